@@ -1,30 +1,41 @@
 import streamlit as st
-import pandas as pd
-import openai
-import time
-from io import StringIO, BytesIO
-from PyPDF2 import PdfReader
-import docx
+from io import BytesIO
 import json
 import os
-from dotenv import load_dotenv
-from openai.error import APIError, RateLimitError
+import findings
+import metrics
+import router
+import parse_cache
+import scheduler
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+@st.cache_resource
+def get_openai():
+    """Imports and configures the OpenAI SDK once per process instead of on every rerun."""
+    from dotenv import load_dotenv
+    import openai
+
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+# Bump when read_uploaded_file output changes so cached parses are invalidated.
+PARSER_VERSION = "STA.read_uploaded_file/3"
 
 def read_uploaded_file(uploaded_file):
     """Reads the uploaded file and extracts its content."""
     content = ""
     if uploaded_file.name.endswith(".txt"):
-        content = StringIO(uploaded_file.getvalue().decode("utf-8")).read()
+        # Decoded straight from the upload's buffer, without getvalue()'s bytes copy or a StringIO round trip.
+        with uploaded_file.getbuffer() as view:
+            content = str(view, "utf-8")
     elif uploaded_file.name.endswith(".pdf"):
-        pdf_reader = PdfReader(uploaded_file)
-        content = " ".join([page.extract_text() for page in pdf_reader.pages if page.extract_text()])
+        import pdf_normalize
+        content = pdf_normalize.read_pdf_text(uploaded_file, document=uploaded_file.name)
     elif uploaded_file.name.endswith(".docx"):
-        doc = docx.Document(uploaded_file)
-        content = " ".join([p.text for p in doc.paragraphs])
+        import docx_stream
+        content = docx_stream.read_docx_text(uploaded_file)
     elif uploaded_file.name.endswith(".xlsx"):
+        import pandas as pd
         df = pd.read_excel(uploaded_file)
         content_lines = []
         for row_idx, row in df.iterrows():
@@ -38,9 +49,11 @@ def read_uploaded_file(uploaded_file):
         st.error("Unsupported file format!")
     return content
 
-def analyze_text_with_gpt(text, retries=3, delay=5):
-    """Analyzes the complete text using GPT without chunking."""
-    prompt = f"""
+MAX_OUTPUT_TOKENS = 16000
+
+def build_prompt(text):
+    """Builds the error-detection prompt for the whole document."""
+    return f"""
 **You are an expert insurance document reviewer powered by advanced AI capabilities. Your task is to carefully analyze insurance-related documents and detect a wide range of possible errors, including typographical mistakes, inconsistencies, and domain-specific issues.**
 
 Please perform the following checks on the document:
@@ -69,7 +82,7 @@ Please perform the following checks on the document:
   - `Line_Number`: Line number of the error. This should be more precise.
   - `Page_Number`: Give the page number of the error.
   - `Error_Type`: Type of error.
-  - `Error_description`: Clear, detailed description of the issue.
+  - `Error_Description`: Clear, detailed description of the issue.
   - `Suggestions`: Recommended correction or improvement.
 
 - Always output a **single JSON object** with one key `"errors"` containing a **list of error objects** — even if there is only one error.
@@ -321,41 +334,51 @@ Please perform the following checks on the document:
 {text}
     """
 
-    for attempt in range(retries):
-        try:
+def analyze_text_with_gpt(text, retries=3, delay=5, document=None):
+    """Analyzes the complete text using GPT without chunking, spreading calls over the configured OpenAI keys."""
+    openai = get_openai()
+    prompt = build_prompt(text)
+
+    def complete(endpoint):
+        with metrics.stage("api_call", document=document):
             response = openai.ChatCompletion.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a highly advanced AI designed to analyze insurance-related documents and detect errors. Your primary task is to identify and categorize errors, then generate a detailed report."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=16000,
-                temperature=0.2
+                max_tokens=MAX_OUTPUT_TOKENS,
+                temperature=0.2,
+                api_key=endpoint.api_key,
             )
+        metrics.record_openai_usage(response, "gpt-4o-mini", document=document)
+        return response.choices[0]['message']['content']
 
-            raw_content = response.choices[0]['message']['content']
+    def warn_retry(endpoint, error):
+        st.warning(f"⚠️ {endpoint.label}: {error}. Retrying...")
+        metrics.record_retry("api_call")
 
-            if raw_content.startswith("```json"):
-                raw_content = raw_content.replace("```json", "").replace("```", "").strip()
+    try:
+        raw_content = router.shared_router().call(complete, ("openai",), attempts=retries, cooldown=delay,
+                                                  on_retry=warn_retry)
+    except router.RouterExhausted as e:
+        st.error(f"❌ {document} could not be analyzed: {e}")
+        return []
 
-            parsed = json.loads(raw_content)
-            return parsed.get("errors", [])
-        except json.JSONDecodeError:
-            st.error("❌ Failed to parse JSON from GPT response.")
-            return []
-        except (APIError, RateLimitError):
-            st.warning("⚠️ API or rate limit error encountered. Retrying...")
-            time.sleep(delay)
-        except Exception as e:
-            st.error(f"❌ Unexpected error: {str(e)}")
-            return []
+    if raw_content.startswith("```json"):
+        raw_content = raw_content.replace("```json", "").replace("```", "").strip()
 
-    return []
+    try:
+        return findings.decode_findings(raw_content)
+    except json.JSONDecodeError:
+        st.error("❌ Failed to parse JSON from GPT response.")
+        return []
 
 def export_errors_to_excel(errors, file_name="Analysis_Report.xlsx"):
     """Exports detected errors to an Excel file."""
+    import pandas as pd
     try:
-        df = pd.DataFrame(errors)
+        df = pd.DataFrame(findings.as_dicts(errors))
         output = BytesIO()
         df.to_excel(output, index=False, engine="openpyxl")
         return output.getvalue()
@@ -363,6 +386,11 @@ def export_errors_to_excel(errors, file_name="Analysis_Report.xlsx"):
         st.error(f"Failed to export errors: {str(e)}")
         return None
 
+@st.cache_resource
+def start_metrics_server():
+    """Starts the Prometheus /metrics endpoint once per process when METRICS_PORT is set."""
+    return metrics.start_metrics_server()
+
 def main():
     st.title("🛡 Insurance Document Error Detector")
     st.write("Upload your insurance documents to detect errors like typographical issues, name inconsistencies, date errors, and more.")
@@ -373,30 +401,45 @@ def main():
         accept_multiple_files=True
     )
 
+    start_metrics_server()
+    profile_enabled = st.sidebar.checkbox("Profile this run (cProfile + tracemalloc)")
+
     if st.button("🚀 Detect Errors"):
         if not uploaded_files:
             st.error("Please upload at least one file!")
         else:
-            all_errors = []
-            for uploaded_file in uploaded_files:
-                file_content = read_uploaded_file(uploaded_file)
-                if not file_content:
-                    continue
-
-                st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
-                errors = analyze_text_with_gpt(file_content)
-                all_errors.extend(errors)
-
-            if all_errors:
-                st.success("✅ Analysis completed!")
-                excel_file = export_errors_to_excel(all_errors)
-                if excel_file:
-                    st.download_button(
-                        label="📥 Download Error Report",
-                        data=excel_file,
-                        file_name="Analysis_Report.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+            with metrics.track_run() as run, metrics.profile_run(profile_enabled):
+                st.session_state["run_metrics"] = run
+                all_errors = []
+                owner = scheduler.session_owner(st.session_state)
+                for uploaded_file in sorted(uploaded_files, key=lambda f: f.size):
+                    with metrics.stage("read_uploaded_file", document=uploaded_file.name):
+                        file_content = parse_cache.cached_read(
+                            uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+                        )
+                    if not file_content:
+                        continue
+
+                    st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
+                    with scheduler.job(owner, size=len(file_content)):
+                        errors = analyze_text_with_gpt(file_content, document=uploaded_file.name)
+                    all_errors.extend(errors)
+
+                metrics.record_metadata("API endpoints", router.shared_router().health())
+
+                if all_errors:
+                    st.success("✅ Analysis completed!")
+                    with metrics.stage("export_errors_to_excel"):
+                        excel_file = export_errors_to_excel(all_errors)
+                    if excel_file:
+                        st.download_button(
+                            label="📥 Download Error Report",
+                            data=excel_file,
+                            file_name="Analysis_Report.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+
+    metrics.render_sidebar(st, st.session_state.get("run_metrics"))
 
 if __name__ == "__main__":
     main()
@@ -1,47 +1,80 @@
 import streamlit as st
-import pandas as pd
-import openai
 import time
-from io import StringIO, BytesIO
-from PyPDF2 import PdfReader
-import docx
+from io import BytesIO
 import json
 import os
-from dotenv import load_dotenv
-from openai.error import APIError, RateLimitError
-
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+import boilerplate
+import cascade
+import cdc
+import compact_output
+import findings
+import findings_view
+import job_queue
+import metrics
+import typo_check
+import parse_cache
+import preflight
+import router
+import scheduler
+import strategy
+
+@st.cache_resource
+def get_openai():
+    """Imports and configures the OpenAI SDK once per process instead of on every rerun."""
+    from dotenv import load_dotenv
+    import openai
+
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+# Bump when read_uploaded_file output changes so cached parses are invalidated.
+PARSER_VERSION = "STAA.read_uploaded_file/3"
 
 def read_uploaded_file(uploaded_file):
     """Reads the uploaded file and extracts its content with line references."""
     content = ""
     if uploaded_file.name.endswith(".txt"):
-        content = StringIO(uploaded_file.getvalue().decode("utf-8")).read()
+        # Decoded straight from the upload's buffer, without getvalue()'s bytes copy or a StringIO round trip.
+        with uploaded_file.getbuffer() as view:
+            content = str(view, "utf-8")
     elif uploaded_file.name.endswith(".pdf"):
-        pdf_reader = PdfReader(uploaded_file)
-        content = " ".join([page.extract_text() for page in pdf_reader.pages if page.extract_text()])
+        import pdf_normalize
+        content = pdf_normalize.read_pdf_text(uploaded_file, document=uploaded_file.name)
     elif uploaded_file.name.endswith(".docx"):
-        doc = docx.Document(uploaded_file)
-        content = " ".join([p.text for p in doc.paragraphs])
+        import docx_stream
+        content = docx_stream.read_docx_text(uploaded_file)
     elif uploaded_file.name.endswith(".xlsx"):
+        import pandas as pd
         df = pd.read_excel(uploaded_file)
         content = df.to_string(index=False)
     else:
         st.error("Unsupported file format!")
     return content
 
+SPELLING_NOTE = """**Note:** Spelling mistakes are detected separately by a local checker. Do not report misspelled words; under Typographical Errors report only grammar and punctuation issues.
+
+"""
+
+# Output token limits per model; gpt-4 has an 8k context shared with the prompt.
+MAX_OUTPUT_TOKENS = {"gpt-4o-mini": 8000, "gpt-4": 2000}
+# Models that accept response_format={"type": "json_object"}.
+JSON_MODE_MODELS = ("gpt-4o-mini", "gpt-4o")
+
+# Bump when build_prompt changes so cached chunk findings are invalidated.
+PROMPT_VERSION = "STAA/2"
+
 def chunk_text(text, chunk_size=8000):
     """Splits text into smaller chunks to stay within token limits."""
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
-def analyze_text_with_gpt(text, retries=3, delay=5):
-    """Uses GPT-4o Mini to extract errors from document content with retry handling."""
-    chunks = chunk_text(text)
-    analysis_reports = []
-
-    for i, chunk in enumerate(chunks):
-        prompt = f"""
+def build_prompt(chunk, local_spelling=False, compact=False, output_format="json"):
+    """
+    Builds the error-detection prompt for one chunk; compact keeps a single example finding and
+    output_format="table" asks for the compact_output table instead of verbose JSON objects.
+    """
+    spelling_note = SPELLING_NOTE if local_spelling else ""
+    prompt = f"""
 **You are an expert insurance document reviewer powered by advanced AI capabilities. Your task is to carefully analyze insurance-related documents and detect a wide range of possible errors, including typographical mistakes, inconsistencies, and domain-specific issues.**
 
 Please perform the following checks on the document:
@@ -70,7 +103,7 @@ Please perform the following checks on the document:
   - `Line_Number`: Line number of the error. This should be more precise.
   - `Page_Number`: Give the page number of the error.
   - `Error_Type`: Type of error.
-  - `Error_description`: Clear, detailed description of the issue.
+  - `Error_Description`: Clear, detailed description of the issue.
   - `Suggestions`: Recommended correction or improvement.
 
 - Always output a **single JSON object** with one key `"errors"` containing a **list of error objects** — even if there is only one error.
@@ -323,70 +356,329 @@ Please perform the following checks on the document:
     ```
 
 
-**Input document:**
+{spelling_note}**Input document:**
 
 {chunk}
         """
-
-        for attempt in range(retries):
-            try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a highly advanced AI designed to analyze insurance-related documents and detect errors. Your primary task is to identify and categorize errors, then generate a detailed report"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=8000,
-                    temperature=0.2
-                )
-
-                raw_content = response.choices[0]['message']['content']
-
-                if raw_content.startswith("```json"):
-                    raw_content = raw_content.replace("```json", "").replace("```", "").strip()
-
-                parsed = json.loads(raw_content)
-                errors = parsed.get("errors", [])
-                analysis_reports.extend(errors)
-                break  # Success
-
-            except json.JSONDecodeError:
-                st.error("❌ Failed to parse JSON from GPT response.")
-                st.code(raw_content)
-                with open("gpt_raw_output_error.json", "w", encoding="utf-8") as f:
-                    f.write(raw_content)
+    if output_format == "table":
+        return compact_output.apply_to_prompt(prompt)
+    return preflight.compact_prompt(prompt) if compact else prompt
+
+def complete_with_openai(endpoint, prompt, model="gpt-4o-mini", document=None, chunk_index=None):
+    """Sends a prompt to an OpenAI chat model (in JSON mode where supported) with the router endpoint's API key."""
+    openai = get_openai()
+    with metrics.stage("api_call", document=document, chunk=chunk_index):
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a highly advanced AI designed to analyze insurance-related documents and detect errors. Your primary task is to identify and categorize errors, then generate a detailed report"},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=MAX_OUTPUT_TOKENS.get(model, 8000),
+            temperature=0.2,
+            api_key=endpoint.api_key,
+            **({"response_format": {"type": "json_object"}} if model in JSON_MODE_MODELS else {}),
+        )
+    metrics.record_openai_usage(response, model, document=document, chunk=chunk_index)
+    return response.choices[0]['message']['content']
+
+def warn_retry(endpoint, error):
+    """Router callback: reports a failed call before it is retried on the next healthiest endpoint."""
+    st.warning(f"⚠️ {endpoint.label}: {error}. Retrying on the healthiest endpoint...")
+    metrics.record_retry("api_call")
+
+def analyze_chunk_with_gpt(chunk, retries=3, delay=5, document=None, chunk_index=None, local_spelling=False,
+                           model="gpt-4o-mini", failover=False, compact_prompt=False, output_format="json"):
+    """
+    Sends one chunk to GPT-4o Mini (or model) through the key router. Returns its errors, or None if no valid response was obtained.
+    With failover, the router may also use Gemini 1.5 Pro when every OpenAI key is failing or rate-limited.
+    Returns None without calling the model once the run's budget is spent.
+    """
+    if not preflight.within_budget():
+        return None
+    prompt = build_prompt(chunk, local_spelling, compact_prompt, output_format)
+
+    def complete(endpoint):
+        if endpoint.provider == "gemini":
+            import STAG
+            return STAG.generate_with_gemini(endpoint, prompt, document, chunk_index)
+        return complete_with_openai(endpoint, prompt, model, document, chunk_index)
+
+    providers = ("openai", "gemini") if failover else ("openai",)
+    try:
+        raw_content = router.shared_router().call(complete, providers, attempts=retries, cooldown=delay,
+                                                  on_retry=warn_retry)
+    except router.RouterExhausted as e:
+        st.error(f"❌ Chunk {chunk_index} of {document} could not be analyzed: {e}")
+        metrics.record_metadata(f"{document}: chunk {chunk_index} failed", str(e))
+        return None
+
+    raw_content = raw_content.strip()
+    if raw_content.startswith("```json"):
+        raw_content = raw_content.replace("```json", "").replace("```", "").strip()
+
+    try:
+        decoded = findings.decode_findings(raw_content)
+    except json.JSONDecodeError:
+        st.error("❌ Failed to parse JSON from GPT response.")
+        st.code(raw_content)
+        with open("gpt_raw_output_error.json", "w", encoding="utf-8") as f:
+            f.write(raw_content)
+        return None
+    return decoded
+
+def analyze_chunk_with_strong_model(chunk, backend, retries=3, delay=5, document=None, chunk_index=None,
+                                    local_spelling=False, compact_prompt=False, output_format="json"):
+    """
+    Re-analyzes an escalated chunk with the cascade's strong backend (gpt-4 or gemini-1.5-pro).
+    Chunks too large for gpt-4's 8k context are sent with the compact prompt and, if still too large,
+    in line-aligned pieces. Returns None (and records it) when the strong model gave no valid response.
+    """
+    if backend == "gemini-1.5-pro":
+        import STAG
+        errors = STAG.analyze_chunk_with_gemini(chunk, retries, delay, document, chunk_index, local_spelling,
+                                                compact_prompt=compact_prompt, output_format=output_format)
+    else:
+        errors = []
+        compact_prompt, pieces = fit_to_context(chunk, backend, local_spelling, compact_prompt, output_format)
+        for line_offset, piece in pieces:
+            piece_errors = analyze_chunk_with_gpt(piece, retries, delay, document, chunk_index, local_spelling,
+                                                  model=backend, compact_prompt=compact_prompt, output_format=output_format)
+            if piece_errors is None:
+                errors = None
                 break
-
-            except APIError as e:
-                st.warning(f"⚠️ API Error on attempt {attempt + 1}: {e}")
-                time.sleep(delay)
-
-            except RateLimitError:
-                st.warning("🚫 Rate limit exceeded. Retrying after delay...")
-                time.sleep(delay)
+            errors.extend(cdc.shift_line_numbers(piece_errors, line_offset))
+    if errors is None:
+        metrics.record_metadata(f"{document}: chunk {chunk_index} escalation failed",
+                                f"no valid {backend} response; cheap-model findings kept")
+    return errors
+
+def fit_to_context(chunk, model, local_spelling=False, compact_prompt=False, output_format="json"):
+    """
+    Returns (compact_prompt, [(line offset, piece), ...]) such that each piece's prompt plus the
+    model's max_tokens fits its context window (strategy.MODEL_LIMITS).
+    """
+    budget = strategy.MODEL_LIMITS[model]["context"] - MAX_OUTPUT_TOKENS.get(model, 8000)
+    def prompt_tokens(text, compact):
+        return strategy.count_tokens(build_prompt(text, local_spelling, compact, output_format), model)
+    if prompt_tokens(chunk, compact_prompt) <= budget:
+        return compact_prompt, [(0, chunk)]
+    if prompt_tokens(chunk, True) <= budget:
+        return True, [(0, chunk)]
+    text_budget = budget - prompt_tokens("", True)
+    pieces = []
+    lines = []
+    tokens = 0
+    start = 0
+    for number, line in enumerate(chunk.split("\n")):
+        line_tokens = strategy.count_tokens(line + "\n", model)
+        if lines and tokens + line_tokens > text_budget:
+            pieces.append((start, "\n".join(lines)))
+            lines, tokens, start = [], 0, number
+        lines.append(line)
+        tokens += line_tokens
+    pieces.append((start, "\n".join(lines)))
+    return True, pieces
+
+def analyze_text_with_gpt(text, retries=3, delay=5, document=None, chunk_cache=None, local_spelling=False,
+                          strong_backend=None, chunk_size=8000, failover=False, compact_prompt=False,
+                          output_format="json", failed=None):
+    """
+    Uses GPT-4o Mini to extract errors from document content with retry handling.
+    With a chunk_cache, chunk boundaries are content-defined and chunks analyzed before
+    (e.g. unchanged regions of a revised document) reuse their findings instead of calling the model.
+    With local_spelling, the prompt leaves spelling to typo_check.
+    With strong_backend, chunks that trip cascade.escalation_reasons are re-analyzed by that model and merged.
+    With failover, chunks may be answered by Gemini when no OpenAI key is usable.
+    With compact_prompt, the prompt carries a single example finding (used to fit a budget).
+    With output_format="table", the model answers in the compact_output table format.
+    With a failed list, the indexes of chunks left without findings (no valid response, or over budget) are appended.
+    """
+    prompt_version = PROMPT_VERSION + ("+local-spelling" if local_spelling else "") + ("+compact" if compact_prompt else "")
+    prompt_version += "+table" if output_format == "table" else ""
+    cache_model = f"gpt-4o-mini>{strong_backend}" if strong_backend else "gpt-4o-mini"
+    with metrics.stage("chunk_text", document=document):
+        if chunk_cache is None:
+            chunks = list(zip(range(0, len(text), chunk_size), chunk_text(text, chunk_size)))
+        else:
+            chunks = cdc.content_defined_chunks(text, chunk_size // 2, chunk_size, chunk_size * 3 // 2)
+    analysis_reports = []
+    reused = 0
+    escalated = 0
+    line_offset = 0
+    previous_offset = 0
+
+    for i, (offset, chunk) in enumerate(chunks):
+        # Chunk findings are numbered from the chunk's first line; shift them to document lines.
+        line_offset += text.count("\n", previous_offset, offset)
+        previous_offset = offset
+
+        if chunk_cache is not None:
+            key = chunk_cache.key(chunk, cache_model, prompt_version)
+            errors = chunk_cache.get(key)
+            if errors is not None:
+                reused += 1
+                analysis_reports.extend(cdc.shift_line_numbers(errors, line_offset))
                 continue
-
-            except Exception as e:
-                st.error(f"❌ Unexpected error: {str(e)}")
-                break
+        if not preflight.within_budget():
+            if failed is not None:
+                failed.append(i)
+            continue  # Budget spent: only cached chunks are still reported.
+
+        errors = analyze_chunk_with_gpt(chunk, retries, delay, document, i, local_spelling, failover=failover,
+                                        compact_prompt=compact_prompt, output_format=output_format)
+        if strong_backend:
+            reasons = cascade.escalation_reasons(chunk, errors)
+            if reasons:
+                escalated += 1
+                metrics.record_metadata(f"{document}: chunk {i} escalated", "; ".join(reasons))
+                strong = analyze_chunk_with_strong_model(chunk, strong_backend, retries, delay, document, i, local_spelling,
+                                                         compact_prompt, output_format)
+                if strong is not None:
+                    errors = cascade.merge_findings(errors, strong)
+        if errors is not None:
+            if chunk_cache is not None:
+                chunk_cache.put(key, errors)
+            analysis_reports.extend(cdc.shift_line_numbers(errors, line_offset))
+        elif failed is not None:
+            failed.append(i)
 
         time.sleep(1)  # Optional: small pause between chunks
 
+    if chunk_cache is not None:
+        metrics.record_metadata(f"{document}: reused chunks", f"{reused}/{len(chunks)}")
+    if strong_backend:
+        metrics.record_metadata(f"{document}: escalated chunks", f"{escalated}/{len(chunks) - reused}")
     return analysis_reports
 
 def output_preprocessing(row: dict):
-    return row["Line_Number"], row["Error_Type"], row["Error_description"], row["Suggestions"]
+    finding = findings.coerce(row)
+    return finding.Line_Number, finding.Error_Type, finding.Error_Description, finding.Suggestions
 
 def export_errors_to_excel(errors, file_name="Analysis_Report.xlsx"):
     """Saves detected errors in an Excel file."""
-    df = pd.DataFrame(errors)
-    df_exploded = df.explode('Error Description').reset_index(drop=True)
-    error_expanded = pd.json_normalize(df_exploded['Error Description'])
-    df_final = pd.concat([df_exploded.drop(columns=['Error Description']), error_expanded], axis=1)
+    import pandas as pd
+    df_final = pd.DataFrame(findings.report_rows(errors))
     output = BytesIO()
     df_final.to_excel(output, index=False, engine="openpyxl")
     return output.getvalue()
 
+def analyze_document(file_content, document=None, chunk_cache=None, skip_boilerplate=False, local_spelling=False,
+                     strong_backend=None, failover=False, compact_prompt=False, output_format="json"):
+    """Runs the full analysis of one document: boilerplate stripping, GPT-4o Mini chunk analysis and local spelling."""
+    def analyze(text, failed=None):
+        return analyze_text_with_gpt(text, document=document, chunk_cache=chunk_cache, local_spelling=local_spelling,
+                                     strong_backend=strong_backend, failover=failover, compact_prompt=compact_prompt,
+                                     output_format=output_format, failed=failed)
+
+    if skip_boilerplate:
+        errors = boilerplate.analyze_without_boilerplate(file_content, analyze, get_boilerplate_index(), document=document)
+    else:
+        errors = analyze(file_content)
+    if local_spelling:
+        with metrics.stage("typo_check", document=document):
+            errors = typo_check.find_typos(file_content, get_typo_index()) + errors
+    return errors
+
+@st.cache_resource
+def get_boilerplate_index():
+    """Opens the shared paragraph-fingerprint index (BOILERPLATE_DB) once per process."""
+    return boilerplate.BoilerplateIndex()
+
+@st.cache_resource
+def get_typo_index():
+    """Loads the precomputed SymSpell index once per process."""
+    return typo_check.load_index()
+
+def estimate_document(file_content, history=None, local_spelling=False, strong_backend=None, compact_prompt=False,
+                      output_format="json", chunk_size=8000):
+    """Pre-flight estimate of one document's calls, tokens, cost and time under the given settings."""
+    prompt_tokens = strategy.count_tokens(build_prompt("", local_spelling, compact_prompt, output_format))
+    plan = preflight.chunk_plan(file_content, "gpt-4o-mini", prompt_tokens, chunk_size)
+    escalation = (strong_backend, preflight.CASCADE_ESCALATION_RATE) if strong_backend else None
+    output_scale = compact_output.OUTPUT_TOKEN_SCALE if output_format == "table" else 1.0
+    # analyze_text_with_gpt pauses one second between chunks.
+    return preflight.estimate_plan(plan, history, pause_seconds=1.0, escalation=escalation, output_scale=output_scale)
+
+def budget_options(local_spelling=False, strong_backend=None, output_format="json"):
+    """Settings tried in order when a run does not fit its budget: as configured, then progressively cheaper."""
+    def settings(compact_prompt, strong, fmt):
+        return {"local_spelling": local_spelling, "strong_backend": strong, "compact_prompt": compact_prompt,
+                "output_format": fmt}
+
+    options = [
+        ("the configured settings", settings(False, strong_backend, output_format)),
+        ("a compact prompt", settings(True, strong_backend, output_format)),
+    ]
+    if output_format != "table":
+        options.append(("the compact table format", settings(True, strong_backend, "table")))
+    if strong_backend:
+        options.append(("the compact table format without the cascade", settings(True, None, "table")))
+    return options
+
+# How often the page reruns to pick up background worker progress.
+WORKER_POLL_SECONDS = 2
+WORKER_UNSUPPORTED = "Not applied when chunks run on background workers."
+
+@st.cache_resource
+def get_job_queue():
+    """Opens the job queue (JOB_QUEUE_URL / JOB_QUEUE_BACKEND) once per process."""
+    return job_queue.open_queue()
+
+def submit_document_to_workers(file_content, document, content_defined=False, local_spelling=False, strong_backend=None,
+                               chunk_size=8000, failover=False, compact_prompt=False, output_format="json", owner="anonymous"):
+    """Queues one chunk job per chunk for `python worker.py` processes and returns the batch id."""
+    with metrics.stage("chunk_text", document=document):
+        if content_defined:
+            chunks = cdc.content_defined_chunks(file_content, chunk_size // 2, chunk_size, chunk_size * 3 // 2)
+        else:
+            chunks = list(zip(range(0, len(file_content), chunk_size), chunk_text(file_content, chunk_size)))
+    metrics.record_metadata(f"{document}: queued chunks", len(chunks))
+    return job_queue.submit_document(get_job_queue(), "STAA", document, file_content, chunks, {
+        "local_spelling": local_spelling,
+        "failover": failover,
+        "compact_prompt": compact_prompt,
+        "output_format": output_format,
+        "strong_backend": strong_backend,
+    }, owner=owner)
+
+def collect_worker_results():
+    """
+    Checks the run's queued batches once (st.session_state["worker_batches"]). While workers are busy
+    it shows their progress and main() reruns the script after WORKER_POLL_SECONDS, so the page stays
+    responsive; once they are done, their findings go to the viewer and the Excel report.
+    """
+    pending = st.session_state["worker_batches"]
+    queued = pending["queued"]
+    fraction, results = job_queue.poll_batches(get_job_queue(), [batch for _, _, batch in queued], pending["submitted"])
+    if results is None:
+        st.progress(fraction, text=f"⏳ Background workers: {fraction:.0%} of chunks analyzed")
+        return
+    del st.session_state["worker_batches"]
+    viewer = st.session_state["findings_view"]
+    all_errors = pending["all_errors"]
+    with metrics.track_run(st.session_state.get("run_metrics")):
+        for document, file_content, batch in queued:
+            found, errors = results[batch]
+            for error in errors:
+                st.error(f"❌ {document}: {error}")
+            if pending["local_spelling"]:
+                with metrics.stage("typo_check", document=document):
+                    found = typo_check.find_typos(file_content, get_typo_index()) + found
+            viewer.add(document, found)
+            all_errors.append({
+                "Document Name": document,
+                "Error Description": found,
+            })
+        st.success("✅ Analysis completed!")
+        with metrics.stage("export_errors_to_excel"):
+            st.session_state["excel_report"] = export_errors_to_excel(all_errors)
+
+@st.cache_resource
+def start_metrics_server():
+    """Starts the Prometheus /metrics endpoint once per process when METRICS_PORT is set."""
+    return metrics.start_metrics_server()
+
 def main():
     st.title("🛡 Insurance Document Error Detector")
     st.write("Upload your insurance documents to detect errors like typographical issues, name inconsistencies, date errors, and more.")
@@ -397,38 +689,163 @@ def main():
         accept_multiple_files=True
     )
 
+    start_metrics_server()
+    profile_enabled = st.sidebar.checkbox("Profile this run (cProfile + tracemalloc)")
+    use_workers = st.sidebar.checkbox(
+        "Run on background workers (job queue)",
+        help="Chunks are queued for `python worker.py` processes instead of being analyzed in this session.",
+    )
+    on_workers = use_workers
+    # Workers analyze single chunks: the chunk cache, boilerplate stripping and run budgets only apply in-session.
+    reuse_chunks = st.sidebar.checkbox("Reuse findings for revised documents (content-defined chunking)",
+                                       value=not on_workers, disabled=on_workers, help=WORKER_UNSUPPORTED) and not on_workers
+    skip_boilerplate = st.sidebar.checkbox("Skip standard wording with known findings (boilerplate cache)",
+                                           disabled=on_workers, help=WORKER_UNSUPPORTED) and not on_workers
+    local_spelling = st.sidebar.checkbox(
+        "Check spelling locally instead of in the prompt",
+        disabled=not typo_check.has_full_dictionary(),
+        help="Needs a general word list (TYPO_DICTIONARY, default /usr/share/dict/words); without one the model checks spelling.",
+    )
+    failover = st.sidebar.checkbox(
+        "Fail over to Gemini when every key is failing",
+        help="Calls are spread over all keys in OPENAI_API_KEYS; this also allows the GOOGLE_API_KEYS keys.",
+    )
+    cascade_choice = st.sidebar.selectbox(
+        "Cascade: escalate suspicious chunks to",
+        ["Off", "gemini-1.5-pro", "gpt-4"],
+        help="Every chunk runs on gpt-4o-mini first; chunks with many findings, dense amounts/dates or parse failures are re-analyzed by the stronger model.",
+    )
+    output_format = st.sidebar.selectbox(
+        "Response format",
+        ["json", "table"],
+        format_func={"json": "Verbose JSON", "table": "Compact table (fewer output tokens)"}.get,
+    )
+
+    run_budget = st.sidebar.number_input("Run budget ($, 0 = unlimited)", min_value=0.0, value=preflight.RUN_BUDGET_USD,
+                                         disabled=on_workers, help=WORKER_UNSUPPORTED)
+    time_budget = st.sidebar.number_input("Time budget (minutes, 0 = unlimited)", min_value=0.0,
+                                          value=preflight.RUN_BUDGET_MINUTES, disabled=on_workers, help=WORKER_UNSUPPORTED)
+    if on_workers:
+        run_budget = time_budget = 0.0
+    budget = preflight.Budget(run_budget, time_budget, preflight.SESSION_BUDGET_USD, st.session_state.get("spent_usd", 0.0))
+
     error_summary_placeholder = st.empty()
 
+    # Pre-flight: parse (cached for the run below) and estimate before anything is sent to a model.
+    chosen = None
+    if uploaded_files:
+        documents = []
+        for uploaded_file in uploaded_files:
+            file_content = parse_cache.cached_read(
+                uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+            )
+            if file_content:
+                documents.append((uploaded_file.name, file_content))
+        configured, chosen, reasons = preflight.plan_run(
+            documents, budget_options(local_spelling, None if cascade_choice == "Off" else cascade_choice, output_format), budget, estimate_document, preflight.load_history()
+        )
+        preflight.render_estimate(st, configured, chosen, reasons)
+
     if st.button("🚀 Detect Errors"):
         if not uploaded_files:
             st.error("Please upload at least one file!")
+        elif chosen is None:
+            st.error("Raise the budget or upload fewer documents to run the analysis.")
         else:
-            all_errors = []
-            for uploaded_file in uploaded_files:
-                file_content = read_uploaded_file(uploaded_file)
-                if not file_content:
-                    continue
-
-                st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
-                analysis_report = analyze_text_with_gpt(file_content)
-
-                error_summary_placeholder.write(f"### ❗ Errors in `{uploaded_file.name}`")
-                error_summary_placeholder.write(analysis_report)
-
-                all_errors.append({
-                    "Document Name": uploaded_file.name,
-                    "Error Description": analysis_report,
-                })
-
-            if all_errors:
-                st.success("✅ Analysis completed!")
-                excel_file = export_errors_to_excel(all_errors)
-                st.download_button(
-                    label="📥 Download Error Report",
-                    data=excel_file,
-                    file_name="Analysis_Report.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            settings = chosen[1]
+            with metrics.track_run() as run, metrics.profile_run(profile_enabled), preflight.enforce(budget):
+                st.session_state["run_metrics"] = run
+                viewer = st.session_state["findings_view"] = findings_view.FindingsTable()
+                st.session_state["excel_report"] = None
+                for _, _, batch in st.session_state.pop("worker_batches", {}).get("queued", []):
+                    get_job_queue().cancel_batch(batch, "superseded by a new run")
+                all_errors = []
+                queued = []
+                owner = scheduler.session_owner(st.session_state)
+                # Shortest job first: small documents are analyzed (and shown) before long ones.
+                for uploaded_file in sorted(uploaded_files, key=lambda f: f.size):
+                    with metrics.stage("read_uploaded_file", document=uploaded_file.name):
+                        file_content = parse_cache.cached_read(
+                            uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+                        )
+                    if not file_content:
+                        continue
+
+                    if use_workers:
+                        st.write(f"📨 Queuing **{uploaded_file.name}** for background workers...")
+                        batch = submit_document_to_workers(
+                            file_content,
+                            uploaded_file.name,
+                            content_defined=reuse_chunks,
+                            local_spelling=local_spelling,
+                            strong_backend=settings["strong_backend"],
+                            failover=failover,
+                            compact_prompt=settings["compact_prompt"],
+                            output_format=settings["output_format"],
+                            owner=owner,
+                        )
+                        queued.append((uploaded_file.name, file_content, batch))
+                        continue
+
+                    st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
+                    chunk_cache = cdc.session_chunk_cache(st.session_state) if reuse_chunks else None
+                    with scheduler.job(owner, size=len(file_content)):
+                        analysis_report = analyze_document(
+                            file_content,
+                            document=uploaded_file.name,
+                            chunk_cache=chunk_cache,
+                            skip_boilerplate=skip_boilerplate,
+                            local_spelling=local_spelling,
+                            strong_backend=settings["strong_backend"],
+                            failover=failover,
+                            compact_prompt=settings["compact_prompt"],
+                            output_format=settings["output_format"],
+                        )
+
+                    viewer.add(uploaded_file.name, analysis_report)
+                    error_summary_placeholder.dataframe(viewer.summary(), hide_index=True)
+
+                    all_errors.append({
+                        "Document Name": uploaded_file.name,
+                        "Error Description": analysis_report,
+                    })
+
+                if queued:
+                    # Collected on the following reruns (collect_worker_results) instead of blocking this one.
+                    st.session_state["worker_batches"] = {
+                        "queued": queued,
+                        "submitted": time.time(),
+                        "all_errors": all_errors,
+                        "local_spelling": local_spelling,
+                    }
+                error_summary_placeholder.empty()  # The viewer below shows the final summary.
+
+                metrics.record_metadata("API endpoints", router.shared_router().health())
+                st.session_state["spent_usd"] = budget.spent_usd + run.total_cost()
+                preflight.update_history(run)
+                if budget.stopped:
+                    st.warning(f"💸 Budget reached ({budget.stopped}); the remaining chunks were not analyzed.")
+
+                if all_errors and not queued:
+                    st.success("✅ Analysis completed!")
+                    with metrics.stage("export_errors_to_excel"):
+                        st.session_state["excel_report"] = export_errors_to_excel(all_errors)
+
+    if st.session_state.get("worker_batches"):
+        collect_worker_results()
+    # Kept in the session so the report stays downloadable while the viewer reruns the script.
+    if st.session_state.get("excel_report"):
+        st.download_button(
+            label="📥 Download Error Report",
+            data=st.session_state["excel_report"],
+            file_name="Analysis_Report.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    findings_view.render(st, st.session_state.get("findings_view"))
+    metrics.render_sidebar(st, st.session_state.get("run_metrics"))
+    if st.session_state.get("worker_batches"):
+        time.sleep(WORKER_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
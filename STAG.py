@@ -1,29 +1,97 @@
 import streamlit as st
-import pandas as pd
-import google.generativeai as genai
 import time
-from io import StringIO, BytesIO
-from PyPDF2 import PdfReader
-import docx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+import contextvars
 import json
 import os
-from dotenv import load_dotenv
+import threading
+import boilerplate
+import cdc
+import compact_output
+import findings
+import findings_view
+import job_queue
+import metrics
+import typo_check
+import parse_cache
+import preflight
+import router
+import scheduler
+import strategy
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+@st.cache_resource
+def get_genai():
+    """Imports the Gemini SDK once per process instead of on every rerun."""
+    import google.generativeai as genai
+
+    return genai
+
+# genai.configure sets a process-wide key: calls on the configured key may run concurrently,
+# and switching to another key waits until they have finished.
+_gemini_key_condition = threading.Condition()
+_gemini_key_state = {"key": None, "active": 0}
+
+@contextmanager
+def gemini_key(genai, api_key):
+    """Makes api_key the configured Gemini key for the duration of the block."""
+    with _gemini_key_condition:
+        while _gemini_key_state["key"] != api_key and _gemini_key_state["active"]:
+            _gemini_key_condition.wait()
+        if _gemini_key_state["key"] != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_key_state["key"] = api_key
+        _gemini_key_state["active"] += 1
+    try:
+        yield
+    finally:
+        with _gemini_key_condition:
+            _gemini_key_state["active"] -= 1
+            _gemini_key_condition.notify_all()
+
+def generate_with_gemini(endpoint, prompt, document=None, chunk_index=None, model_name="gemini-1.5-pro",
+                         cached_content=None):
+    """
+    Sends a prompt to Gemini in JSON mode with the router endpoint's API key and returns the response text.
+    With cached_content (created on the same key), the prompt is answered against the cached document.
+    """
+    genai = get_genai()
+    generation_config = {"response_mime_type": "application/json"}
+    with gemini_key(genai, endpoint.api_key):
+        if cached_content is not None:
+            model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+        else:
+            model = genai.GenerativeModel(model_name, generation_config=generation_config)
+        with metrics.stage("api_call", document=document, chunk=chunk_index):
+            response = model.generate_content(prompt)
+    metrics.record_gemini_usage(response, model_name, document=document, chunk=chunk_index)
+    return response.text
+
+def warn_retry(endpoint, error):
+    """Router callback: reports a failed call before it is retried on the next healthiest endpoint."""
+    st.warning(f"⚠️ {endpoint.label}: {error}. Retrying on the healthiest endpoint...")
+    metrics.record_retry("api_call")
+
+# Bump when read_uploaded_file output changes so cached parses are invalidated.
+PARSER_VERSION = "STAG.read_uploaded_file/3"
 
 def read_uploaded_file(uploaded_file):
     """Reads the uploaded file and extracts its content with line references."""
     content = ""
     if uploaded_file.name.endswith(".txt"):
-        content = StringIO(uploaded_file.getvalue().decode("utf-8")).read()
+        # Decoded straight from the upload's buffer, without getvalue()'s bytes copy or a StringIO round trip.
+        with uploaded_file.getbuffer() as view:
+            content = str(view, "utf-8")
     elif uploaded_file.name.endswith(".pdf"):
-        pdf_reader = PdfReader(uploaded_file)
-        content = " ".join([page.extract_text() for page in pdf_reader.pages if page.extract_text()])
+        import pdf_normalize
+        content = pdf_normalize.read_pdf_text(uploaded_file, document=uploaded_file.name)
     elif uploaded_file.name.endswith(".docx"):
-        doc = docx.Document(uploaded_file)
-        content = " ".join([p.text for p in doc.paragraphs])
+        import docx_stream
+        content = docx_stream.read_docx_text(uploaded_file)
     elif uploaded_file.name.endswith(".xlsx"):
+        import pandas as pd
         df = pd.read_excel(uploaded_file)
         content_lines = []
         for row_idx, row in df.iterrows():
@@ -37,17 +105,21 @@ def read_uploaded_file(uploaded_file):
         st.error("Unsupported file format!")
     return content
 
+SPELLING_NOTE = """**Note:** Spelling mistakes are detected separately by a local checker. Do not report misspelled words; under Typographical Errors report only grammar and punctuation issues.
+
+"""
+
+# Bump when build_prompt changes so cached chunk findings are invalidated.
+PROMPT_VERSION = "STAG/2"
+
 def chunk_text(text, chunk_size=8000):
     """Splits text into smaller chunks to stay within token limits."""
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
-def analyze_text_with_gemini(text, retries=3, delay=5):
-    """Uses Google Gemini 1.5 Pro to extract errors from document content with retry handling."""
-    chunks = chunk_text(text)
-    analysis_reports = []
-
-    for i, chunk in enumerate(chunks):
-        prompt = f"""
+def build_prompt(chunk, local_spelling=False, compact=False, output_format="json"):
+    """Builds the error-detection prompt for one chunk; compact keeps a single example finding."""
+    spelling_note = SPELLING_NOTE if local_spelling else ""
+    prompt = f"""
 **You are an expert insurance document reviewer powered by advanced AI capabilities. Your task is to carefully analyze insurance-related documents and detect a wide range of possible errors, including typographical mistakes, inconsistencies, and domain-specific issues.**
 
 Please perform the following checks on the document:
@@ -62,7 +134,7 @@ Please perform the following checks on the document:
   - `Line_Number`
   - `Page_Number`
   - `Error_Type`
-  - `Error_description`
+  - `Error_Description`
   - `Suggestions`
 
 - Always output a **single JSON object** with one key `"errors"` containing a **list of error objects**.
@@ -180,52 +252,424 @@ Please perform the following checks on the document:
 }}
     ```
 
-**Input document:**
+{spelling_note}**Input document:**
 
 {chunk}
         """
+    if output_format == "table":
+        return compact_output.apply_to_prompt(prompt)
+    return preflight.compact_prompt(prompt) if compact else prompt
+
+def analyze_chunk_with_gemini(chunk, retries=3, delay=5, document=None, chunk_index=None, local_spelling=False,
+                              failover=False, compact_prompt=False, model="gemini-1.5-pro", output_format="json"):
+    """
+    Sends one chunk to Gemini 1.5 Pro (or model) through the key router. Returns its errors, or None if no valid response was obtained.
+    With failover, the router may also use gpt-4o-mini when every Gemini key is failing or rate-limited.
+    Returns None without calling the model once the run's budget is spent.
+    """
+    if not preflight.within_budget():
+        return None
+    prompt = build_prompt(chunk, local_spelling, compact_prompt, output_format)
 
-        for attempt in range(retries):
-            try:
-                model = genai.GenerativeModel('gemini-1.5-pro')
-                response = model.generate_content(prompt)
+    def complete(endpoint):
+        if endpoint.provider == "openai":
+            import STAA
+            return STAA.complete_with_openai(endpoint, prompt, "gpt-4o-mini", document, chunk_index)
+        return generate_with_gemini(endpoint, prompt, document, chunk_index, model)
 
-                raw_content = response.text.strip()
+    providers = ("gemini", "openai") if failover else ("gemini",)
+    try:
+        raw_content = router.shared_router().call(complete, providers, attempts=retries, cooldown=delay,
+                                                  on_retry=warn_retry)
+    except router.RouterExhausted as e:
+        st.error(f"❌ Chunk {chunk_index} of {document} could not be analyzed: {e}")
+        metrics.record_metadata(f"{document}: chunk {chunk_index} failed", str(e))
+        return None
+    return decode_response(raw_content)
 
-                if raw_content.startswith("```json"):
-                    raw_content = raw_content.replace("```json", "").replace("```", "").strip()
+def decode_response(raw_content):
+    """Decodes a Gemini response into findings, or returns None (and saves the response) when it is not valid JSON."""
+    raw_content = raw_content.strip()
+    if raw_content.startswith("```json"):
+        raw_content = raw_content.replace("```json", "").replace("```", "").strip()
 
-                parsed = json.loads(raw_content)
-                errors = parsed.get("errors", [])
-                analysis_reports.extend(errors)
-                break  # Success
+    try:
+        decoded = findings.decode_findings(raw_content)
+    except json.JSONDecodeError:
+        st.error("❌ Failed to parse JSON from Gemini response.")
+        st.code(raw_content)
+        with open("gemini_raw_output_error.json", "w", encoding="utf-8") as f:
+            f.write(raw_content)
+        return None
+    return decoded
 
-            except json.JSONDecodeError:
-                st.error("❌ Failed to parse JSON from Gemini response.")
-                st.code(raw_content)
-                with open("gemini_raw_output_error.json", "w", encoding="utf-8") as f:
-                    f.write(raw_content)
-                break
+def analyze_text_with_gemini(text, retries=3, delay=5, document=None, chunk_cache=None, local_spelling=False,
+                             chunk_size=8000, failover=False, compact_prompt=False, model="gemini-1.5-pro",
+                             output_format="json", failed=None):
+    """
+    Uses Google Gemini 1.5 Pro to extract errors from document content with retry handling.
+    With a chunk_cache, chunk boundaries are content-defined and chunks analyzed before
+    (e.g. unchanged regions of a revised document) reuse their findings instead of calling the model.
+    With local_spelling, the prompt leaves spelling to typo_check.
+    With failover, chunks may be answered by gpt-4o-mini when no Gemini key is usable.
+    With compact_prompt or a cheaper model (e.g. gemini-1.5-flash), the run fits a smaller budget.
+    With output_format="table", the model answers in the compact_output table format.
+    With a failed list, the indexes of chunks left without findings (no valid response, or over budget) are appended.
+    """
+    prompt_version = PROMPT_VERSION + ("+local-spelling" if local_spelling else "") + ("+compact" if compact_prompt else "")
+    prompt_version += "+table" if output_format == "table" else ""
+    with metrics.stage("chunk_text", document=document):
+        if chunk_cache is None:
+            chunks = list(zip(range(0, len(text), chunk_size), chunk_text(text, chunk_size)))
+        else:
+            chunks = cdc.content_defined_chunks(text, chunk_size // 2, chunk_size, chunk_size * 3 // 2)
+    analysis_reports = []
+    reused = 0
+    line_offset = 0
+    previous_offset = 0
 
-            except Exception as e:
-                st.warning(f"⚠️ Error on attempt {attempt + 1}: {e}")
-                time.sleep(delay)
+    for i, (offset, chunk) in enumerate(chunks):
+        # Chunk findings are numbered from the chunk's first line; shift them to document lines.
+        line_offset += text.count("\n", previous_offset, offset)
+        previous_offset = offset
+
+        if chunk_cache is not None:
+            key = chunk_cache.key(chunk, model, prompt_version)
+            errors = chunk_cache.get(key)
+            if errors is not None:
+                reused += 1
+                analysis_reports.extend(cdc.shift_line_numbers(errors, line_offset))
                 continue
+        if not preflight.within_budget():
+            if failed is not None:
+                failed.append(i)
+            continue  # Budget spent: only cached chunks are still reported.
+
+        errors = analyze_chunk_with_gemini(chunk, retries, delay, document, i, local_spelling, failover,
+                                           compact_prompt, model, output_format)
+        if errors is not None:
+            if chunk_cache is not None:
+                chunk_cache.put(key, errors)
+            analysis_reports.extend(cdc.shift_line_numbers(errors, line_offset))
+        elif failed is not None:
+            failed.append(i)
 
         time.sleep(1)  # Optional: small pause between chunks
 
+    if chunk_cache is not None:
+        metrics.record_metadata(f"{document}: reused chunks", f"{reused}/{len(chunks)}")
     return analysis_reports
 
+# Long-context mode: one cached copy of the whole document, then one short query per category.
+CATEGORY_PASSES = {
+    "typos": "Typographical Errors: spelling, grammar and punctuation mistakes.",
+    "names": "Name Inconsistencies: every person, company or insurer name written differently anywhere in the document.",
+    "dates": "Date Inconsistencies: impossible sequences, conflicting dates for the same event and mixed date formats across the whole document.",
+    "domain": "Domain-Specific Mistakes: invalid policy numbers, unrealistic coverage amounts, incorrect insurance terminology and missing critical information.",
+}
+LOCAL_SPELLING_TYPOS = "Typographical Errors: grammar and punctuation mistakes only (spelling is checked separately)."
+LONG_CONTEXT_SYSTEM = (
+    "You are an expert insurance document reviewer. The insurance document follows; each line starts with its "
+    "line number as 'L<number>:'. Use those numbers for Line_Number. Answer each question for the whole document."
+)
+JSON_SPEC = (
+    'Output a single JSON object {"errors": [...]} whose error objects have Page_Number, Line_Number, Error_Type, '
+    'Error_Description and Suggestions, and nothing else. If there are no errors, output {"errors": []}.'
+)
+# Gemini rejects context caches below this size; smaller documents are sent inline with each pass.
+CACHE_MIN_TOKENS = 32768
+CACHE_TTL = timedelta(minutes=int(os.getenv("GEMINI_CACHE_TTL_MINUTES", 30)))
+# Context caching needs a pinned model version.
+CACHE_MODELS = {"gemini-1.5-pro": "models/gemini-1.5-pro-002", "gemini-1.5-flash": "models/gemini-1.5-flash-002"}
+
+def number_lines(text):
+    return "\n".join(f"L{i}: {line}" for i, line in enumerate(text.split("\n"), start=1))
+
+def build_category_prompt(category, local_spelling=False, output_format="json"):
+    """The short per-category question asked against the cached document."""
+    focus = LOCAL_SPELLING_TYPOS if category == "typos" and local_spelling else CATEGORY_PASSES[category]
+    spec = compact_output.prompt_spec() if output_format == "table" else JSON_SPEC
+    return f"Check the document only for {focus}\n\n{spec}"
+
+def fits_long_context(text, model="gemini-1.5-pro"):
+    """True when the whole document plus prompts and output fits the model's context window."""
+    limits = strategy.MODEL_LIMITS[model]
+    return strategy.count_tokens(text, model) + 2000 + limits["output"] <= limits["context"]
+
+def fits_inline_failover(inline_document):
+    """True when a category pass with the inline document fits gpt-4o-mini, the long-context failover model."""
+    import STAA
+    limit = strategy.MODEL_LIMITS["gpt-4o-mini"]["context"] - STAA.MAX_OUTPUT_TOKENS["gpt-4o-mini"] - 2000
+    return strategy.count_tokens(inline_document, "gpt-4o-mini") <= limit
+
+def create_document_cache(text, document=None, model="gemini-1.5-pro", retries=3, delay=5):
+    """
+    Uploads the numbered document once as cached context. Returns (endpoint, cache), or (None, None)
+    when the document is too small to cache or no key could create it; caches belong to the key that made them.
+    """
+    numbered = number_lines(text)
+    if strategy.count_tokens(numbered, model) < CACHE_MIN_TOKENS:
+        return None, None
+    genai = get_genai()
+
+    def create(endpoint):
+        with gemini_key(genai, endpoint.api_key), metrics.stage("cache_document", document=document):
+            cache = genai.caching.CachedContent.create(
+                model=CACHE_MODELS.get(model, model),
+                display_name=(document or "document")[:100],
+                system_instruction=LONG_CONTEXT_SYSTEM,
+                contents=[numbered],
+                ttl=CACHE_TTL,
+            )
+        return endpoint, cache
+
+    try:
+        return router.shared_router().call(create, ("gemini",), attempts=retries, cooldown=delay, on_retry=warn_retry)
+    except router.RouterExhausted as e:
+        st.warning(f"⚠️ Could not cache {document}; sending it with every pass instead: {e}")
+        return None, None
+
+def delete_document_cache(endpoint, cache):
+    """Deletes a context cache early instead of paying storage until its TTL expires."""
+    try:
+        with gemini_key(get_genai(), endpoint.api_key):
+            cache.delete()
+    except Exception as e:  # The TTL removes it anyway.
+        metrics.record_metadata("cache delete failed", str(e))
+
+def merge_category_findings(results):
+    """Concatenates the passes' findings, dropping exact repeats, in page and line order."""
+    merged = {}
+    for found in results:
+        for finding in found or []:
+            key = (finding.Page_Number, finding.Line_Number, finding.Error_Type.lower(), finding.Error_Description.lower())
+            merged.setdefault(key, finding)
+    return sorted(merged.values(), key=lambda f: (f.Page_Number or 0, f.Line_Number or 0))
+
+def analyze_long_context(text, retries=3, delay=5, document=None, local_spelling=False, failover=False,
+                         model="gemini-1.5-pro", output_format="json", failed=None):
+    """
+    Analyzes the whole document at once for document-wide name and date consistency: the numbered text is
+    cached once (when large enough) and the category passes run in parallel against the cache.
+    Passes that land on another key than the cache's, or on gpt-4o-mini with failover, get the text inline.
+    Documents that do not fit the context window fall back to chunked analysis. Failover sends the
+    whole document to gpt-4o-mini, so it is only used when the document fits gpt-4o-mini's window;
+    otherwise passes that find no Gemini key fall back to chunked analysis, which fails over per chunk.
+    Passes left without findings are appended to a failed list when one is given.
+    """
+    if not fits_long_context(text, model):
+        st.warning(f"⚠️ {document} does not fit the {model} context window; analyzing it in chunks.")
+        return analyze_text_with_gemini(text, retries, delay, document, local_spelling=local_spelling,
+                                        failover=failover, model=model, output_format=output_format, failed=failed)
+    if not preflight.within_budget():
+        if failed is not None:
+            failed.extend(CATEGORY_PASSES)
+        return []
+    cache_endpoint, cache = create_document_cache(text, document, model, retries, delay)
+    inline_document = f"{LONG_CONTEXT_SYSTEM}\n\n{number_lines(text)}\n\n"
+    metrics.record_metadata(f"{document}: long-context", "cached" if cache is not None else "inline")
+    inline_failover = failover and fits_inline_failover(inline_document)
+    providers = ("gemini", "openai") if inline_failover else ("gemini",)
+
+    def run_pass(category):
+        """Returns the raw response; runs on a pool thread, so Streamlit output is left to the caller."""
+        if not preflight.within_budget():
+            return None
+        prompt = build_category_prompt(category, local_spelling, output_format)
+
+        def complete(endpoint):
+            if endpoint.provider == "openai":
+                import STAA
+                return STAA.complete_with_openai(endpoint, inline_document + prompt, "gpt-4o-mini", document, category)
+            if cache is not None and endpoint.label == cache_endpoint.label:
+                return generate_with_gemini(endpoint, prompt, document, category, model, cached_content=cache)
+            return generate_with_gemini(endpoint, inline_document + prompt, document, category, model)
+
+        return router.shared_router().call(complete, providers, attempts=retries, cooldown=delay,
+                                           on_retry=lambda endpoint, error: metrics.record_retry("api_call"),
+                                           prefer=cache_endpoint.label if cache is not None else None)
+
+    results = []
+    exhausted = False
+    try:
+        with ThreadPoolExecutor(max_workers=len(CATEGORY_PASSES)) as pool:
+            # Pool threads need the caller's context so metrics and the budget apply to the current run.
+            futures = {category: pool.submit(contextvars.copy_context().run, run_pass, category)
+                       for category in CATEGORY_PASSES}
+            for category, future in futures.items():
+                try:
+                    raw_content = future.result()
+                except router.RouterExhausted as e:
+                    st.error(f"❌ The {category} pass of {document} failed: {e}")
+                    metrics.record_metadata(f"{document}: {category} pass failed", str(e))
+                    exhausted = True
+                    raw_content = None
+                found = decode_response(raw_content) if raw_content is not None else None
+                if found is None and failed is not None:
+                    failed.append(category)
+                results.append(found)
+    finally:
+        if cache is not None:
+            delete_document_cache(cache_endpoint, cache)
+    if exhausted and failover and not inline_failover:
+        st.warning(f"⚠️ {document} is too large for gpt-4o-mini failover; analyzing it in chunks instead.")
+        if failed is not None:
+            del failed[:]
+        return analyze_text_with_gemini(text, retries, delay, document, local_spelling=local_spelling,
+                                        failover=True, model=model, output_format=output_format, failed=failed)
+    return merge_category_findings(results)
+
 def export_errors_to_excel(errors, file_name="Analysis_Report.xlsx"):
     """Saves detected errors in an Excel file."""
-    df = pd.DataFrame(errors)
-    df_exploded = df.explode('Error Description').reset_index(drop=True)
-    error_expanded = pd.json_normalize(df_exploded['Error Description'])
-    df_final = pd.concat([df_exploded.drop(columns=['Error Description']), error_expanded], axis=1)
+    import pandas as pd
+    df_final = pd.DataFrame(findings.report_rows(errors))
     output = BytesIO()
     df_final.to_excel(output, index=False, engine="openpyxl")
     return output.getvalue()
 
+def analyze_document(file_content, document=None, chunk_cache=None, skip_boilerplate=False, local_spelling=False,
+                     failover=False, compact_prompt=False, model="gemini-1.5-pro", output_format="json",
+                     long_context=False):
+    """
+    Runs the full analysis of one document: boilerplate stripping, Gemini analysis (chunked, or whole-document
+    category passes with long_context) and local spelling.
+    """
+    def analyze(text, failed=None):
+        if long_context:
+            return analyze_long_context(text, document=document, local_spelling=local_spelling, failover=failover,
+                                        model=model, output_format=output_format, failed=failed)
+        return analyze_text_with_gemini(text, document=document, chunk_cache=chunk_cache, local_spelling=local_spelling,
+                                        failover=failover, compact_prompt=compact_prompt, model=model,
+                                        output_format=output_format, failed=failed)
+
+    if skip_boilerplate:
+        errors = boilerplate.analyze_without_boilerplate(file_content, analyze, get_boilerplate_index(), document=document)
+    else:
+        errors = analyze(file_content)
+    if local_spelling:
+        with metrics.stage("typo_check", document=document):
+            errors = typo_check.find_typos(file_content, get_typo_index()) + errors
+    return errors
+
+@st.cache_resource
+def get_boilerplate_index():
+    """Opens the shared paragraph-fingerprint index (BOILERPLATE_DB) once per process."""
+    return boilerplate.BoilerplateIndex()
+
+@st.cache_resource
+def get_typo_index():
+    """Loads the precomputed SymSpell index once per process."""
+    return typo_check.load_index()
+
+def estimate_document(file_content, history=None, local_spelling=False, compact_prompt=False, model="gemini-1.5-pro",
+                      output_format="json", long_context=False, chunk_size=8000):
+    """Pre-flight estimate of one document's calls, tokens, cost and time under the given settings."""
+    if long_context and fits_long_context(file_content, model):
+        return estimate_long_context(file_content, history, local_spelling, model, output_format)
+    prompt_tokens = strategy.count_tokens(build_prompt("", local_spelling, compact_prompt, output_format), model)
+    plan = preflight.chunk_plan(file_content, model, prompt_tokens, chunk_size)
+    output_scale = compact_output.OUTPUT_TOKEN_SCALE if output_format == "table" else 1.0
+    # analyze_text_with_gemini pauses one second between chunks.
+    return preflight.estimate_plan(plan, history, pause_seconds=1.0, output_scale=output_scale)
+
+def estimate_long_context(file_content, history=None, local_spelling=False, model="gemini-1.5-pro", output_format="json"):
+    """
+    Pre-flight estimate of the long-context mode. input_tokens counts cached document tokens at their
+    discounted price, and the passes run in parallel, so the time is that of one pass.
+    """
+    document_tokens = strategy.count_tokens(number_lines(file_content), model)
+    passes = len(CATEGORY_PASSES)
+    prompt_tokens = max(strategy.count_tokens(build_category_prompt(c, local_spelling, output_format), model)
+                        for c in CATEGORY_PASSES)
+    if document_tokens >= CACHE_MIN_TOKENS:
+        input_tokens = document_tokens + passes * (prompt_tokens + document_tokens * metrics.CACHED_INPUT_PRICE_RATIO)
+    else:
+        input_tokens = passes * (prompt_tokens + document_tokens)
+    plan = {"model": model, "calls": passes, "input_tokens": int(input_tokens)}
+    output_scale = compact_output.OUTPUT_TOKEN_SCALE if output_format == "table" else 1.0
+    estimate = preflight.estimate_plan(plan, history, output_scale=output_scale)
+    estimate["seconds"] /= passes
+    return estimate
+
+def budget_options(local_spelling=False, output_format="json", long_context=False):
+    """Settings tried in order when a run does not fit its budget: as configured, then progressively cheaper."""
+    def settings(compact_prompt, model, fmt):
+        return {"local_spelling": local_spelling, "compact_prompt": compact_prompt, "model": model, "output_format": fmt,
+                "long_context": long_context}
+
+    options = [
+        ("the configured settings", settings(False, "gemini-1.5-pro", output_format)),
+        ("a compact prompt", settings(True, "gemini-1.5-pro", output_format)),
+    ]
+    if output_format != "table":
+        options.append(("the compact table format", settings(True, "gemini-1.5-pro", "table")))
+    options.append(("the compact table format on gemini-1.5-flash", settings(True, "gemini-1.5-flash", "table")))
+    return options
+
+# How often the page reruns to pick up background worker progress.
+WORKER_POLL_SECONDS = 2
+WORKER_UNSUPPORTED = "Not applied when chunks run on background workers."
+
+@st.cache_resource
+def get_job_queue():
+    """Opens the job queue (JOB_QUEUE_URL / JOB_QUEUE_BACKEND) once per process."""
+    return job_queue.open_queue()
+
+def submit_document_to_workers(file_content, document, content_defined=False, local_spelling=False, failover=False,
+                               chunk_size=8000, compact_prompt=False, model="gemini-1.5-pro", output_format="json",
+                               owner="anonymous"):
+    """Queues one chunk job per chunk for `python worker.py` processes and returns the batch id."""
+    with metrics.stage("chunk_text", document=document):
+        if content_defined:
+            chunks = cdc.content_defined_chunks(file_content, chunk_size // 2, chunk_size, chunk_size * 3 // 2)
+        else:
+            chunks = list(zip(range(0, len(file_content), chunk_size), chunk_text(file_content, chunk_size)))
+    metrics.record_metadata(f"{document}: queued chunks", len(chunks))
+    return job_queue.submit_document(get_job_queue(), "STAG", document, file_content, chunks, {
+        "local_spelling": local_spelling,
+        "failover": failover,
+        "compact_prompt": compact_prompt,
+        "output_format": output_format,
+        "model": model,
+    }, owner=owner)
+
+def collect_worker_results():
+    """
+    Checks the run's queued batches once (st.session_state["worker_batches"]). While workers are busy
+    it shows their progress and main() reruns the script after WORKER_POLL_SECONDS, so the page stays
+    responsive; once they are done, their findings go to the viewer and the Excel report.
+    """
+    pending = st.session_state["worker_batches"]
+    queued = pending["queued"]
+    fraction, results = job_queue.poll_batches(get_job_queue(), [batch for _, _, batch in queued], pending["submitted"])
+    if results is None:
+        st.progress(fraction, text=f"⏳ Background workers: {fraction:.0%} of chunks analyzed")
+        return
+    del st.session_state["worker_batches"]
+    viewer = st.session_state["findings_view"]
+    all_errors = pending["all_errors"]
+    with metrics.track_run(st.session_state.get("run_metrics")):
+        for document, file_content, batch in queued:
+            found, errors = results[batch]
+            for error in errors:
+                st.error(f"❌ {document}: {error}")
+            if pending["local_spelling"]:
+                with metrics.stage("typo_check", document=document):
+                    found = typo_check.find_typos(file_content, get_typo_index()) + found
+            viewer.add(document, found)
+            all_errors.append({
+                "Document Name": document,
+                "Error Description": found,
+            })
+        st.success("✅ Analysis completed!")
+        with metrics.stage("export_errors_to_excel"):
+            st.session_state["excel_report"] = export_errors_to_excel(all_errors)
+
+@st.cache_resource
+def start_metrics_server():
+    """Starts the Prometheus /metrics endpoint once per process when METRICS_PORT is set."""
+    return metrics.start_metrics_server()
+
 def main():
     st.title("🛡 Insurance Document Error Detector (Google Gemini)")
     st.write("Upload your insurance documents to detect errors like typographical issues, name inconsistencies, date errors, and more.")
@@ -236,38 +680,164 @@ def main():
         accept_multiple_files=True
     )
 
+    start_metrics_server()
+    profile_enabled = st.sidebar.checkbox("Profile this run (cProfile + tracemalloc)")
+    long_context = st.sidebar.checkbox(
+        "Long-context mode (whole document, cached context, parallel category passes)",
+        help="The whole document is cached once and checked for typos, names, dates and domain rules in parallel "
+             "passes, so consistency checks see the entire document. Runs in this session, not on workers.",
+    )
+    use_workers = st.sidebar.checkbox(
+        "Run on background workers (job queue)",
+        help="Chunks are queued for `python worker.py` processes instead of being analyzed in this session.",
+    )
+    on_workers = use_workers and not long_context
+    # Workers analyze single chunks: the chunk cache, boilerplate stripping and run budgets only apply in-session.
+    reuse_chunks = st.sidebar.checkbox("Reuse findings for revised documents (content-defined chunking)",
+                                       value=not on_workers, disabled=on_workers, help=WORKER_UNSUPPORTED) and not on_workers
+    skip_boilerplate = st.sidebar.checkbox("Skip standard wording with known findings (boilerplate cache)",
+                                           disabled=on_workers, help=WORKER_UNSUPPORTED) and not on_workers
+    local_spelling = st.sidebar.checkbox(
+        "Check spelling locally instead of in the prompt",
+        disabled=not typo_check.has_full_dictionary(),
+        help="Needs a general word list (TYPO_DICTIONARY, default /usr/share/dict/words); without one the model checks spelling.",
+    )
+    failover = st.sidebar.checkbox(
+        "Fail over to gpt-4o-mini when every key is failing",
+        help="Calls are spread over all keys in GOOGLE_API_KEYS; this also allows the other provider's keys.",
+    )
+    output_format = st.sidebar.selectbox(
+        "Response format",
+        ["json", "table"],
+        format_func={"json": "Verbose JSON", "table": "Compact table (fewer output tokens)"}.get,
+    )
+
+    run_budget = st.sidebar.number_input("Run budget ($, 0 = unlimited)", min_value=0.0, value=preflight.RUN_BUDGET_USD,
+                                         disabled=on_workers, help=WORKER_UNSUPPORTED)
+    time_budget = st.sidebar.number_input("Time budget (minutes, 0 = unlimited)", min_value=0.0,
+                                          value=preflight.RUN_BUDGET_MINUTES, disabled=on_workers, help=WORKER_UNSUPPORTED)
+    if on_workers:
+        run_budget = time_budget = 0.0
+    budget = preflight.Budget(run_budget, time_budget, preflight.SESSION_BUDGET_USD, st.session_state.get("spent_usd", 0.0))
+
     error_summary_placeholder = st.empty()
 
+    # Pre-flight: parse (cached for the run below) and estimate before anything is sent to a model.
+    chosen = None
+    if uploaded_files:
+        documents = []
+        for uploaded_file in uploaded_files:
+            file_content = parse_cache.cached_read(
+                uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+            )
+            if file_content:
+                documents.append((uploaded_file.name, file_content))
+        configured, chosen, reasons = preflight.plan_run(
+            documents, budget_options(local_spelling, output_format, long_context), budget, estimate_document, preflight.load_history()
+        )
+        preflight.render_estimate(st, configured, chosen, reasons)
+
     if st.button("🚀 Detect Errors"):
         if not uploaded_files:
             st.error("Please upload at least one file!")
+        elif chosen is None:
+            st.error("Raise the budget or upload fewer documents to run the analysis.")
         else:
-            all_errors = []
-            for uploaded_file in uploaded_files:
-                file_content = read_uploaded_file(uploaded_file)
-                if not file_content:
-                    continue
-
-                st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
-                analysis_report = analyze_text_with_gemini(file_content)
-
-                error_summary_placeholder.write(f"### ❗ Errors in `{uploaded_file.name}`")
-                error_summary_placeholder.write(analysis_report)
-
-                all_errors.append({
-                    "Document Name": uploaded_file.name,
-                    "Error Description": analysis_report,
-                })
-
-            if all_errors:
-                st.success("✅ Analysis completed!")
-                excel_file = export_errors_to_excel(all_errors)
-                st.download_button(
-                    label="📥 Download Error Report",
-                    data=excel_file,
-                    file_name="Analysis_Report_Google.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            settings = chosen[1]
+            with metrics.track_run() as run, metrics.profile_run(profile_enabled), preflight.enforce(budget):
+                st.session_state["run_metrics"] = run
+                viewer = st.session_state["findings_view"] = findings_view.FindingsTable()
+                st.session_state["excel_report"] = None
+                for _, _, batch in st.session_state.pop("worker_batches", {}).get("queued", []):
+                    get_job_queue().cancel_batch(batch, "superseded by a new run")
+                all_errors = []
+                queued = []
+                owner = scheduler.session_owner(st.session_state)
+                # Shortest job first: small documents are analyzed (and shown) before long ones.
+                for uploaded_file in sorted(uploaded_files, key=lambda f: f.size):
+                    with metrics.stage("read_uploaded_file", document=uploaded_file.name):
+                        file_content = parse_cache.cached_read(
+                            uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+                        )
+                    if not file_content:
+                        continue
+
+                    if on_workers:
+                        st.write(f"📨 Queuing **{uploaded_file.name}** for background workers...")
+                        batch = submit_document_to_workers(
+                            file_content,
+                            uploaded_file.name,
+                            content_defined=reuse_chunks,
+                            local_spelling=local_spelling,
+                            failover=failover,
+                            compact_prompt=settings["compact_prompt"],
+                            output_format=settings["output_format"],
+                            model=settings["model"],
+                            owner=owner,
+                        )
+                        queued.append((uploaded_file.name, file_content, batch))
+                        continue
+
+                    st.write(f"🔍 Analyzing **{uploaded_file.name}**...")
+                    chunk_cache = cdc.session_chunk_cache(st.session_state) if reuse_chunks else None
+                    with scheduler.job(owner, size=len(file_content)):
+                        analysis_report = analyze_document(
+                            file_content,
+                            document=uploaded_file.name,
+                            chunk_cache=chunk_cache,
+                            skip_boilerplate=skip_boilerplate,
+                            local_spelling=local_spelling,
+                            failover=failover,
+                            compact_prompt=settings["compact_prompt"],
+                            output_format=settings["output_format"],
+                            model=settings["model"],
+                            long_context=settings["long_context"],
+                        )
+
+                    viewer.add(uploaded_file.name, analysis_report)
+                    error_summary_placeholder.dataframe(viewer.summary(), hide_index=True)
+
+                    all_errors.append({
+                        "Document Name": uploaded_file.name,
+                        "Error Description": analysis_report,
+                    })
+
+                if queued:
+                    # Collected on the following reruns (collect_worker_results) instead of blocking this one.
+                    st.session_state["worker_batches"] = {
+                        "queued": queued,
+                        "submitted": time.time(),
+                        "all_errors": all_errors,
+                        "local_spelling": local_spelling,
+                    }
+                error_summary_placeholder.empty()  # The viewer below shows the final summary.
+
+                metrics.record_metadata("API endpoints", router.shared_router().health())
+                st.session_state["spent_usd"] = budget.spent_usd + run.total_cost()
+                preflight.update_history(run)
+                if budget.stopped:
+                    st.warning(f"💸 Budget reached ({budget.stopped}); the remaining chunks were not analyzed.")
+
+                if all_errors and not queued:
+                    st.success("✅ Analysis completed!")
+                    with metrics.stage("export_errors_to_excel"):
+                        st.session_state["excel_report"] = export_errors_to_excel(all_errors)
+
+    if st.session_state.get("worker_batches"):
+        collect_worker_results()
+    # Kept in the session so the report stays downloadable while the viewer reruns the script.
+    if st.session_state.get("excel_report"):
+        st.download_button(
+            label="📥 Download Error Report",
+            data=st.session_state["excel_report"],
+            file_name="Analysis_Report_Google.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    findings_view.render(st, st.session_state.get("findings_view"))
+    metrics.render_sidebar(st, st.session_state.get("run_metrics"))
+    if st.session_state.get("worker_batches"):
+        time.sleep(WORKER_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+import streamlit as st
+import metrics
+import parse_cache
+import scheduler
+import strategy
+import STA
+import STAA
+import STAG
+
+MODELS = ["gpt-4o-mini", "gemini-1.5-pro"]
+
+def plan_document(text, model):
+    """Counts tokens locally and picks whole-document or chunked analysis for the model."""
+    if model == "gemini-1.5-pro":
+        return strategy.plan_analysis(text, model, strategy.count_tokens(STAG.build_prompt(""), model))
+    # Plan against the max_tokens each path actually sends, not just the model's limit.
+    plan = strategy.plan_analysis(text, model, strategy.count_tokens(STA.build_prompt(""), model),
+                                  max_output_tokens=STA.MAX_OUTPUT_TOKENS)
+    if plan["strategy"] == "chunked":
+        plan = strategy.plan_analysis(text, model, strategy.count_tokens(STAA.build_prompt(""), model),
+                                      max_output_tokens=STAA.MAX_OUTPUT_TOKENS[model])
+    return plan
+
+def analyze_with_plan(text, plan, document=None):
+    """Runs the STA, STAA or STAG analysis path chosen by the plan."""
+    if plan["model"] == "gemini-1.5-pro":
+        if plan["strategy"] == "whole":
+            return STAG.analyze_chunk_with_gemini(text, document=document) or []
+        return STAG.analyze_text_with_gemini(text, document=document, chunk_size=plan["chunk_chars"])
+    if plan["strategy"] == "whole":
+        return STA.analyze_text_with_gpt(text, document=document)
+    return STAA.analyze_text_with_gpt(text, document=document, chunk_size=plan["chunk_chars"])
+
+@st.cache_resource
+def start_metrics_server():
+    """Starts the Prometheus /metrics endpoint once per process when METRICS_PORT is set."""
+    return metrics.start_metrics_server()
+
+def main():
+    st.title("🛡 Insurance Document Error Detector (Auto Strategy)")
+    st.write("Upload your insurance documents; each one is analyzed whole or in chunks depending on its measured token count.")
+
+    uploaded_files = st.file_uploader(
+        "📎 Upload files (txt, pdf, docx, xlsx)",
+        type=["txt", "pdf", "docx", "xlsx"],
+        accept_multiple_files=True
+    )
+
+    start_metrics_server()
+    model = st.sidebar.selectbox("Model", MODELS)
+    profile_enabled = st.sidebar.checkbox("Profile this run (cProfile + tracemalloc)")
+
+    if st.button("🚀 Detect Errors"):
+        if not uploaded_files:
+            st.error("Please upload at least one file!")
+        else:
+            with metrics.track_run() as run, metrics.profile_run(profile_enabled):
+                st.session_state["run_metrics"] = run
+                all_errors = []
+                owner = scheduler.session_owner(st.session_state)
+                for uploaded_file in sorted(uploaded_files, key=lambda f: f.size):
+                    with metrics.stage("read_uploaded_file", document=uploaded_file.name):
+                        file_content = parse_cache.cached_read(
+                            uploaded_file, STA.read_uploaded_file, STA.PARSER_VERSION, parse_cache.session_cache(st.session_state)
+                        )
+                    if not file_content:
+                        continue
+
+                    with metrics.stage("plan", document=uploaded_file.name):
+                        plan = plan_document(file_content, model)
+                    metrics.record_metadata(f"{uploaded_file.name}: strategy", plan)
+                    st.write(
+                        f"🔍 Analyzing **{uploaded_file.name}**: {plan['document_tokens']:,} tokens, "
+                        f"{plan['strategy']} ({plan['calls']} call{'s' if plan['calls'] != 1 else ''} to {plan['model']})"
+                    )
+                    with scheduler.job(owner, size=len(file_content)):
+                        analysis_report = analyze_with_plan(file_content, plan, document=uploaded_file.name)
+
+                    all_errors.append({
+                        "Document Name": uploaded_file.name,
+                        "Error Description": analysis_report,
+                    })
+
+                if all_errors:
+                    st.success("✅ Analysis completed!")
+                    with metrics.stage("export_errors_to_excel"):
+                        excel_file = STAA.export_errors_to_excel(all_errors)
+                    st.download_button(
+                        label="📥 Download Error Report",
+                        data=excel_file,
+                        file_name="Analysis_Report.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+
+    metrics.render_sidebar(st, st.session_state.get("run_metrics"))
+
+if __name__ == "__main__":
+    main()
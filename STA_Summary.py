@@ -1,16 +1,28 @@
 import streamlit as st
-import pandas as pd
-import openai
-import time
-from io import StringIO, BytesIO
-from PyPDF2 import PdfReader
-import docx
 import os
-from dotenv import load_dotenv
-from openai.error import APIError, RateLimitError
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+import parse_cache
+import router
+import scheduler
+import strategy
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+@st.cache_resource
+def get_openai():
+    """
+    Imports and configures the OpenAI SDK once per process instead of on every rerun.
+    """
+    from dotenv import load_dotenv
+    import openai
+
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+# Bump when read_uploaded_file output changes so cached parses are invalidated.
+PARSER_VERSION = "STA_Summary.read_uploaded_file/3"
 
 def read_uploaded_file(uploaded_file):
     """
@@ -19,14 +31,17 @@ def read_uploaded_file(uploaded_file):
     """
     content = ""
     if uploaded_file.name.endswith(".txt"):
-        content = StringIO(uploaded_file.getvalue().decode("utf-8")).read()
+        # Decoded straight from the upload's buffer, without getvalue()'s bytes copy or a StringIO round trip.
+        with uploaded_file.getbuffer() as view:
+            content = str(view, "utf-8")
     elif uploaded_file.name.endswith(".pdf"):
-        pdf_reader = PdfReader(uploaded_file)
-        content = " ".join([page.extract_text() for page in pdf_reader.pages])
+        import pdf_normalize
+        content = pdf_normalize.read_pdf_text(uploaded_file, document=uploaded_file.name)
     elif uploaded_file.name.endswith(".docx"):
-        doc = docx.Document(uploaded_file)
-        content = " ".join([p.text for p in doc.paragraphs])
+        import docx_stream
+        content = docx_stream.read_docx_text(uploaded_file)
     elif uploaded_file.name.endswith(".xlsx"):
+        import pandas as pd
         df = pd.read_excel(uploaded_file)
         content = df.to_string(index=False)
     else:
@@ -39,42 +54,177 @@ def chunk_text(text, chunk_size=5000):
     """
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
-def analyze_text_with_gpt4(text):
+# Bump when the map or reduce prompts change so cached summaries are invalidated.
+SUMMARY_VERSION = "STA_Summary/1"
+MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", 4))
+# Reduce groups are sized so prompt, partial reports and max_tokens fit gpt-4's context window.
+REDUCE_CONTEXT_TOKENS = strategy.MODEL_LIMITS["gpt-4"]["context"]
+MAX_REDUCE_ROUNDS = 6
+# Partial and merged summaries kept per session, so re-summarizing skips the map step.
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+def complete_with_gpt4(prompt, max_tokens=800, retries=3, delay=5, document=None, chunk=None):
     """
-    Uses GPT-4 to analyze text for errors while handling token limits.
+    Sends one prompt to GPT-4 through the key router, which spreads calls over the configured
+    OpenAI keys and fails over on errors and rate limits. Safe to call from worker threads.
     """
-    chunks = chunk_text(text)
-    analysis_reports = []
-
-    for i, chunk in enumerate(chunks):
-        prompt = f"""
-        Analyze the following text for typographical errors, name inconsistencies, date inconsistencies, 
-        and domain-specific mistakes. Provide a detailed, categorized report:
-        {chunk}
-        """
+    openai = get_openai()
 
-        try:
+    def complete(endpoint):
+        with metrics.stage("api_call", document=document, chunk=chunk):
             response = openai.ChatCompletion.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "You are an AI assistant helping with document analysis."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=800,  # Reduced token limit
-                temperature=0.7
+                max_tokens=max_tokens,
+                temperature=0.7,
+                api_key=endpoint.api_key,
             )
+        metrics.record_openai_usage(response, "gpt-4", document=document, chunk=chunk)
+        return response.choices[0]['message']['content'].strip()
 
-            analysis_reports.append(response.choices[0]['message']['content'].strip())
-            time.sleep(2)  # Adding delay to prevent rate limits
+    try:
+        return router.shared_router().call(complete, ("openai",), attempts=retries, cooldown=delay,
+                                           on_retry=lambda endpoint, error: metrics.record_retry("api_call"))
+    except router.RouterExhausted as e:
+        raise RuntimeError(f"GPT-4 is unavailable on every configured key. Please wait or try again later. ({e})")
 
-        except openai.error.RateLimitError:
-            st.error("Rate limit exceeded! Please wait or try again later.")
-        except AttributeError:
-            st.error("Unexpected response format from GPT-4!")
+def map_chunk(chunk, document=None, chunk_index=None):
+    """
+    Produces the partial report for one chunk.
+    """
+    prompt = f"""
+        Analyze the following text for typographical errors, name inconsistencies, date inconsistencies, 
+        and domain-specific mistakes. Provide a detailed, categorized report:
+        {chunk}
+        """
+    return complete_with_gpt4(prompt, max_tokens=800, document=document, chunk=chunk_index)
 
-    return "\n\n".join(analysis_reports)
+def reduce_prompt(reports, target_words):
+    joined = "\n\n---\n\n".join(reports)
+    return f"""
+        The following are partial error reports for consecutive parts of one insurance document.
+        Merge them into a single categorized summary (typographical errors, name inconsistencies,
+        date inconsistencies, domain-specific mistakes). Remove duplicates, keep concrete examples,
+        and use at most {target_words} words:
+        {joined}
+        """
 
+def reduce_max_tokens(target_words):
+    return min(4000, int(target_words * 2))
 
+def reduce_reports(reports, target_words, document=None):
+    """
+    Merges partial reports into one categorized summary of at most target_words words.
+    """
+    return complete_with_gpt4(reduce_prompt(reports, target_words), max_tokens=reduce_max_tokens(target_words),
+                              document=document)
+
+def reduce_groups(reports, target_words):
+    """
+    Groups consecutive reports by token count so each reduce prompt plus its max_tokens fits
+    REDUCE_CONTEXT_TOKENS; a report too large to share a prompt is reduced on its own.
+    """
+    budget = (REDUCE_CONTEXT_TOKENS - reduce_max_tokens(target_words)
+              - strategy.count_tokens(reduce_prompt([], target_words), "gpt-4"))
+    groups = []
+    group, tokens = [], 0
+    for report in reports:
+        size = strategy.count_tokens(report + "\n\n---\n\n", "gpt-4")
+        if group and tokens + size > budget:
+            groups.append(group)
+            group, tokens = [], 0
+        group.append(report)
+        tokens += size
+    if group:
+        groups.append(group)
+    return groups
+
+def _cache_key(*parts):
+    digest = hashlib.sha256(SUMMARY_VERSION.encode("utf-8"))
+    for part in parts:
+        digest.update(b"\x00" + str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+def _run_in_context(executor, fn, *args, **kwargs):
+    # Worker threads need the caller's context so metrics land on the current run.
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def analyze_text_with_gpt4(text, document=None, target_words=400, cache=None):
+    """
+    Uses GPT-4 to analyze text for errors while handling token limits.
+    Chunks are mapped to partial reports in parallel, then reduced in groups that fit gpt-4's
+    context until a single summary of at most target_words words remains, for at most
+    MAX_REDUCE_ROUNDS rounds. Map results are cached (a parse_cache.ParseCache) by chunk content,
+    so re-summarizing at a different length only repeats the reduce step.
+    """
+    cache = parse_cache.ParseCache(SUMMARY_CACHE_MAX_BYTES) if cache is None else cache
+    with metrics.stage("chunk_text", document=document):
+        chunks = chunk_text(text)
+    if not chunks:
+        return ""
+
+    partials = [None] * len(chunks)
+    failures = []
+    with ThreadPoolExecutor(max_workers=MAP_WORKERS) as executor:
+        futures = {}
+        for i, chunk in enumerate(chunks):
+            key = _cache_key("map", chunk)
+            partials[i] = cache.get(key)
+            if partials[i] is None:
+                futures[_run_in_context(executor, map_chunk, chunk, document, i)] = (i, key)
+        for future in as_completed(futures):
+            i, key = futures[future]
+            try:
+                partials[i] = future.result()
+                cache.put(key, partials[i])
+            except Exception as e:
+                failures.append(f"chunk {i + 1}: {e}")
+
+    for failure in failures:
+        st.error(f"Failed to analyze {failure}")
+    level = [p for p in partials if p]
+
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=MAP_WORKERS) as executor:
+        while len(level) > 1 or (level and len(level[0].split()) > target_words):
+            if rounds == MAX_REDUCE_ROUNDS:
+                st.warning(f"Stopped merging partial reports after {MAX_REDUCE_ROUNDS} rounds.")
+                metrics.record_metadata(f"{document}: reduce rounds", f"stopped at {MAX_REDUCE_ROUNDS}")
+                break
+            rounds += 1
+            groups = reduce_groups(level, target_words)
+            next_level = [None] * len(groups)
+            futures = {}
+            for g, group in enumerate(groups):
+                key = _cache_key("reduce", target_words, *group)
+                next_level[g] = cache.get(key)
+                if next_level[g] is None:
+                    futures[_run_in_context(executor, reduce_reports, group, target_words, document)] = (g, key)
+            for future in as_completed(futures):
+                g, key = futures[future]
+                try:
+                    next_level[g] = future.result()
+                    cache.put(key, next_level[g])
+                except Exception as e:
+                    st.error(f"Failed to merge partial reports: {e}")
+                    next_level[g] = "\n\n".join(groups[g])
+            if next_level == level:
+                break
+            level = next_level
+
+    return "\n\n".join(level)
+
+
+
+@st.cache_resource
+def start_metrics_server():
+    """
+    Starts the Prometheus /metrics endpoint once per process when METRICS_PORT is set.
+    """
+    return metrics.start_metrics_server()
 
 def main():
     st.title("Insurance Document Error Detector")
@@ -86,23 +236,45 @@ def main():
         accept_multiple_files=True
     )
 
+    start_metrics_server()
+    profile_enabled = st.sidebar.checkbox("Profile this run (cProfile + tracemalloc)")
+    target_words = st.sidebar.slider("Summary length (words)", 100, 1500, 400, step=50)
+
     error_summary_placeholder = st.empty()
 
     if st.button("Detect Errors"):
         if not uploaded_files:
             st.error("Please upload at least one file!")
         else:
-            all_errors = []
-            for uploaded_file in uploaded_files:
-                file_content = read_uploaded_file(uploaded_file)
-                if not file_content:
-                    continue
+            with metrics.track_run() as run, metrics.profile_run(profile_enabled):
+                st.session_state["run_metrics"] = run
+                all_errors = []
+                owner = scheduler.session_owner(st.session_state)
+                for uploaded_file in sorted(uploaded_files, key=lambda f: f.size):
+                    with metrics.stage("read_uploaded_file", document=uploaded_file.name):
+                        file_content = parse_cache.cached_read(
+                            uploaded_file, read_uploaded_file, PARSER_VERSION, parse_cache.session_cache(st.session_state)
+                        )
+                    if not file_content:
+                        continue
+
+                    st.write(f"Analyzing {uploaded_file.name}...")
+                    if "summary_cache" not in st.session_state:
+                        st.session_state["summary_cache"] = parse_cache.ParseCache(SUMMARY_CACHE_MAX_BYTES)
+                    with scheduler.job(owner, size=len(file_content)):
+                        analysis_report = analyze_text_with_gpt4(
+                            file_content,
+                            document=uploaded_file.name,
+                            target_words=target_words,
+                            cache=st.session_state["summary_cache"],
+                        )
+
+                    error_summary_placeholder.write(f"### Errors in {uploaded_file.name}")
+                    error_summary_placeholder.write(analysis_report)
 
-                st.write(f"Analyzing {uploaded_file.name}...")
-                analysis_report = analyze_text_with_gpt4(file_content)
+                metrics.record_metadata("API endpoints", router.shared_router().health())
 
-                error_summary_placeholder.write(f"### Errors in {uploaded_file.name}")
-                error_summary_placeholder.write(analysis_report)
+    metrics.render_sidebar(st, st.session_state.get("run_metrics"))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+"""
+Measures decode + validation cost and memory of model findings for large responses.
+
+Compares plain json.loads (the raw dicts the apps used to pass around) with
+findings.decode_findings (canonical keys, int page/line numbers, slot records).
+Usage: python bench_findings.py [--findings 2000 20000] [--repeat 5]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import findings
+
+KEY_VARIANTS = [
+    ("Page_Number", "Line_Number", "Error_Type", "Error_Description", "Suggestions"),
+    ("Page_Number", "Line_Number", "Error_Type", "Error_description", "Suggestions"),
+    ("page", "line", "type", "description", "suggestion"),
+]
+
+
+def make_response(count, seed=0):
+    """A response of count findings with drifting keys and mixed number types."""
+    rng = random.Random(seed)
+    errors = []
+    for i in range(count):
+        page, line, error_type, description, suggestions = rng.choice(KEY_VARIANTS)
+        number = rng.randint(1, 4000)
+        errors.append({
+            page: rng.choice([rng.randint(1, 90), str(rng.randint(1, 90))]),
+            line: rng.choice([number, str(number), f"Line {number}", f"{number}-{number + 2}"]),
+            error_type: rng.choice(["Typographical Error", "Date Inconsistencies", "Name Inconsistencies"]),
+            description: f"Misspelled word: 'polisy{i}' instead of 'policy'.",
+            suggestions: "Correct 'polisy' to 'policy'.",
+        })
+    return json.dumps({"errors": errors})
+
+
+def time_call(func, raw, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(raw)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def retained_bytes(func, raw):
+    """Bytes still allocated by func's result after it returns."""
+    tracemalloc.start()
+    result = func(raw)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--findings", type=int, nargs="*", default=[2000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    decoders = {
+        "json.loads (raw dicts)": lambda raw: json.loads(raw)["errors"],
+        "decode_findings": findings.decode_findings,
+    }
+    print(f"msgspec: {'installed' if findings.msgspec is not None else 'not installed (json fallback)'}")
+    print(f"{'findings':>9} {'decoder':<24} {'median (ms)':>12} {'us/finding':>11} {'retained (KiB)':>15}")
+    for count in args.findings:
+        raw = make_response(count)
+        for name, func in decoders.items():
+            seconds = time_call(func, raw, args.repeat)
+            kib = retained_bytes(func, raw) / 1024
+            print(f"{count:>9} {name:<24} {seconds * 1000:>12.1f} {seconds * 1e6 / count:>11.2f} {kib:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
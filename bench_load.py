@@ -0,0 +1,291 @@
+"""
+Concurrent-user load test of STAA / STAG against a local mock LLM, for sizing deployments.
+
+Each concurrency level runs in a fresh interpreter with N simulated reviewer sessions. A session
+repeatedly uploads a synthetic document (a mix of small, medium and large) and runs what
+"Detect Errors" runs: parse through the session's parse cache -> analyze_document under its own
+scheduler owner -> findings viewer -> Excel report. The Streamlit server runs every browser
+session's script in a thread of one process, so sessions are threads here too and share the
+router, scheduler and caches as in production. (AppTest cannot drive st.file_uploader, so the
+upload path is called directly; Streamlit calls outside a script run are no-ops.)
+
+The mock LLM is an HTTP server in this process. STAA reaches it through OPENAI_API_BASE; STAG's
+Gemini SDK is replaced by a client that posts to the same server. Each call takes --llm-latency
+seconds plus its completion tokens / --llm-tokens-per-second, with +-20% jitter.
+
+Reported per level: sessions/s (completed upload-to-report interactions per second), p50/p95/p99
+end-to-end latency (and p95 for small documents), peak RSS of the level's process and model calls.
+Usage: python bench_load.py [--app STAA] [--levels 1 2 4 8 16] [--documents 3] [--mix 0.6 0.3 0.1]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Characters per synthetic document size class: about 1, 3 and 10 chunks of 8000 characters.
+DOCUMENT_SIZES = {"small": 3000, "medium": 24000, "large": 80000}
+MOCK_KEYS = 4
+FINDINGS_PER_CALL = 2
+COMPLETION_TOKENS_PER_FINDING = 60
+
+NAMES = ["John Smith", "Ann Lee", "Maria Garcia", "Wei Chen", "Olu Adeyemi"]
+CLAUSES = [
+    "The insured {name} is covered under policy {policy} from {start} to {end}.",
+    "The deductible for each claim is ${amount} unless stated otherwise in the schedule.",
+    "Coverage for water damage is excluded where the dwelling has been vacant for 60 days.",
+    "The premium of ${amount} is due on {start} and is payable in monthly instalments.",
+    "Claims must be reported by {name} within thirty days of the date of loss.",
+    "This endorsement amends section {section} of the policy {policy}.",
+]
+
+
+def make_document(size, rng):
+    """Returns synthetic policy text of about `size` characters, different for every seed."""
+    policy = f"PN-{rng.randint(10000, 99999)}"
+    lines = []
+    length = 0
+    while length < size:
+        line = rng.choice(CLAUSES).format(
+            name=rng.choice(NAMES), policy=policy, start=f"2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+            end=f"2026-0{rng.randint(1, 9)}-2{rng.randint(0, 8)}", amount=rng.randint(100, 5000),
+            section=rng.randint(1, 12),
+        )
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+def mock_findings(prompt, rng):
+    lines = max(prompt.count("\n"), 1)
+    return [
+        {
+            "Page_Number": 1,
+            "Line_Number": rng.randint(1, lines),
+            "Error_Type": "Date Inconsistencies",
+            "Error_Description": "Coverage start date is after the end date.",
+            "Suggestions": "Check the coverage period.",
+        }
+        for _ in range(FINDINGS_PER_CALL)
+    ]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Answers OpenAI chat completions (/chat/completions) and the mock Gemini client (/gemini)."""
+
+    latency = 0.5
+    tokens_per_second = 100.0
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        rng = random.Random()
+        if self.path.endswith("/chat/completions"):
+            prompt = "".join(message["content"] for message in request["messages"])
+        else:
+            prompt = request["prompt"]
+        content = json.dumps({"errors": mock_findings(prompt, rng)})
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = FINDINGS_PER_CALL * COMPLETION_TOKENS_PER_FINDING
+        time.sleep((self.latency + completion_tokens / self.tokens_per_second) * rng.uniform(0.8, 1.2))
+        if self.path.endswith("/chat/completions"):
+            body = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }
+        else:
+            body = {"text": content, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_llm(latency, tokens_per_second):
+    """Starts the mock LLM on a free local port in a daemon thread and returns its base URL."""
+    handler = type("Handler", (MockLLMHandler,), {"latency": latency, "tokens_per_second": tokens_per_second})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+class MockGeminiModel:
+    def __init__(self, base_url, model_name):
+        self.base_url = base_url
+        self.model_name = model_name
+
+    def generate_content(self, prompt):
+        request = urllib.request.Request(
+            f"{self.base_url}/gemini", data=json.dumps({"model": self.model_name, "prompt": prompt}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            body = json.loads(response.read())
+        return SimpleNamespace(text=body["text"], usage_metadata=SimpleNamespace(
+            prompt_token_count=body["prompt_tokens"], candidates_token_count=body["completion_tokens"],
+            cached_content_token_count=0,
+        ))
+
+
+class MockGenAI:
+    """Stands in for google.generativeai in STAG: models post their prompts to the mock LLM."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def configure(self, api_key=None, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name, generation_config=None):
+        return MockGeminiModel(self.base_url, model_name)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else None
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)  # bytes on macOS, KiB on Linux
+
+
+def run_session(app, number, documents, mix, results):
+    """One reviewer: uploads `documents` synthetic files one after another, as Detect Errors would."""
+    import findings_view
+    import metrics
+    import parse_cache
+    import scheduler
+
+    rng = random.Random(number)
+    session_state = {}
+    owner = scheduler.session_owner(session_state)
+    for index in range(documents):
+        size_class = rng.choices(list(DOCUMENT_SIZES), weights=mix)[0]
+        upload = io.BytesIO(make_document(DOCUMENT_SIZES[size_class], rng).encode())
+        upload.name = f"session{number}-{index}.txt"
+        start = time.perf_counter()
+        try:
+            with metrics.track_run() as run:
+                file_content = parse_cache.cached_read(
+                    upload, app.read_uploaded_file, app.PARSER_VERSION, parse_cache.session_cache(session_state)
+                )
+                with scheduler.job(owner, size=len(file_content)):
+                    found = app.analyze_document(file_content, document=upload.name)
+                viewer = session_state["findings_view"] = findings_view.FindingsTable()
+                viewer.add(upload.name, found)
+                viewer.summary()
+                session_state["excel_report"] = app.export_errors_to_excel(
+                    [{"Document Name": upload.name, "Error Description": found}]
+                )
+        except Exception as e:
+            results.append({"size": size_class, "seconds": None, "error": str(e)})
+            continue
+        results.append({"size": size_class, "seconds": time.perf_counter() - start, "calls": len(run.usage)})
+
+
+def run_level(app_name, sessions, documents, mix, base_url):
+    """Runs one concurrency level in this process and returns its measurements."""
+    import importlib
+
+    app = importlib.import_module(app_name)
+    if app_name == "STAG":
+        mock = MockGenAI(base_url)
+        app.get_genai = lambda: mock
+    baseline_mib = peak_rss_mib()
+    results = []
+    threads = [threading.Thread(target=run_session, args=(app, n, documents, mix, results)) for n in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    seconds = [r["seconds"] for r in results if r["seconds"] is not None]
+    small = [r["seconds"] for r in results if r["seconds"] is not None and r["size"] == "small"]
+    return {
+        "sessions": sessions,
+        "completed": len(seconds),
+        "errors": [r["error"] for r in results if r["seconds"] is None][:3],
+        "sessions_per_second": len(seconds) / wall if wall else 0.0,
+        "p50": percentile(seconds, 0.5),
+        "p95": percentile(seconds, 0.95),
+        "p99": percentile(seconds, 0.99),
+        "small_p95": percentile(small, 0.95),
+        "calls": sum(r.get("calls", 0) for r in results),
+        "baseline_rss_mib": baseline_mib,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+
+def mock_environment(base_url):
+    """Environment for a level's process: every API key and base URL points at the mock LLM."""
+    keys = ",".join(f"mock-key-{i}" for i in range(1, MOCK_KEYS + 1))
+    return {**os.environ, "OPENAI_API_BASE": base_url, "OPENAI_API_KEY": "mock-key-1", "OPENAI_API_KEYS": keys,
+            "GOOGLE_API_KEY": "mock-key-1", "GOOGLE_API_KEYS": keys, "METRICS_PROM_FILE": ""}
+
+
+def format_seconds(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["STAA", "STAG"], default="STAA")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="concurrent sessions")
+    parser.add_argument("--documents", type=int, default=3, help="documents uploaded by each session")
+    parser.add_argument("--mix", type=float, nargs=3, default=[0.6, 0.3, 0.1], metavar=("SMALL", "MEDIUM", "LARGE"),
+                        help="share of small (3k), medium (24k) and large (80k character) documents")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mock seconds per call before output")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100.0, help="mock output speed")
+    parser.add_argument("--child", metavar="BASE_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # One level in a fresh process, so its peak RSS is not inflated by earlier levels.
+        print(json.dumps(run_level(args.app, args.levels[0], args.documents, args.mix, args.child)))
+        return
+
+    base_url = start_mock_llm(args.llm_latency, args.llm_tokens_per_second)
+    print(f"{args.app}: {args.documents} documents per session, mix {args.mix}, mock LLM {args.llm_latency}s "
+          f"+ {args.llm_tokens_per_second:g} tokens/s")
+    print(f"{'sessions':>8} {'done':>5} {'sessions/s':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'small p95':>9} "
+          f"{'calls':>6} {'RSS MiB':>8} {'peak MiB':>8}")
+    for level in args.levels:
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", base_url, "--app", args.app, "--levels", str(level),
+             "--documents", str(args.documents), "--mix", *map(str, args.mix)],
+            capture_output=True, text=True, env=mock_environment(base_url),
+        )
+        if child.returncode != 0:
+            print(f"{level:>8} failed: {child.stderr.strip().splitlines()[-1] if child.stderr.strip() else child.returncode}")
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        print(f"{level:>8} {result['completed']:>5} {result['sessions_per_second']:>10.2f} "
+              f"{format_seconds(result['p50']):>7} {format_seconds(result['p95']):>7} {format_seconds(result['p99']):>7} "
+              f"{format_seconds(result['small_p95']):>9} {result['calls']:>6} {result['baseline_rss_mib']:>8.0f} "
+              f"{result['peak_rss_mib']:>8.0f}")
+        for error in result["errors"]:
+            print(f"{'':>8} error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compares the verbose JSON response format with the compact table format (compact_output).
+
+Offline (default): encodes the same synthetic findings both ways and counts output tokens locally,
+then checks that the compact form decodes back to the same number of findings.
+Live (--live FILE): analyzes the first chunks of FILE with STAA in both formats and reports
+completion tokens, seconds and findings per format (needs OPENAI_API_KEY(S)).
+Usage: python bench_output_format.py [--findings 10 50 200] [--live document.txt --chunks 3]
+"""
+import argparse
+import json
+import random
+import time
+
+import compact_output
+import findings
+import strategy
+
+SAMPLES = [
+    ("Typographical Error", "Misspelled word: '{w}' instead of '{c}'.", "Change '{w}' to '{c}'."),
+    ("Date Inconsistencies", "Coverage start date '2025-04-0{d}' is after the end date.", "Check the coverage period."),
+    ("Name Inconsistencies", "Insured name '{n}' differs from the name on page 1.", "Use '{n}son' consistently."),
+    ("Policy Number Error", "Policy number 'PN-12{d}45' does not match the declarations page.", "Use 'PN-12345'."),
+]
+
+
+def make_findings(count, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        error_type, description, suggestion = rng.choice(SAMPLES)
+        values = {"w": f"polisy{i}", "c": "policy", "d": rng.randint(1, 9), "n": rng.choice(["John Smith", "Ann Lee"])}
+        rows.append({
+            "Page_Number": rng.randint(1, 40),
+            "Line_Number": rng.randint(1, 60),
+            "Error_Type": error_type,
+            "Error_Description": description.format(**values),
+            "Suggestions": suggestion.format(**values),
+        })
+    return rows
+
+
+def offline(counts, model):
+    print(f"{'findings':>9} {'verbose tokens':>15} {'compact tokens':>15} {'ratio':>6} {'round-trip':>11}")
+    for count in counts:
+        rows = make_findings(count)
+        # Models answer in the indented layout of the prompt's example block.
+        verbose = json.dumps({"errors": rows}, indent=2)
+        compact = json.dumps(compact_output.encode(rows), separators=(",", ":"))
+        verbose_tokens = strategy.count_tokens(verbose, model)
+        compact_tokens = strategy.count_tokens(compact, model)
+        decoded = len(findings.decode_findings(compact))
+        print(f"{count:>9} {verbose_tokens:>15,} {compact_tokens:>15,} {compact_tokens / verbose_tokens:>6.2f} "
+              f"{decoded:>5}/{count:<5}")
+
+
+def live(path, chunks):
+    import metrics
+    import STAA
+
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    pieces = STAA.chunk_text(text)[:chunks]
+    print(f"{'format':<7} {'chunks':>6} {'completion tokens':>18} {'seconds':>8} {'findings':>9}")
+    for output_format in ("json", "table"):
+        with metrics.track_run() as run:
+            start = time.perf_counter()
+            found = 0
+            for i, chunk in enumerate(pieces):
+                errors = STAA.analyze_chunk_with_gpt(chunk, document=path, chunk_index=i, output_format=output_format)
+                found += len(errors or [])
+            seconds = time.perf_counter() - start
+        completion = sum(u["completion_tokens"] for u in run.usage)
+        print(f"{output_format:<7} {len(pieces):>6} {completion:>18,} {seconds:>8.1f} {found:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--findings", type=int, nargs="*", default=[10, 50, 200])
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--live", metavar="FILE", help="also time real model calls on this text file")
+    parser.add_argument("--chunks", type=int, default=3)
+    args = parser.parse_args()
+
+    offline(args.findings, args.model)
+    if args.live:
+        live(args.live, args.chunks)
+
+
+if __name__ == "__main__":
+    main()
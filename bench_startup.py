@@ -0,0 +1,59 @@
+"""
+Measures cold-start import time of the Streamlit apps and their heavy dependencies.
+
+Each module is imported in a fresh interpreter so nothing is shared between samples.
+Usage: python bench_startup.py [--repeat 5] [module ...]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    "streamlit",
+    "pandas",
+    "PyPDF2",
+    "docx",
+    "openai",
+    "google.generativeai",
+    "STA",
+    "STAA",
+    "STAG",
+    "STA_Summary",
+]
+
+SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def time_import(module, repeat):
+    """Returns the import times in seconds, or None if the module cannot be imported."""
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(module=module)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return None
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<22} {'median (ms)':>12} {'min (ms)':>10}")
+    for module in args.modules:
+        samples = time_import(module, args.repeat)
+        if samples is None:
+            print(f"{module:<22} {'not importable':>23}")
+            continue
+        print(f"{module:<22} {statistics.median(samples) * 1000:>12.1f} {min(samples) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+import findings as finding_records
+import metrics
+
+DEFAULT_DB = os.getenv("BOILERPLATE_DB", "boilerplate_index.sqlite3")
+MIN_PARAGRAPH_CHARS = 40
+
+_QUOTED_RE = re.compile(r"'([^']{3,})'")
+_SPACE_RE = re.compile(r"\s+")
+_SENTENCE_END_RE = re.compile(r"[.!?:;][\"')\]]*\s*$")
+
+
+def fingerprint(paragraph):
+    """Fingerprint of a paragraph that ignores case and whitespace differences."""
+    normalized = _SPACE_RE.sub(" ", paragraph).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _signature(findings):
+    return json.dumps(sorted(json.dumps(f, sort_keys=True) for f in findings))
+
+
+def _attribute(findings, paragraphs):
+    """Maps each finding to the (first, last) line span of the paragraph it quotes (or names by Line_Number)."""
+    by_span = {}
+    for finding in findings:
+        description = finding.Error_Description
+        target = None
+        for quoted in _QUOTED_RE.findall(description):
+            target = next((span for span, text in paragraphs.items() if quoted in text), None)
+            if target is not None:
+                break
+        if target is None and finding.Line_Number is not None:
+            target = next((span for span in paragraphs if span[0] <= finding.Line_Number <= span[1]), None)
+        if target is not None:
+            # Stored relative to the paragraph's first line so it can be re-attached wherever the paragraph is.
+            local = {k: v for k, v in finding.items() if k != "Page_Number"}
+            line = finding.Line_Number
+            local["Line_Number"] = line - target[0] if line is not None and target[0] <= line <= target[1] else 0
+            by_span.setdefault(target, []).append(local)
+    return by_span
+
+
+class BoilerplateIndex:
+    """
+    SQLite index of paragraph fingerprints across past uploads.
+    A paragraph (see _paragraphs) becomes boilerplate once it has produced the same findings (possibly none)
+    in min_seen consecutive analyses; it is then stripped from model input and its
+    findings are re-attached locally.
+    """
+
+    def __init__(self, path=DEFAULT_DB, min_seen=3):
+        self.path = path
+        self.min_seen = min_seen
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS paragraphs ("
+                " fingerprint TEXT PRIMARY KEY,"
+                " seen INTEGER NOT NULL DEFAULT 0,"
+                " stable INTEGER NOT NULL DEFAULT 0,"
+                " findings TEXT)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _paragraphs(self, text):
+        """
+        Returns {(first_line, last_line): paragraph} for paragraphs long enough to be standard wording.
+        A paragraph is a run of lines ending at a blank line or at a line that ends a sentence, so
+        PDF and xlsx text, which wrap sentences over several lines, is never cut mid-sentence.
+        """
+        lines = text.split("\n")
+        spans = []
+        first = None
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                if first is not None:
+                    spans.append((first, number - 1))
+                first = None
+                continue
+            first = first or number
+            if _SENTENCE_END_RE.search(line):
+                spans.append((first, number))
+                first = None
+        if first is not None:
+            spans.append((first, len(lines)))
+        paragraphs = {}
+        for first, last in spans:
+            paragraph = "\n".join(lines[first - 1:last])
+            if len(paragraph.strip()) >= MIN_PARAGRAPH_CHARS:
+                paragraphs[(first, last)] = paragraph
+        return paragraphs
+
+    def strip(self, text):
+        """
+        Removes known boilerplate paragraphs from text.
+        Returns (reduced_text, line_map, reattached) where line_map[i] is the original line of
+        reduced line i + 1 and reattached holds the cached findings with original line numbers.
+        """
+        lines = text.split("\n")
+        paragraphs = self._paragraphs(text)
+        prints = {span: fingerprint(p) for span, p in paragraphs.items()}
+        known = {}
+        with self._connect() as conn:
+            for span, fp in prints.items():
+                row = conn.execute(
+                    "SELECT findings FROM paragraphs WHERE fingerprint = ? AND stable >= ?",
+                    (fp, self.min_seen),
+                ).fetchone()
+                if row is not None:
+                    known[span] = finding_records.from_rows(json.loads(row[0]))
+            conn.executemany(
+                "UPDATE paragraphs SET seen = seen + 1 WHERE fingerprint = ?",
+                [(prints[span],) for span in known],
+            )
+
+        stripped = set()
+        reattached = []
+        for (first, last), found in sorted(known.items()):
+            stripped.update(range(first, last + 1))
+            reattached.extend(f.replace(Line_Number=first + (f.Line_Number or 0)) for f in found)
+        kept, line_map = [], []
+        for number, line in enumerate(lines, start=1):
+            if number not in stripped:
+                kept.append(line)
+                line_map.append(number)
+        return "\n".join(kept), line_map, reattached
+
+    def observe(self, text, findings, skip_lines=()):
+        """
+        Records the findings produced for the analyzed paragraphs of text. A paragraph repeated within
+        the document counts as one observation, with the findings of its first occurrence.
+        """
+        skip = set(skip_lines)
+        paragraphs = {span: text for span, text in self._paragraphs(text).items()
+                      if skip.isdisjoint(range(span[0], span[1] + 1))}
+        by_span = _attribute(findings, paragraphs)
+        observed = {}
+        for span, paragraph in paragraphs.items():
+            observed.setdefault(fingerprint(paragraph), by_span.get(span, []))
+        with self._connect() as conn:
+            for fp, local in observed.items():
+                row = conn.execute("SELECT findings FROM paragraphs WHERE fingerprint = ?", (fp,)).fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO paragraphs (fingerprint, seen, stable, findings) VALUES (?, 1, 1, ?)",
+                                 (fp, json.dumps(local)))
+                elif _signature(json.loads(row[0])) == _signature(local):
+                    conn.execute("UPDATE paragraphs SET seen = seen + 1, stable = stable + 1 WHERE fingerprint = ?", (fp,))
+                else:
+                    conn.execute("UPDATE paragraphs SET seen = seen + 1, stable = 1, findings = ? WHERE fingerprint = ?",
+                                 (json.dumps(local), fp))
+
+
+def remap_lines(findings, line_map):
+    """Maps Line_Number values of findings on reduced text back to original line numbers."""
+    remapped = []
+    for finding in findings:
+        line = finding.Line_Number
+        if line is not None and 1 <= line <= len(line_map):
+            finding = finding.replace(Line_Number=line_map[line - 1])
+        remapped.append(finding)
+    return remapped
+
+
+def analyze_without_boilerplate(text, analyze, index, document=None):
+    """
+    Runs analyze(reduced_text, failed) on text with known boilerplate removed, then merges the
+    remapped model findings with the cached boilerplate findings. analyze appends the chunks it
+    got no findings for (failed or over budget) to failed; the index only learns from complete analyses,
+    since a missing chunk would otherwise record its paragraphs as having no findings.
+    """
+    reduced, line_map, reattached = index.strip(text)
+    failed = []
+    findings = analyze(reduced, failed) if reduced.strip() else []
+    findings = remap_lines(findings, line_map)
+    if failed:
+        metrics.record_metadata(f"{document}: boilerplate index", f"not updated ({len(failed)} chunks not analyzed)")
+    else:
+        stripped = sorted(set(range(1, text.count("\n") + 2)) - set(line_map))
+        index.observe(text, findings, skip_lines=stripped)
+    metrics.record_metadata(f"{document}: boilerplate chars stripped", f"{len(text) - len(reduced)}/{len(text)}")
+    return findings + reattached
@@ -0,0 +1,55 @@
+import re
+
+# Escalation thresholds for the cheap-first cascade.
+MAX_CHEAP_FINDINGS = 8
+MAX_FIGURES_PER_1000_CHARS = 6.0
+# Canonical Error_Type values (compact_output.ERROR_TYPES) worth a second opinion on their own.
+HIGH_RISK_TYPES = ("Policy Number Error", "Coverage Amount Error")
+_HIGH_RISK_KEYS = {t.lower().rstrip("s") for t in HIGH_RISK_TYPES}
+
+_MONEY_RE = re.compile(r"(?:[$€£]\s?\d[\d,]*(?:\.\d+)?|\b\d[\d,]*(?:\.\d+)?\s?(?:USD|EUR|GBP|INR|dollars)\b)", re.IGNORECASE)
+_DATE_RE = re.compile(
+    r"\b(?:\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}[ -](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[ -]\d{2,4})\b",
+    re.IGNORECASE,
+)
+
+
+def figure_density(chunk):
+    """Money amounts and dates per 1000 characters."""
+    if not chunk:
+        return 0.0
+    figures = len(_MONEY_RE.findall(chunk)) + len(_DATE_RE.findall(chunk))
+    return figures * 1000 / len(chunk)
+
+
+def escalation_reasons(chunk, findings):
+    """
+    Returns why a chunk analyzed by the cheap model should be re-analyzed by the strong one.
+    findings is None when the cheap model gave no parseable response.
+    """
+    reasons = []
+    if findings is None:
+        return ["cheap model response could not be parsed"]
+    if len(findings) >= MAX_CHEAP_FINDINGS:
+        reasons.append(f"{len(findings)} findings")
+    density = figure_density(chunk)
+    if density >= MAX_FIGURES_PER_1000_CHARS:
+        reasons.append(f"{density:.1f} amounts/dates per 1000 chars")
+    risky = [f for f in findings if _canonical_type(f) in _HIGH_RISK_KEYS]
+    if risky:
+        reasons.append(f"{len(risky)} policy number/coverage amount findings")
+    return reasons
+
+
+def _canonical_type(finding):
+    return str(finding.get("Error_Type", "")).strip().lower().rstrip("s")
+
+
+def _finding_key(finding):
+    return finding.get("Line_Number"), _canonical_type(finding)
+
+
+def merge_findings(cheap, strong):
+    """Strong-model findings win; cheap findings are kept only where the strong model reported nothing similar."""
+    seen = {_finding_key(f) for f in strong}
+    return list(strong) + [f for f in cheap or [] if _finding_key(f) not in seen]
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import findings as finding_records
+
+DEFAULT_MEMORY_BYTES = int(os.getenv("CHUNK_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# A unit ends at a newline or after sentence punctuation followed by whitespace, so boundaries
+# fall between sentences/lines and PDF text joined without newlines still gets split points.
+_UNIT_RE = re.compile(r"[^\n.!?;]*(?:[.!?;]+(?:\s+|$)|\n|$)")
+
+
+def _units(text, max_size):
+    for match in _UNIT_RE.finditer(text):
+        start, end = match.span()
+        if start == end:
+            continue
+        # Hard-split pathological units (no punctuation or newlines) so no chunk exceeds max_size.
+        for piece_start in range(start, end, max_size):
+            yield piece_start, min(piece_start + max_size, end)
+
+
+def content_defined_chunks(text, min_size=4000, avg_size=8000, max_size=12000):
+    """
+    Splits text into chunks whose boundaries depend only on nearby content.
+
+    Each unit (sentence or line) is hashed with crc32; a unit closes a chunk when its hash falls
+    below a threshold proportional to the unit length, giving ~avg_size chunks on average. An edit
+    only moves the boundaries next to it, so the other chunks of a revised document hash identically.
+    Returns a list of (start_offset, chunk) pairs.
+    """
+    chunks = []
+    chunk_start = 0
+    spread = max(avg_size - min_size, 1)
+    for unit_start, unit_end in _units(text, max_size):
+        if unit_end - chunk_start > max_size and unit_start > chunk_start:
+            chunks.append((chunk_start, text[chunk_start:unit_start]))
+            chunk_start = unit_start
+        size = unit_end - chunk_start
+        if size < min_size:
+            continue
+        unit = text[unit_start:unit_end]
+        threshold = min(1.0, (unit_end - unit_start) / spread) * 0xFFFFFFFF
+        if zlib.crc32(unit.encode("utf-8")) <= threshold:
+            chunks.append((chunk_start, text[chunk_start:unit_end]))
+            chunk_start = unit_end
+    if chunk_start < len(text):
+        chunks.append((chunk_start, text[chunk_start:]))
+    return chunks
+
+
+def line_at(text, offset):
+    """1-based line number of a character offset."""
+    return text.count("\n", 0, offset) + 1
+
+
+def shift_line_numbers(findings, offset):
+    """Returns copies of Findings with their Line_Number shifted by offset lines."""
+    if not offset:
+        return list(findings)
+    return [f if f.Line_Number is None else f.replace(Line_Number=f.Line_Number + offset) for f in findings]
+
+
+class ChunkResultCache:
+    """
+    Findings per chunk keyed by chunk content, model and prompt version.
+    Findings are stored relative to their chunk so they can be remapped to wherever the
+    chunk lands in a revised document. The in-memory tier is an LRU bounded by the findings' JSON
+    size (CHUNK_CACHE_MAX_BYTES); CHUNK_CACHE_DIR adds a shared on-disk tier.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MEMORY_BYTES):
+        self.directory = directory if directory is not None else os.getenv("CHUNK_CACHE_DIR")
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(chunk, model, prompt_version):
+        digest = hashlib.sha256(f"{model}|{prompt_version}|".encode("utf-8"))
+        digest.update(chunk.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        findings = entry[0] if entry is not None else None
+        if findings is None and self.directory:
+            try:
+                with open(os.path.join(self.directory, f"{key}.json"), "r", encoding="utf-8") as f:
+                    data = f.read()
+                findings = finding_records.from_rows(json.loads(data))
+                self._put_memory(key, findings, len(data))
+            except (OSError, ValueError):
+                findings = None
+        if findings is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return findings
+
+    def put(self, key, findings):
+        data = json.dumps(findings, default=finding_records.json_default)
+        self._put_memory(key, findings, len(data))
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.json")
+            # Writers sharing the directory (watch_folder threads, app processes) each use their own temp file.
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def _put_memory(self, key, findings, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (findings, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+
+
+def session_chunk_cache(session_state):
+    """Returns the per-session ChunkResultCache, creating it on first use."""
+    if "chunk_cache" not in session_state:
+        session_state["chunk_cache"] = ChunkResultCache()
+    return session_state["chunk_cache"]
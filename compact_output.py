@@ -0,0 +1,107 @@
+"""
+Compact tabular response format.
+
+Instead of one verbose object per finding, the model returns a header row and one array per
+finding, with numeric error-type codes and the quoted span plus its fix instead of full sentences:
+
+    {"c": ["p", "l", "t", "q", "f", "n"], "r": [[1, 25, 1, "insurence", "insurance", "Misspelled word"]]}
+
+expand() turns this back into the report's error schema, so findings.decode_findings accepts both formats.
+"""
+import re
+
+# Error-type codes used in the "t" column.
+ERROR_TYPES = {
+    1: "Typographical Error",
+    2: "Name Inconsistencies",
+    3: "Date Inconsistencies",
+    4: "Policy Number Error",
+    5: "Coverage Amount Error",
+    6: "Terminology Error",
+    7: "Missing Information",
+    8: "Other",
+}
+COLUMNS = {"p": "page", "l": "line", "t": "type", "q": "quote", "f": "fix", "n": "note"}
+DEFAULT_HEADER = ["p", "l", "t", "q", "f", "n"]
+
+# Rough share of the verbose format's output tokens, from bench_output_format.py; used for pre-flight estimates.
+OUTPUT_TOKEN_SCALE = 0.45
+
+PROMPT_SPEC = """**Output Requirements (compact table):**
+- Output a single JSON object {{"c": ["p", "l", "t", "q", "f", "n"], "r": [...]}} and nothing else.
+- "r" holds one array per error, in the column order of "c":
+  - p: page number (integer), l: line number (integer)
+  - t: error type code: {codes}
+  - q: the exact erroneous text quoted from the document (short)
+  - f: the corrected text for q, or "" when there is no direct replacement
+  - n: a note of at most 8 words, or "" when q and f say it all
+- Example: {{"c": ["p", "l", "t", "q", "f", "n"], "r": [[1, 25, 1, "insurence", "insurance", "Misspelled word"], [7, 22, 3, "2025-04-01", "", "Start date after end date 2025-03-31"]]}}
+- If there are no errors, output {{"c": ["p", "l", "t", "q", "f", "n"], "r": []}}.
+
+"""
+
+_OUTPUT_SECTION_RE = re.compile(r"\*\*Output Requirements:\*\*.*?(?=\*\*Note:\*\*|\*\*Input document:\*\*)", re.DOTALL)
+
+
+def prompt_spec():
+    codes = ", ".join(f"{code} = {name}" for code, name in ERROR_TYPES.items())
+    return PROMPT_SPEC.format(codes=codes)
+
+
+def apply_to_prompt(prompt):
+    """Replaces a prompt's verbose output requirements and examples with the compact table spec."""
+    return _OUTPUT_SECTION_RE.sub(lambda _: prompt_spec(), prompt, count=1)
+
+
+def is_compact(parsed):
+    return isinstance(parsed, dict) and isinstance(parsed.get("r"), list)
+
+
+def expand(parsed):
+    """Expands a compact response into dict rows in the verbose error schema; malformed rows are skipped."""
+    header = [COLUMNS.get(str(name).lower()) for name in parsed.get("c") or DEFAULT_HEADER]
+    rows = []
+    for values in parsed["r"]:
+        if not isinstance(values, list):
+            continue
+        cells = dict(zip(header, values))
+        code = cells.get("type")
+        try:
+            error_type = ERROR_TYPES.get(int(code), ERROR_TYPES[8])
+        except (TypeError, ValueError):
+            error_type = str(code or ERROR_TYPES[8])
+        quote = str(cells.get("quote") or "").strip()
+        fix = str(cells.get("fix") or "").strip()
+        note = str(cells.get("note") or "").strip()
+        if note and quote:
+            description = f"{note}: '{quote}'."
+        elif quote:
+            description = f"{error_type}: '{quote}'."
+        else:
+            description = note
+        if quote and fix:
+            suggestion = f"Change '{quote}' to '{fix}'."
+        else:
+            suggestion = fix
+        rows.append({
+            "Page_Number": cells.get("page"),
+            "Line_Number": cells.get("line"),
+            "Error_Type": error_type,
+            "Error_Description": description,
+            "Suggestions": suggestion,
+        })
+    return rows
+
+
+def encode(findings):
+    """Encodes findings in the compact format (used by bench_output_format.py to compare output sizes)."""
+    codes = {name: code for code, name in ERROR_TYPES.items()}
+    rows = []
+    for finding in findings:
+        quotes = re.findall(r"'([^']+)'", finding.get("Error_Description", "") + " " + finding.get("Suggestions", ""))
+        quote = quotes[0] if quotes else ""
+        fix = quotes[1] if len(quotes) > 1 else ""
+        note = finding.get("Error_Description", "").split(":")[0][:60]
+        rows.append([finding.get("Page_Number"), finding.get("Line_Number"),
+                     codes.get(finding.get("Error_Type"), 8), quote, fix, note])
+    return {"c": DEFAULT_HEADER, "r": rows}
@@ -0,0 +1,102 @@
+import re
+import zipfile
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# part: "header"/"body"/"footer" plus the part file name, kind: "paragraph" or "cell".
+# index is the paragraph number within the part; table/row/col are 1-based and None for paragraphs.
+DocxBlock = namedtuple("DocxBlock", ["part", "kind", "index", "table", "row", "col", "text"])
+
+_HEADER_RE = re.compile(r"^word/header\d*\.xml$")
+_FOOTER_RE = re.compile(r"^word/footer\d*\.xml$")
+
+
+def _parts(archive):
+    names = archive.namelist()
+    headers = sorted(n for n in names if _HEADER_RE.match(n))
+    footers = sorted(n for n in names if _FOOTER_RE.match(n))
+    return [("header", n) for n in headers] + [("body", "word/document.xml")] + [("footer", n) for n in footers]
+
+
+def _iter_part(stream, part):
+    """Streams one WordprocessingML part, yielding paragraphs and table cells in document order."""
+    paragraph_index = 0
+    paragraphs = []           # stack of text-run lists; text boxes nest paragraphs inside runs
+    cells = []                # stack of paragraph lists, one per open table cell (nested tables)
+    tables = []               # stack of [table_number, row, col]
+    table_count = 0
+
+    for event, elem in iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == W + "p":
+                paragraphs.append([])
+            elif tag == W + "tbl":
+                table_count += 1
+                tables.append([table_count, 0, 0])
+            elif tag == W + "tr" and tables:
+                tables[-1][1] += 1
+                tables[-1][2] = 0
+            elif tag == W + "tc" and tables:
+                tables[-1][2] += 1
+                cells.append([])
+            continue
+
+        if tag == W + "t" and paragraphs:
+            paragraphs[-1].append(elem.text or "")
+        elif tag == W + "tab" and paragraphs:
+            paragraphs[-1].append("\t")
+        elif tag in (W + "br", W + "cr") and paragraphs:
+            paragraphs[-1].append("\n")
+        elif tag == W + "p" and paragraphs:
+            text = "".join(paragraphs.pop())
+            if paragraphs:
+                paragraphs[-1].append(" " + text)
+            elif cells:
+                cells[-1].append(text)
+            else:
+                paragraph_index += 1
+                if text.strip():
+                    yield DocxBlock(part, "paragraph", paragraph_index, None, None, None, text)
+            elem.clear()
+        elif tag == W + "tc" and cells:
+            text = " ".join(t for t in cells.pop() if t.strip())
+            number, row, col = tables[-1]
+            if text:
+                yield DocxBlock(part, "cell", paragraph_index, number, row, col, text)
+            elem.clear()
+        elif tag == W + "tbl" and tables:
+            tables.pop()
+            elem.clear()
+
+
+def iter_docx_blocks(file):
+    """
+    Yields DocxBlock records for headers, body and footers of a .docx without building the python-docx DOM.
+    Parts are parsed with iterparse and processed elements are cleared as soon as they are emitted.
+    """
+    with zipfile.ZipFile(file) as archive:
+        for kind, name in _parts(archive):
+            part = kind if kind == "body" else f"{kind}:{name.rsplit('/', 1)[-1]}"
+            with archive.open(name) as stream:
+                yield from _iter_part(stream, part)
+
+
+def format_block(block):
+    """Renders a block as one text line, tagging table cells and header/footer text with their position."""
+    if block.kind == "cell":
+        prefix = f"[Table {block.table} R{block.row}C{block.col}] "
+    else:
+        prefix = ""
+    if block.part.startswith("header"):
+        prefix = f"[Header] {prefix}"
+    elif block.part.startswith("footer"):
+        prefix = f"[Footer] {prefix}"
+    return prefix + block.text
+
+
+def read_docx_text(file):
+    """Returns the text of a .docx, one paragraph or table cell per line."""
+    return "\n".join(format_block(block) for block in iter_docx_blocks(file))
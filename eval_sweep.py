@@ -0,0 +1,412 @@
+"""
+Sweeps chunking and prompt settings over a labeled corpus and reports recall/precision against
+tokens, calls and model latency, marking the Pareto-optimal settings.
+
+Ground truth comes from report workbooks in the export format (Analysis_Report_Google.xlsx:
+Document Name, Page_Number, Line_Number, Error_Type, ...) whose Document Name matches a file in
+--corpus, and/or from --inject N known typos per document (letter swaps and doubled words at
+seeded positions). A finding matches a label of the same document within --tolerance lines and
+of the same error category (first word of the type; --ignore-type matches on lines only); each
+label is matched at most once.
+
+Grid: --apps STA STAA STAG x --models x --chunk-sizes x --overlaps x --prompts (full, compact,
+table) x --max-tokens. STAA/STAG chunks go through the app's own chunk analysis (prompt, router,
+decoder); overlapping chunks are merged like the cascade merges findings. STA sends whole
+documents, so only its max_tokens varies. Models apply to the app of their provider.
+
+Models are called live (--mode live), live while recording every response to --recordings
+(--mode record), or replayed from that file without API keys (--mode replay). Replayed calls
+report their recorded latency; calls missing from the recordings count as "missing" and return
+no findings.
+Usage: python eval_sweep.py --corpus docs/ --labels Analysis_Report_Google.xlsx [--inject 5]
+           [--apps STAA STAG] [--chunk-sizes 4000 8000 16000] [--overlaps 0 400] [--mode replay]
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import cascade
+import cdc
+import findings as finding_records
+import metrics
+
+PROMPTS = {"full": (False, "json"), "compact": (True, "json"), "table": (False, "table")}
+APP_MODELS = {"STA": ("gpt-4o-mini",), "STAA": ("gpt-4o-mini", "gpt-4o", "gpt-4"),
+              "STAG": ("gemini-1.5-pro", "gemini-1.5-flash")}
+DEFAULT_MODELS = {"STA": "gpt-4o-mini", "STAA": "gpt-4o-mini", "STAG": "gemini-1.5-pro"}
+CORPUS_EXTENSIONS = (".txt", ".pdf", ".docx", ".xlsx")
+_WORD_RE = re.compile(r"\b[A-Za-z]{6,}\b")
+
+
+class Recorder:
+    """Times model calls at the SDK boundary and records or replays their responses by request hash."""
+
+    def __init__(self, mode, path):
+        self.mode = mode
+        self.path = path
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.seconds = 0.0
+        self.missing = 0
+        if mode == "replay":
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.responses[entry["key"]] = entry
+
+    @staticmethod
+    def key(provider, request):
+        return hashlib.sha256(json.dumps([provider, request], sort_keys=True).encode()).hexdigest()
+
+    def call(self, provider, request, send):
+        """Returns the response data, or None for a replay miss; send() makes the live call and returns JSON data."""
+        key = self.key(provider, request)
+        if self.mode == "replay":
+            entry = self.responses.get(key)
+            with self.lock:
+                if entry is None:
+                    self.missing += 1
+                    return None
+                self.seconds += entry["seconds"]
+            return entry["response"]
+        start = time.perf_counter()
+        response = send()
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.seconds += seconds
+            if self.mode == "record":
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "provider": provider, "seconds": seconds, "response": response}) + "\n")
+        return response
+
+    def openai_create(self, openai, original):
+        def create(**kwargs):
+            request = {k: v for k, v in kwargs.items() if k != "api_key"}
+            data = self.call("openai", request, lambda: json.loads(json.dumps(original(**kwargs))))
+            if data is None:
+                data = {"choices": [{"index": 0, "message": {"role": "assistant", "content": '{"errors": []}'}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0}}
+            return openai.util.convert_to_openai_object(data)
+        return create
+
+    def genai(self, real=None):
+        recorder = self
+
+        class Model:
+            def __init__(self, model_name, generation_config=None):
+                self.model_name = model_name
+                self.generation_config = generation_config
+
+            def generate_content(self, prompt):
+                def send():
+                    response = real.GenerativeModel(self.model_name, generation_config=self.generation_config) \
+                        .generate_content(prompt)
+                    usage = response.usage_metadata
+                    return {"text": response.text, "prompt_tokens": usage.prompt_token_count,
+                            "completion_tokens": usage.candidates_token_count}
+
+                request = {"model": self.model_name, "config": self.generation_config, "prompt": prompt}
+                data = recorder.call("gemini", request, send)
+                data = data or {"text": '{"errors": []}', "prompt_tokens": 0, "completion_tokens": 0}
+                return SimpleNamespace(text=data["text"], usage_metadata=SimpleNamespace(
+                    prompt_token_count=data["prompt_tokens"], candidates_token_count=data["completion_tokens"],
+                    cached_content_token_count=0,
+                ))
+
+        def configure(**kwargs):
+            if real is not None:
+                real.configure(**kwargs)
+
+        return SimpleNamespace(configure=configure, GenerativeModel=Model)
+
+
+@contextlib.contextmanager
+def intercept(apps, recorder):
+    """Routes the apps' OpenAI and Gemini SDK calls through the recorder for the duration of the block."""
+    restore = []
+    openai_apps = [app for name, app in apps.items() if name in ("STA", "STAA")]
+    if openai_apps:
+        openai = openai_apps[0].get_openai()
+        original = openai.ChatCompletion.create
+        openai.ChatCompletion.create = recorder.openai_create(openai, original)
+        restore.append(lambda: setattr(openai.ChatCompletion, "create", original))
+    if "STAG" in apps:
+        stag = apps["STAG"]
+        get_genai = stag.get_genai
+        proxy = recorder.genai(None if recorder.mode == "replay" else get_genai())
+        stag.get_genai = lambda: proxy
+        restore.append(lambda: setattr(stag, "get_genai", get_genai))
+    try:
+        yield
+    finally:
+        for undo in restore:
+            undo()
+
+
+@contextlib.contextmanager
+def max_tokens_override(app, model, max_tokens):
+    """Temporarily sets the app's output token limit (STA: one int; STAA: per model)."""
+    if max_tokens is None or not hasattr(app, "MAX_OUTPUT_TOKENS"):
+        yield
+        return
+    original = app.MAX_OUTPUT_TOKENS
+    app.MAX_OUTPUT_TOKENS = {**original, model: max_tokens} if isinstance(original, dict) else max_tokens
+    try:
+        yield
+    finally:
+        app.MAX_OUTPUT_TOKENS = original
+
+
+def overlapping_chunks(text, chunk_size, overlap):
+    """(offset, chunk) pairs of chunk_size characters, each starting `overlap` characters before the previous end."""
+    step = max(chunk_size - overlap, 1)
+    return [(offset, text[offset:offset + chunk_size]) for offset in range(0, max(len(text), 1), step)
+            if offset == 0 or offset + overlap < len(text)]
+
+
+def analyze(app_name, app, text, document, config):
+    """Runs one document through an app under one grid configuration and returns its findings."""
+    model, chunk_size, overlap, prompt = config["model"], config["chunk_size"], config["overlap"], config["prompt"]
+    with max_tokens_override(app, model, config["max_tokens"]):
+        if app_name == "STA":
+            return app.analyze_text_with_gpt(text, document=document)
+        compact, output_format = PROMPTS[prompt]
+        merged = []
+        line_offset = 0
+        previous_offset = 0
+        for index, (offset, chunk) in enumerate(overlapping_chunks(text, chunk_size, overlap)):
+            line_offset += text.count("\n", previous_offset, offset)
+            previous_offset = offset
+            if app_name == "STAG":
+                errors = app.analyze_chunk_with_gemini(chunk, document=document, chunk_index=index, model=model,
+                                                       compact_prompt=compact, output_format=output_format)
+            else:
+                errors = app.analyze_chunk_with_gpt(chunk, document=document, chunk_index=index, model=model,
+                                                    compact_prompt=compact, output_format=output_format)
+            if errors:
+                # Findings repeated in the overlap keep their first occurrence, as the cascade merges findings.
+                merged = cascade.merge_findings(cdc.shift_line_numbers(errors, line_offset), merged)
+        return merged
+
+
+def category(error_type):
+    """Coarse error category for matching: 'Name Inconsistency' and 'Name Inconsistencies' both give 'name'."""
+    return re.sub(r"[^a-z]", "", (error_type or "").lower().split(" ")[0].split("-")[0])[:4]
+
+
+def match(predicted, labels, tolerance, ignore_type=False):
+    """Greedy one-to-one matching by line distance; returns the number of matched labels."""
+    free = list(labels)
+    matched = 0
+    for finding in sorted(predicted, key=lambda f: f.Line_Number or 0):
+        if finding.Line_Number is None:
+            continue
+        candidates = [
+            label for label in free
+            if label.Line_Number is not None and abs(label.Line_Number - finding.Line_Number) <= tolerance
+            and (ignore_type or category(label.Error_Type) == category(finding.Error_Type))
+        ]
+        if candidates:
+            free.remove(min(candidates, key=lambda label: abs(label.Line_Number - finding.Line_Number)))
+            matched += 1
+    return matched
+
+
+def load_labels(paths):
+    """{document name: [Finding]} from report workbooks; documents listed without findings get []."""
+    import pandas as pd
+
+    labels = {}
+    for path in paths:
+        for row in pd.read_excel(path).to_dict("records"):
+            row = {key: value for key, value in row.items() if not pd.isna(value)}
+            document = row.pop("Document Name", None)
+            if document is None:
+                continue
+            found = labels.setdefault(str(document), [])
+            finding = finding_records.coerce(row)
+            if finding is not None:
+                found.append(finding)
+    return labels
+
+
+def inject_errors(text, count, seed):
+    """Adds `count` typos at seeded lines (letter swaps and doubled words) and returns (text, labels)."""
+    rng = random.Random(seed)
+    lines = text.split("\n")
+    candidates = [i for i, line in enumerate(lines) if _WORD_RE.search(line)]
+    labels = []
+    for n, i in enumerate(sorted(rng.sample(candidates, min(count, len(candidates))))):
+        word = rng.choice(_WORD_RE.findall(lines[i]))
+        # Swapping two equal letters ("committee") changes nothing; such words get a doubled word instead.
+        swaps = [j for j in range(1, len(word) - 2) if word[j] != word[j + 1]]
+        if n % 2 == 0 and swaps:
+            j = rng.choice(swaps)
+            wrong = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+            description = f"Misspelled word '{wrong}'."
+        else:
+            wrong = f"{word} {word}"
+            description = f"Repeated word '{word}'."
+        lines[i] = re.sub(rf"\b{word}\b", wrong, lines[i], count=1)
+        labels.append(finding_records.Finding(None, i + 1, "Typographical Error", description, f"Use '{word}'."))
+    return "\n".join(lines), labels
+
+
+def load_corpus(directory, labels, inject):
+    """Returns [(document, text, labels)] for labeled (or injected) documents, parsed with STAA's reader."""
+    import STAA
+
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(CORPUS_EXTENSIONS) or (name not in labels and not inject):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            upload = io.BytesIO(f.read())
+        upload.name = name
+        text = STAA.read_uploaded_file(upload)
+        if not text:
+            continue
+        known = list(labels.get(name, []))
+        if inject:
+            text, injected = inject_errors(text, inject, seed=name)
+            known += injected
+        corpus.append((name, text, known))
+    return corpus
+
+
+def grid(args):
+    configs = []
+    for app_name in args.apps:
+        models = [m for m in args.models if m in APP_MODELS[app_name]] or [DEFAULT_MODELS[app_name]]
+        max_tokens = args.max_tokens if app_name != "STAG" else [None]
+        if app_name == "STA":
+            axes = itertools.product(models, [None], [None], ["full"], max_tokens)
+        else:
+            axes = itertools.product(models, args.chunk_sizes, args.overlaps, args.prompts, max_tokens)
+        for model, chunk_size, overlap, prompt, tokens in axes:
+            if overlap is not None and overlap >= chunk_size:
+                continue
+            configs.append({"app": app_name, "model": model, "chunk_size": chunk_size, "overlap": overlap,
+                            "prompt": prompt, "max_tokens": tokens})
+    return configs
+
+
+def evaluate(configs, corpus, recorder, apps, tolerance, ignore_type):
+    rows = []
+    total_labels = sum(len(known) for _, _, known in corpus)
+    for config in configs:
+        app = apps[config["app"]]
+        predicted = matched = calls = tokens = 0
+        cost = 0.0
+        recorder.seconds = 0.0
+        recorder.missing = 0
+        for document, text, known in corpus:
+            with metrics.track_run() as run:
+                found = analyze(config["app"], app, text, document, config)
+            found = [f for f in map(finding_records.coerce, found) if f is not None]
+            predicted += len(found)
+            matched += match(found, known, tolerance, ignore_type)
+            calls += len(run.usage)
+            tokens += run.total_tokens()
+            cost += run.total_cost()
+        recall = matched / total_labels if total_labels else 0.0
+        precision = matched / predicted if predicted else 0.0
+        rows.append({
+            **config,
+            "recall": recall,
+            "precision": precision,
+            "f1": 2 * recall * precision / (recall + precision) if recall + precision else 0.0,
+            "calls": calls,
+            "tokens": tokens,
+            "cost_usd": cost,
+            "model_seconds_per_document": recorder.seconds / len(corpus) if corpus else 0.0,
+            "missing": recorder.missing,
+        })
+    return rows
+
+
+def pareto(rows):
+    """
+    Marks rows that no other row beats on recall and precision without costing more tokens and
+    model time. Rows with replay misses are incomplete measurements and take no part.
+    """
+    def score(row):
+        return row["recall"], row["precision"], -row["tokens"], -row["model_seconds_per_document"]
+
+    complete = [score(row) for row in rows if not row["missing"]]
+    for row in rows:
+        row["pareto"] = not row["missing"] and not any(
+            all(a >= b for a, b in zip(other, score(row))) and other != score(row) for other in complete
+        )
+    return rows
+
+
+def print_table(rows):
+    def show(value):
+        return "-" if value is None else str(value)
+
+    print(f"{'':1} {'app':<5} {'model':<17} {'chunk':>6} {'overlap':>7} {'prompt':<8} {'max_tok':>7} {'recall':>6} "
+          f"{'prec':>5} {'f1':>5} {'calls':>5} {'tokens':>9} {'cost $':>8} {'s/doc':>6} {'missing':>7}")
+    for row in sorted(rows, key=lambda r: (-r["recall"], r["tokens"])):
+        print(f"{'*' if row['pareto'] else '':1} {row['app']:<5} {row['model']:<17} {show(row['chunk_size']):>6} "
+              f"{show(row['overlap']):>7} {row['prompt']:<8} {show(row['max_tokens']):>7} {row['recall']:>6.2f} "
+              f"{row['precision']:>5.2f} {row['f1']:>5.2f} {row['calls']:>5} {row['tokens']:>9,} {row['cost_usd']:>8.4f} "
+              f"{row['model_seconds_per_document']:>6.1f} {row['missing']:>7}")
+    print("* Pareto frontier: no other setting has higher recall and precision for fewer tokens and less model time.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="directory of documents")
+    parser.add_argument("--labels", nargs="*", default=[], help="report workbooks with the expected findings")
+    parser.add_argument("--inject", type=int, default=0, help="known typos to inject per document")
+    parser.add_argument("--apps", nargs="+", choices=list(APP_MODELS), default=["STAA", "STAG"])
+    parser.add_argument("--models", nargs="*", default=[], help="default: each app's default model")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[4000, 8000, 16000])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0])
+    parser.add_argument("--prompts", nargs="+", choices=list(PROMPTS), default=["full"])
+    parser.add_argument("--max-tokens", type=int, nargs="*", default=[], help="default: each app's limit")
+    parser.add_argument("--tolerance", type=int, default=2, help="line distance for a finding to match a label")
+    parser.add_argument("--ignore-type", action="store_true", help="match on line numbers only")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], default="live")
+    parser.add_argument("--recordings", default="sweep_recordings.jsonl")
+    parser.add_argument("--csv", help="also write the results to this CSV file")
+    args = parser.parse_args()
+    args.max_tokens = args.max_tokens or [None]
+
+    if args.mode == "replay":
+        # The router needs a key per provider; replayed calls never reach the API.
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+        os.environ.setdefault("GOOGLE_API_KEY", "replay")
+    import importlib
+
+    apps = {name: importlib.import_module(name) for name in args.apps}
+    corpus = load_corpus(args.corpus, load_labels(args.labels), args.inject)
+    if not corpus:
+        parser.error("no labeled documents: pass --labels whose Document Name matches files in --corpus, or --inject")
+    configs = grid(args)
+    print(f"{len(corpus)} documents, {sum(len(k) for _, _, k in corpus)} labels, {len(configs)} settings, "
+          f"mode {args.mode}")
+    recorder = Recorder(args.mode, args.recordings)
+    with intercept(apps, recorder):
+        rows = pareto(evaluate(configs, corpus, recorder, apps, args.tolerance, args.ignore_type))
+    print_table(rows)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
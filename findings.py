@@ -0,0 +1,234 @@
+"""
+Typed finding records decoded from model responses.
+
+Models drift between key spellings (Error_Description / Error_description / description ...) and
+return page and line numbers as ints, strings ("12", "Line 12", "12-14") or nothing. Responses are
+decoded once into Finding records with canonical keys and int-or-None numbers, so the chunk
+cache, cascade, boilerplate index and Excel export can rely on the schema.
+"""
+import json
+import re
+from collections.abc import Mapping
+
+import compact_output
+
+try:
+    import msgspec
+except ImportError:  # Optional: faster JSON parsing of large responses.
+    msgspec = None
+
+FIELDS = ("Page_Number", "Line_Number", "Error_Type", "Error_Description", "Suggestions")
+INT_FIELDS = ("Page_Number", "Line_Number")
+
+# Normalized key (lowercase, letters and digits only) -> canonical field.
+_ALIASES = {
+    "pagenumber": "Page_Number", "page": "Page_Number", "pageno": "Page_Number", "pagenum": "Page_Number",
+    "linenumber": "Line_Number", "line": "Line_Number", "lineno": "Line_Number", "linenum": "Line_Number",
+    "errortype": "Error_Type", "type": "Error_Type", "category": "Error_Type",
+    "errordescription": "Error_Description", "description": "Error_Description", "issue": "Error_Description",
+    "details": "Error_Description",
+    "suggestions": "Suggestions", "suggestion": "Suggestions", "correction": "Suggestions",
+    "recommendation": "Suggestions", "fix": "Suggestions",
+}
+_KEY_RE = re.compile(r"[^a-z0-9]")
+_INT_RE = re.compile(r"\d+")
+_canonical_cache = {}
+# Key tuple of a response object -> FIELDS index (or None / -1) per key; objects in one response share layouts.
+_layouts = {}
+
+
+def canonical_key(key):
+    """Returns the canonical field for a response key, or None for keys outside the schema."""
+    try:
+        return _canonical_cache[key]
+    except KeyError:
+        field = _ALIASES.get(_KEY_RE.sub("", str(key).lower()))
+        _canonical_cache[key] = field
+        return field
+
+
+def _layout(keys):
+    """
+    Compiles a key layout once: each key maps to the index of its field in FIELDS, None when it is
+    outside the schema, or -1 when it is a second alias of a field already present (first wins).
+    """
+    layout = _layouts.get(keys)
+    if layout is None:
+        seen = set()
+        layout = []
+        for key in keys:
+            field = canonical_key(key)
+            if field is None:
+                layout.append(None)
+            elif field in seen:
+                layout.append(-1)
+            else:
+                seen.add(field)
+                layout.append(FIELDS.index(field))
+        layout = tuple(layout)
+        _layouts[keys] = layout
+    return layout
+
+
+def to_int(value):
+    """Coerces page/line values to int: 12, 12.0, "12", "Line 12" and "12-14" give 12; anything else None."""
+    if type(value) is int:
+        return value
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        match = _INT_RE.search(value)
+        return int(match.group()) if match else None
+    return None
+
+
+def to_text(value):
+    if type(value) is str:
+        return value.strip()
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        return "; ".join(to_text(v) for v in value if v is not None)
+    return str(value)
+
+
+class Finding(Mapping):
+    """
+    One detected error. Slots keep records small; the read-only mapping interface (get, items,
+    dict(finding)) keeps code written for plain dicts working. Keys outside the schema are kept in extra.
+    """
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, Page_Number=None, Line_Number=None, Error_Type="", Error_Description="", Suggestions="",
+                 extra=None):
+        self.Page_Number = Page_Number
+        self.Line_Number = Line_Number
+        self.Error_Type = Error_Type
+        self.Error_Description = Error_Description
+        self.Suggestions = Suggestions
+        self.extra = extra
+
+    def __getitem__(self, key):
+        if key in FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from FIELDS
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return len(FIELDS) + len(self.extra or ())
+
+    def __repr__(self):
+        return f"Finding({self.to_dict()!r})"
+
+    def replace(self, **changes):
+        """Returns a copy with some fields changed."""
+        values = {field: getattr(self, field) for field in FIELDS}
+        values.update(changes)
+        return Finding(extra=self.extra, **values)
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in FIELDS}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+def coerce(row):
+    """Builds a Finding from one response object, or returns None when it is not an object."""
+    if type(row) is not dict:  # Exact dict check first: ABC isinstance checks are slow in the hot loop.
+        if isinstance(row, Finding):
+            return row
+        if not isinstance(row, Mapping):
+            return None
+    values = [None] * len(FIELDS)
+    extra = None
+    for (key, value), index in zip(row.items(), _layout(tuple(row))):
+        if index is None:
+            extra = extra or {}
+            extra[key] = value
+        elif index >= 0:
+            values[index] = value
+    page, line, error_type, description, suggestions = values
+    finding = Finding(to_int(page), to_int(line), to_text(error_type), to_text(description), to_text(suggestions), extra)
+    if not finding.Error_Type and not finding.Error_Description:
+        return None
+    return finding
+
+
+def from_rows(rows):
+    """Coerces a list of response objects, dropping entries that are not findings."""
+    return [finding for finding in map(coerce, rows or ()) if finding is not None]
+
+
+def _loads(raw):
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(raw)
+        except msgspec.DecodeError:
+            pass  # Let json raise the JSONDecodeError callers handle.
+    return json.loads(raw)
+
+
+def decode_findings(raw):
+    """
+    Decodes a model response into Findings. Accepts {"errors": [...]}, the compact table format
+    (compact_output), a bare list, or a single finding object. Raises json.JSONDecodeError for invalid JSON.
+    """
+    parsed = _loads(raw)
+    if compact_output.is_compact(parsed):
+        return from_rows(compact_output.expand(parsed))
+    if isinstance(parsed, Mapping):
+        rows = next((parsed[k] for k in parsed if str(k).lower() in ("errors", "findings")), None)
+        if rows is None:
+            rows = [parsed] if coerce(parsed) is not None else []
+    elif isinstance(parsed, list):
+        rows = parsed
+    else:
+        rows = []
+    if isinstance(rows, Mapping):
+        rows = [rows]
+    return from_rows(rows if isinstance(rows, list) else [])
+
+
+def as_dicts(findings):
+    """Plain dicts for JSON, Streamlit display and pandas."""
+    return [f.to_dict() if isinstance(f, Finding) else dict(f) for f in findings]
+
+
+def json_default(value):
+    """json.dump(..., default=json_default) serializes Findings as dicts."""
+    if isinstance(value, Finding):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def report_rows(documents):
+    """
+    Flattens [{"Document Name": ..., "Error Description": [findings]}] into one row per finding,
+    with a bare document row for documents without findings.
+    """
+    rows = []
+    for document in documents:
+        name = document["Document Name"]
+        found = document["Error Description"] or []
+        if not found:
+            rows.append({"Document Name": name})
+        for finding in map(coerce, found):
+            if finding is not None:
+                rows.append({"Document Name": name, **finding.to_dict()})
+    return rows
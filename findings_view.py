@@ -0,0 +1,135 @@
+"""
+Paginated findings viewer backed by an Arrow table.
+
+A run's findings are appended per document as Arrow record batches and kept in the session, so
+reruns (filter or page changes) reuse them. Filtering, sorting and paging run in pyarrow on the
+server and only the current page is sent to the browser, which keeps the UI responsive with
+100k findings. pyarrow ships with Streamlit and is imported on first use.
+"""
+import math
+
+import findings as finding_records
+
+SORTABLE = ("Document", "Page_Number", "Line_Number", "Error_Type")
+PAGE_SIZES = (50, 100, 500)
+
+
+def _arrow():
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    return pa, pc
+
+
+class FindingsTable:
+    """One run's findings; a view (filter + sort) is computed once and reused while paging."""
+
+    def __init__(self):
+        self._batches = []
+        self._table = None
+        self._view_key = None
+        self._view = None
+        self._summary = None
+        self.documents = []
+        self.num_rows = 0
+
+    def schema(self):
+        pa, _ = _arrow()
+        return pa.schema([
+            ("Document", pa.string()),
+            ("Page_Number", pa.int64()),
+            ("Line_Number", pa.int64()),
+            ("Error_Type", pa.string()),
+            ("Error_Description", pa.string()),
+            ("Suggestions", pa.string()),
+        ])
+
+    def add(self, document, found):
+        """Appends one document's findings as a record batch."""
+        pa, _ = _arrow()
+        rows = [f for f in map(finding_records.coerce, found or ()) if f is not None]
+        columns = [[document] * len(rows)] + [[getattr(f, field) for f in rows] for field in finding_records.FIELDS]
+        self._batches.append(pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self.schema())],
+            schema=self.schema(),
+        ))
+        self.documents.append(document)
+        self.num_rows += len(rows)
+        self._table = None
+        self._view_key = None
+        self._summary = None
+
+    def table(self):
+        if self._table is None:
+            pa, _ = _arrow()
+            self._table = pa.Table.from_batches(self._batches, schema=self.schema())
+        return self._table
+
+    def values(self, column):
+        """Distinct values of a column, sorted, for filter choices."""
+        _, pc = _arrow()
+        return sorted(v for v in pc.unique(self.table()[column]).to_pylist() if v is not None)
+
+    def view(self, documents=(), error_types=(), page_number=None, sort_by="Document", descending=False):
+        """Returns the filtered, sorted table; the last view is cached so paging does not re-sort."""
+        key = (tuple(documents), tuple(error_types), page_number, sort_by, descending)
+        if key == self._view_key:
+            return self._view
+        pa, pc = _arrow()
+        table = self.table()
+        mask = None
+        for column, wanted in (("Document", documents), ("Error_Type", error_types)):
+            if wanted:
+                condition = pc.is_in(table[column], value_set=pa.array(list(wanted), type=pa.string()))
+                mask = condition if mask is None else pc.and_(mask, condition)
+        if page_number:
+            condition = pc.equal(table["Page_Number"], page_number)
+            mask = condition if mask is None else pc.and_(mask, condition)
+        if mask is not None:
+            table = table.filter(mask)
+        order = "descending" if descending else "ascending"
+        keys = [(sort_by, order)] + [(c, "ascending") for c in ("Document", "Page_Number", "Line_Number") if c != sort_by]
+        table = table.take(pc.sort_indices(table, sort_keys=keys))
+        self._view_key, self._view = key, table
+        return table
+
+    def summary(self):
+        """Per-document finding counts, total and by error type (including documents without findings)."""
+        if self._summary is None:
+            grouped = self.table().group_by(["Document", "Error_Type"]).aggregate([("Error_Description", "count")])
+            types = {row["Error_Type"] or "(none)": 0 for row in grouped.select(["Error_Type"]).to_pylist()}
+            counts = {document: {"Document": document, "Findings": 0, **types} for document in self.documents}
+            for row in grouped.to_pylist():
+                entry = counts[row["Document"]]
+                entry["Findings"] += row["Error_Description_count"]
+                entry[row["Error_Type"] or "(none)"] = row["Error_Description_count"]
+            self._summary = list(counts.values())
+        return self._summary
+
+
+def render(st, table, key="findings"):
+    """Shows the summary and one page of the findings with filter, sort and page controls."""
+    if table is None:
+        return
+    st.subheader("❗ Findings")
+    st.dataframe(table.summary(), hide_index=True, use_container_width=True)
+    if not table.num_rows:
+        st.info("No errors were found.")
+        return
+
+    filters = st.columns([3, 3, 1])
+    documents = filters[0].multiselect("Document", table.values("Document"), key=f"{key}_documents")
+    error_types = filters[1].multiselect("Error type", table.values("Error_Type"), key=f"{key}_types")
+    page_number = filters[2].number_input("Document page", min_value=0, step=1, key=f"{key}_page_number",
+                                          help="0 shows every page.")
+    controls = st.columns([3, 1, 1, 1])
+    sort_by = controls[0].selectbox("Sort by", SORTABLE, key=f"{key}_sort")
+    descending = controls[1].checkbox("Descending", key=f"{key}_descending")
+    page_size = controls[2].selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+
+    view = table.view(documents, error_types, int(page_number), sort_by, descending)
+    pages = max(math.ceil(view.num_rows / page_size), 1)
+    page = controls[3].number_input("Results page", min_value=1, max_value=pages, step=1, key=f"{key}_results_page")
+    page = min(int(page), pages)
+    st.caption(f"{view.num_rows:,} of {table.num_rows:,} findings · page {page} of {pages}")
+    st.dataframe(view.slice((page - 1) * page_size, page_size).to_pandas(), hide_index=True, use_container_width=True)
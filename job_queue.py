@@ -0,0 +1,336 @@
+import importlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+import findings as finding_records
+import metrics
+import scheduler
+
+DEFAULT_URL = os.getenv("JOB_QUEUE_URL", "sqlite:///jobs.sqlite3")
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 600))
+MAX_ATTEMPTS = 3
+# Workers heartbeat this often; the UI gives up on a batch when no worker has been seen for
+# JOB_WORKER_TIMEOUT_SECONDS or the batch has not finished within JOB_WAIT_TIMEOUT_SECONDS.
+HEARTBEAT_SECONDS = 10
+WORKER_TIMEOUT_SECONDS = int(os.getenv("JOB_WORKER_TIMEOUT_SECONDS", 60))
+WAIT_TIMEOUT_SECONDS = int(os.getenv("JOB_WAIT_TIMEOUT_SECONDS", 3600))
+# Columns added after the first release; older queue files are migrated on open.
+SCHEDULING_COLUMNS = (
+    ("owner", "TEXT NOT NULL DEFAULT 'anonymous'"),
+    ("lane", "TEXT NOT NULL DEFAULT 'interactive'"),
+    ("size", "INTEGER NOT NULL DEFAULT 0"),
+    ("weight", "REAL NOT NULL DEFAULT 1.0"),
+    ("started", "REAL"),
+)
+
+
+class JobQueue:
+    """
+    Interface for the analysis job queue. The SQLite implementation below is the local default;
+    a broker-backed class with the same methods can be selected with JOB_QUEUE_BACKEND=module:Class.
+    """
+
+    def submit(self, kind, payload, batch=None, job=None):
+        """Queues a job; job is the scheduler.Job (owner, size, lane, weight) it is claimed for."""
+        raise NotImplementedError
+
+    def claim(self, worker_id):
+        """Returns (job_id, kind, payload) for the next pending job in scheduler order, or None."""
+        raise NotImplementedError
+
+    def complete(self, job_id, result, worker_id):
+        """Stores the result if worker_id still holds the job's lease; returns whether it did."""
+        raise NotImplementedError
+
+    def fail(self, job_id, error, worker_id):
+        """Requeues or fails the job if worker_id still holds its lease; returns whether it did."""
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id):
+        """Records that a worker process is alive."""
+        raise NotImplementedError
+
+    def live_workers(self, within=WORKER_TIMEOUT_SECONDS):
+        """Returns how many workers sent a heartbeat in the last `within` seconds."""
+        raise NotImplementedError
+
+    def cancel_batch(self, batch, reason):
+        """Marks a batch's unfinished jobs failed with reason; their workers' results are then discarded."""
+        raise NotImplementedError
+
+    def batch_status(self, batch):
+        """Returns a list of {id, status, result, error, payload} dicts for a batch in submit order."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns ({lane: pending jobs}, {(lane, size class): [recent wait seconds]}); optional for backends."""
+        return {}, {}
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite-backed queue; claims are atomic so any number of worker processes can share the file.
+    Jobs are claimed in scheduler order: interactive lane first (batch jobs are promoted after
+    SCHEDULER_BATCH_MAX_WAIT seconds), then the owner with the least service per weight in the
+    shares table, then the smallest document, then submit order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " seq INTEGER,"
+                " batch TEXT,"
+                " kind TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " worker TEXT,"
+                " lease_expires REAL,"
+                " result TEXT,"
+                " error TEXT,"
+                " created REAL NOT NULL,"
+                " finished REAL)"
+            )
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in SCHEDULING_COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            conn.execute("CREATE TABLE IF NOT EXISTS shares (owner TEXT PRIMARY KEY, served REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, seen REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, seq)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, kind, payload, batch=None, job=None):
+        job = job or scheduler.DEFAULT_JOB
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._activate(conn, job.owner)
+            conn.execute(
+                "INSERT INTO jobs (id, seq, batch, kind, payload, created, owner, lane, size, weight)"
+                " VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs), ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, batch, kind, json.dumps(payload), time.time(), job.owner, job.lane, job.size, job.weight),
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def _activate(self, conn, owner):
+        """An owner without pending jobs resumes at the least-served pending owner's level (see scheduler)."""
+        if conn.execute("SELECT 1 FROM jobs WHERE owner = ? AND status = 'pending' LIMIT 1", (owner,)).fetchone():
+            return
+        floor = conn.execute(
+            "SELECT MIN(served) FROM shares WHERE owner IN (SELECT DISTINCT owner FROM jobs WHERE status = 'pending')"
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO shares (owner, served) VALUES (?, ?)"
+            " ON CONFLICT (owner) DO UPDATE SET served = MAX(served, excluded.served)",
+            (owner, floor or 0.0),
+        )
+
+    def claim(self, worker_id):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._beat(conn, worker_id, now)
+            # A job whose lease expired on its last attempt (its worker died every time) is not reclaimed again.
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ?"
+                " WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (f"lease expired on all {MAX_ATTEMPTS} attempts", now, now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload, jobs.owner, weight FROM jobs LEFT JOIN shares ON shares.owner = jobs.owner"
+                " WHERE (status = 'pending') OR (status = 'running' AND lease_expires < ?)"
+                " ORDER BY CASE WHEN lane = 'interactive' OR created < ? THEN 0 ELSE 1 END,"
+                " COALESCE(served, 0), size, seq LIMIT 1",
+                (now, now - scheduler.BATCH_MAX_WAIT),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, kind, payload, owner, weight = row
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1,"
+                " started = COALESCE(started, ?) WHERE id = ?",
+                (worker_id, now + LEASE_SECONDS, now, job_id),
+            )
+            conn.execute(
+                "INSERT INTO shares (owner, served) VALUES (?, ?)"
+                " ON CONFLICT (owner) DO UPDATE SET served = served + excluded.served",
+                (owner, 1.0 / weight if weight > 0 else 1.0),
+            )
+            conn.execute("COMMIT")
+            return job_id, kind, json.loads(payload)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id, result, worker_id):
+        # A worker whose lease expired (and whose job was reclaimed or cancelled) must not overwrite it.
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished = ?"
+                " WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result, default=finding_records.json_default), time.time(), job_id, worker_id),
+            ).rowcount > 0
+
+    def fail(self, job_id, error, worker_id):
+        """Requeues the job until it has been attempted MAX_ATTEMPTS times, then marks it failed."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " error = ?, finished = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (MAX_ATTEMPTS, str(error), time.time(), job_id, worker_id),
+            ).rowcount > 0
+
+    def _beat(self, conn, worker_id, now):
+        conn.execute(
+            "INSERT INTO workers (id, seen) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET seen = excluded.seen",
+            (worker_id, now),
+        )
+
+    def heartbeat(self, worker_id):
+        with self._connect() as conn:
+            self._beat(conn, worker_id, time.time())
+
+    def live_workers(self, within=WORKER_TIMEOUT_SECONDS):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM workers WHERE seen >= ?", (time.time() - within,)).fetchone()[0]
+
+    def cancel_batch(self, batch, reason):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ?"
+                " WHERE batch = ? AND status IN ('pending', 'running')",
+                (reason, time.time(), batch),
+            )
+
+    def batch_status(self, batch):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, status, result, error, payload FROM jobs WHERE batch = ? ORDER BY seq", (batch,)
+            ).fetchall()
+        return [
+            {
+                "id": job_id,
+                "status": status,
+                "result": json.loads(result) if result else None,
+                "error": error,
+                "payload": json.loads(payload),
+            }
+            for job_id, status, result, error, payload in rows
+        ]
+
+    def stats(self, samples=metrics.QUEUE_WAIT_SAMPLES):
+        with self._connect() as conn:
+            depth = dict(conn.execute("SELECT lane, COUNT(*) FROM jobs WHERE status = 'pending' GROUP BY lane"))
+            rows = conn.execute(
+                "SELECT lane, size, started - created FROM jobs WHERE started IS NOT NULL ORDER BY started DESC LIMIT ?",
+                (samples,),
+            ).fetchall()
+        waits = {}
+        for lane, size, seconds in rows:
+            waits.setdefault((lane, scheduler.Job(size=size).size_class()), []).append(seconds)
+        return depth, waits
+
+
+def open_queue(url=None):
+    """Opens the queue named by JOB_QUEUE_BACKEND (module:Class) or JOB_QUEUE_URL (sqlite:///path)."""
+    backend = os.getenv("JOB_QUEUE_BACKEND")
+    if backend:
+        module_name, class_name = backend.split(":")
+        return getattr(importlib.import_module(module_name), class_name)(url or DEFAULT_URL)
+    url = url or DEFAULT_URL
+    if not url.startswith("sqlite:///"):
+        raise ValueError(f"Unsupported JOB_QUEUE_URL {url!r}; set JOB_QUEUE_BACKEND for a broker-backed queue.")
+    return SQLiteJobQueue(url[len("sqlite:///"):])
+
+
+def submit_document(queue, app, document, text, chunks, options=None, owner="anonymous", lane="interactive",
+                    weight=1.0):
+    """
+    Submits one chunk job per (offset, chunk) pair for a document and returns the batch id.
+    Each job carries the chunk's line offset so workers return document line numbers, and the
+    owner, lane and document size the queue and the worker's scheduler order it by.
+    """
+    job = scheduler.Job(owner, len(text), lane, weight)
+    batch = uuid.uuid4().hex
+    line_offset = 0
+    previous_offset = 0
+    for index, (offset, chunk) in enumerate(chunks):
+        line_offset += text.count("\n", previous_offset, offset)
+        previous_offset = offset
+        queue.submit("chunk", {
+            "app": app,
+            "document": document,
+            "chunk_index": index,
+            "line_offset": line_offset,
+            "chunk": chunk,
+            "options": options or {},
+            "job": {"owner": job.owner, "size": job.size, "lane": job.lane, "weight": job.weight},
+        }, batch=batch, job=job)
+    return batch
+
+
+def collect_batch(queue, batch):
+    """Returns (finished, findings, errors) for a batch; findings are concatenated in chunk order."""
+    jobs = queue.batch_status(batch)
+    finished = all(job["status"] in ("done", "failed") for job in jobs)
+    findings = [f for job in jobs if job["status"] == "done" for f in finding_records.from_rows(job["result"])]
+    errors = [f"chunk {job['payload']['chunk_index'] + 1}: {job['error']}" for job in jobs if job["status"] == "failed"]
+    return finished, findings, errors
+
+
+def progress(queue, batch):
+    jobs = queue.batch_status(batch)
+    if not jobs:
+        return 1.0
+    return sum(job["status"] in ("done", "failed") for job in jobs) / len(jobs)
+
+
+def publish_stats(queue):
+    """Copies the queue's depth and recent waits into metrics (queue "jobs") for the sidebar and /metrics."""
+    depth, waits = queue.stats()
+    for lane in scheduler.LANES:
+        metrics.set_queue_depth("jobs", lane, depth.get(lane, 0))
+    for (lane, size_class), seconds in waits.items():
+        metrics.set_queue_waits("jobs", lane, size_class, seconds)
+
+
+def poll_batches(queue, batches, submitted, timeout=WAIT_TIMEOUT_SECONDS):
+    """
+    Checks the batches once without waiting. Returns (fraction of finished jobs, results), where
+    results is None while jobs are still running and {batch: (findings, errors)} once they are done.
+    Unfinished jobs are cancelled, and reported as errors, when the batches were submitted more
+    than timeout seconds ago or no worker has sent a heartbeat within WORKER_TIMEOUT_SECONDS.
+    """
+    publish_stats(queue)
+    jobs = [job for batch in batches for job in queue.batch_status(batch)]
+    finished = sum(job["status"] in ("done", "failed") for job in jobs)
+    if finished < len(jobs):
+        if time.time() - submitted > timeout:
+            reason = f"not finished within {timeout} seconds"
+        elif not queue.live_workers():
+            reason = f"no worker heartbeat in the last {WORKER_TIMEOUT_SECONDS} seconds (is `python worker.py` running?)"
+        else:
+            return finished / len(jobs), None
+        for batch in batches:
+            queue.cancel_batch(batch, reason)
+    results = {}
+    for batch in batches:
+        _, findings, errors = collect_batch(queue, batch)
+        results[batch] = (findings, errors)
+    return 1.0, results
@@ -0,0 +1,341 @@
+import io
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Estimated USD price per 1M tokens as (input, output). Update when provider pricing changes.
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4": (30.00, 60.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+# Share of the input price billed for tokens read from a Gemini context cache (storage is billed separately).
+CACHED_INPUT_PRICE_RATIO = 0.25
+
+_lock = threading.Lock()
+_current_run = ContextVar("current_run", default=None)
+
+# Process-wide aggregates exported in Prometheus format.
+_stage_seconds = {}    # stage -> [count, total_seconds]
+_retries = {}          # stage -> count
+_tokens = {}           # (model, direction) -> count
+_cost = {}             # model -> usd
+_queue_depth = {}      # (queue, lane) -> waiting items
+_queue_waits = {}      # (queue, lane, size class) -> recent wait seconds
+QUEUE_WAIT_SAMPLES = 1000
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Returns the estimated USD cost of a call, or 0.0 for unknown models."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class RunMetrics:
+    """Collects stage timings, retries, token usage and cost for one analysis run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.ended = None
+        self.stages = []        # dicts with stage, seconds, document, chunk
+        self.usage = []         # dicts with model, document, chunk, tokens, cost
+        self.retries = {}
+        self.metadata = {}
+        self.profile_report = None
+
+    def total_cost(self):
+        return sum(u["cost"] for u in self.usage)
+
+    def total_tokens(self):
+        return sum(u["prompt_tokens"] + u["completion_tokens"] for u in self.usage)
+
+    def stage_totals(self):
+        totals = {}
+        for s in self.stages:
+            totals[s["stage"]] = totals.get(s["stage"], 0.0) + s["seconds"]
+        return totals
+
+    def per_document(self):
+        """Aggregates seconds, tokens and cost per document."""
+        docs = {}
+        for s in self.stages:
+            if s["document"] is not None:
+                docs.setdefault(s["document"], {"seconds": 0.0, "tokens": 0, "cost": 0.0})
+                docs[s["document"]]["seconds"] += s["seconds"]
+        for u in self.usage:
+            doc = docs.setdefault(u["document"], {"seconds": 0.0, "tokens": 0, "cost": 0.0})
+            doc["tokens"] += u["prompt_tokens"] + u["completion_tokens"]
+            doc["cost"] += u["cost"]
+        return docs
+
+
+@contextmanager
+def track_run(run=None):
+    """
+    Makes a fresh RunMetrics (or run, to continue one on a later rerun) the current run for the
+    duration of the block. The run's wall time ends with the last block.
+    """
+    run = run or RunMetrics()
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        run.ended = time.time()
+        _current_run.reset(token)
+        write_prometheus_file()
+
+
+def current_run():
+    return _current_run.get()
+
+
+@contextmanager
+def stage(name, document=None, chunk=None):
+    """Times a pipeline stage and records it on the current run and the global aggregates."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            entry = _stage_seconds.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        run = current_run()
+        if run is not None:
+            run.stages.append({"stage": name, "seconds": seconds, "document": document, "chunk": chunk})
+
+
+def timed(name):
+    """Decorator form of `stage` for functions without per-document labels."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_retry(name):
+    with _lock:
+        _retries[name] = _retries.get(name, 0) + 1
+    run = current_run()
+    if run is not None:
+        run.retries[name] = run.retries.get(name, 0) + 1
+
+
+def record_usage(model, prompt_tokens, completion_tokens, document=None, chunk=None, cached_tokens=0):
+    """Records token usage and estimated cost for one model call; cached_tokens of the prompt are billed at a discount."""
+    prompt_tokens = int(prompt_tokens or 0)
+    completion_tokens = int(completion_tokens or 0)
+    billed_prompt = prompt_tokens - int(cached_tokens or 0) * (1 - CACHED_INPUT_PRICE_RATIO)
+    cost = estimate_cost(model, billed_prompt, completion_tokens)
+    with _lock:
+        _tokens[(model, "input")] = _tokens.get((model, "input"), 0) + prompt_tokens
+        _tokens[(model, "output")] = _tokens.get((model, "output"), 0) + completion_tokens
+        _cost[model] = _cost.get(model, 0.0) + cost
+    run = current_run()
+    if run is not None:
+        run.usage.append({
+            "model": model,
+            "document": document,
+            "chunk": chunk,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost,
+        })
+
+
+def record_openai_usage(response, model, document=None, chunk=None):
+    """Reads the `usage` field of an OpenAI ChatCompletion response."""
+    usage = response.get("usage") or {}
+    record_usage(model, usage.get("prompt_tokens"), usage.get("completion_tokens"), document, chunk)
+
+
+def record_gemini_usage(response, model, document=None, chunk=None):
+    """Reads `usage_metadata` of a Gemini GenerateContentResponse."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    record_usage(model, getattr(usage, "prompt_token_count", 0),
+                 getattr(usage, "candidates_token_count", 0), document, chunk,
+                 getattr(usage, "cached_content_token_count", 0))
+
+
+def record_metadata(key, value):
+    run = current_run()
+    if run is not None:
+        run.metadata[key] = value
+
+
+def set_queue_depth(queue, lane, depth):
+    with _lock:
+        _queue_depth[(queue, lane)] = depth
+
+
+def record_queue_wait(queue, lane, size_class, seconds):
+    """Records how long one item waited in a queue; the last QUEUE_WAIT_SAMPLES per lane and size are kept."""
+    with _lock:
+        _queue_waits.setdefault((queue, lane, size_class), deque(maxlen=QUEUE_WAIT_SAMPLES)).append(seconds)
+
+
+def set_queue_waits(queue, lane, size_class, waits):
+    """Replaces the recent waits of a queue whose history is kept elsewhere (e.g. the job queue's database)."""
+    with _lock:
+        _queue_waits[(queue, lane, size_class)] = deque(waits, maxlen=QUEUE_WAIT_SAMPLES)
+
+
+def _quantile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def queue_stats():
+    """One row per queue, lane and size class with depth and p50/p95/p99 wait over the recent samples."""
+    with _lock:
+        waits = {key: sorted(samples) for key, samples in _queue_waits.items() if samples}
+        depth = dict(_queue_depth)
+    rows = []
+    for (queue, lane, size_class), ordered in sorted(waits.items()):
+        rows.append({
+            "queue": queue, "lane": lane, "size": size_class, "waiting": depth.get((queue, lane), 0),
+            "samples": len(ordered), "p50_s": round(_quantile(ordered, 0.5), 3),
+            "p95_s": round(_quantile(ordered, 0.95), 3), "p99_s": round(_quantile(ordered, 0.99), 3),
+        })
+    return rows
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus():
+    """Renders the process-wide aggregates in the Prometheus text exposition format."""
+    lines = [
+        "# HELP sta_stage_seconds Time spent in each pipeline stage.",
+        "# TYPE sta_stage_seconds summary",
+    ]
+    with _lock:
+        for name, (count, total) in sorted(_stage_seconds.items()):
+            lines.append(f'sta_stage_seconds_count{{stage="{_escape(name)}"}} {count}')
+            lines.append(f'sta_stage_seconds_sum{{stage="{_escape(name)}"}} {total:.6f}')
+        lines += ["# HELP sta_retries_total Retried model calls.", "# TYPE sta_retries_total counter"]
+        for name, count in sorted(_retries.items()):
+            lines.append(f'sta_retries_total{{stage="{_escape(name)}"}} {count}')
+        lines += ["# HELP sta_tokens_total Model tokens consumed.", "# TYPE sta_tokens_total counter"]
+        for (model, direction), count in sorted(_tokens.items()):
+            lines.append(f'sta_tokens_total{{model="{_escape(model)}",direction="{direction}"}} {count}')
+        lines += ["# HELP sta_cost_usd_total Estimated model cost in USD.", "# TYPE sta_cost_usd_total counter"]
+        for model, cost in sorted(_cost.items()):
+            lines.append(f'sta_cost_usd_total{{model="{_escape(model)}"}} {cost:.6f}')
+        lines += ["# HELP sta_queue_depth Items waiting in a queue.", "# TYPE sta_queue_depth gauge"]
+        for (queue, lane), depth in sorted(_queue_depth.items()):
+            lines.append(f'sta_queue_depth{{queue="{queue}",lane="{lane}"}} {depth}')
+    lines += ["# HELP sta_queue_wait_seconds Recent queue wait times.", "# TYPE sta_queue_wait_seconds summary"]
+    for row in queue_stats():
+        labels = f'queue="{row["queue"]}",lane="{row["lane"]}",size="{row["size"]}"'
+        for q in ("50", "95", "99"):
+            lines.append(f'sta_queue_wait_seconds{{{labels},quantile="0.{q}"}} {row[f"p{q}_s"]}')
+        lines.append(f'sta_queue_wait_seconds_count{{{labels}}} {row["samples"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path=None):
+    """Writes the metrics to METRICS_PROM_FILE (e.g. for the node_exporter textfile collector)."""
+    path = path or os.getenv("METRICS_PROM_FILE")
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def start_metrics_server(port=None):
+    """Serves /metrics on METRICS_PORT in a daemon thread. Returns the server or None."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    port = port or os.getenv("METRICS_PORT")
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def profile_run(enabled=False, top=25):
+    """Optionally captures cProfile and tracemalloc stats and stores a text report on the current run."""
+    if not enabled:
+        yield
+        return
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(top)
+        report.write(f"\nPeak traced memory: {peak / 1024 / 1024:.1f} MiB\n")
+        for stat in snapshot.statistics("lineno")[:10]:
+            report.write(f"{stat}\n")
+        run = current_run()
+        if run is not None:
+            run.profile_report = report.getvalue()
+
+
+def render_sidebar(st, run):
+    """Shows a run's metrics in the Streamlit sidebar."""
+    if run is None:
+        return
+    sidebar = st.sidebar
+    sidebar.subheader("⏱ Run metrics")
+    sidebar.metric("Wall time (s)", f"{(run.ended or time.time()) - run.started:.1f}")
+    sidebar.metric("Tokens", f"{run.total_tokens():,}")
+    sidebar.metric("Estimated cost ($)", f"{run.total_cost():.4f}")
+    if run.retries:
+        sidebar.write({"Retries": run.retries})
+    sidebar.write("**Seconds per stage**")
+    sidebar.table([{"Stage": k, "Seconds": round(v, 3)} for k, v in run.stage_totals().items()])
+    sidebar.write("**Per document**")
+    sidebar.table([{"Document": doc, "Seconds": round(v["seconds"], 2), "Tokens": v["tokens"],
+                    "Cost ($)": round(v["cost"], 4)} for doc, v in run.per_document().items()])
+    if run.metadata:
+        sidebar.write({"Run metadata": run.metadata})
+    stats = queue_stats()
+    if stats:
+        sidebar.write("**Queue waits (all sessions)**")
+        sidebar.table(stats)
+    if run.profile_report:
+        with sidebar.expander("Profile"):
+            st.code(run.profile_report)
+    sidebar.download_button("📈 Download Prometheus metrics", render_prometheus(),
+                            file_name="metrics.prom", mime="text/plain")
@@ -0,0 +1,225 @@
+import contextvars
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_MEMORY_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+DEFAULT_DISK_BYTES = int(os.getenv("PARSE_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Details of the parse in progress in cached_read (see record_detail).
+_details = contextvars.ContextVar("parse_details", default=None)
+
+
+def content_key(uploaded_file, parser_version):
+    """Hashes the upload bytes together with the file suffix and parser version."""
+    digest = hashlib.sha256()
+    if hasattr(uploaded_file, "getbuffer"):
+        with uploaded_file.getbuffer() as view:
+            digest.update(view)
+    else:
+        digest.update(uploaded_file.getvalue())
+    suffix = os.path.splitext(uploaded_file.name)[1].lower()
+    digest.update(f"|{suffix}|{parser_version}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    In-memory LRU of parsed document text, evicted by total size in bytes. Each entry also keeps
+    the parser's details (record_detail / record_metadata), which are small and not counted.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._details = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        text = self.disk.get(key) if self.disk else None
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._put_memory(key, text, self.disk.details(key))
+        return text
+
+    def details(self, key):
+        """Returns the details stored with a cached parse ({} when there are none)."""
+        with self._lock:
+            if key in self._details:
+                return self._details[key]
+        return self.disk.details(key) if self.disk else {}
+
+    def put(self, key, text, details=None):
+        self._put_memory(key, text, details)
+        if self.disk:
+            self.disk.put(key, text, details)
+
+    def _put_memory(self, key, text, details=None):
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= sys.getsizeof(self._entries.pop(key))
+            self._entries[key] = text
+            self._details[key] = details or {}
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._details.pop(evicted_key, None)
+                self.total_bytes -= sys.getsizeof(evicted)
+
+
+class DiskCache:
+    """Shared on-disk tier keyed the same way; least recently read files are evicted first."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    @staticmethod
+    def _details_path(path):
+        return path[:-len(".txt")] + ".details.json"
+
+    def details(self, key):
+        try:
+            with open(self._details_path(self._path(key)), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        os.utime(path)  # mark as recently used
+        return text
+
+    def put(self, key, text, details=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Details first, so a readable text file always has its details next to it.
+        if details:
+            self._write(self._details_path(path), json.dumps(details))
+        self._write(path, text)
+        self._evict()
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".txt"):
+                        path = os.path.join(root, name)
+                        stat = os.stat(path)
+                        files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                for removed in (path, self._details_path(path)):
+                    try:
+                        os.remove(removed)
+                    except OSError:
+                        pass
+                total -= size
+
+
+_shared_disk = None
+
+
+def shared_disk_cache():
+    """Returns the disk tier configured by PARSE_CACHE_DIR, or None when it is not set."""
+    global _shared_disk
+    directory = os.getenv("PARSE_CACHE_DIR")
+    if not directory:
+        return None
+    if _shared_disk is None or _shared_disk.directory != directory:
+        _shared_disk = DiskCache(directory)
+    return _shared_disk
+
+
+def session_cache(session_state):
+    """Returns the per-session cache stored in Streamlit's session state, creating it on first use."""
+    if "parse_cache" not in session_state:
+        session_state["parse_cache"] = ParseCache(disk=shared_disk_cache())
+    return session_state["parse_cache"]
+
+
+def record_detail(name, value):
+    """
+    Keeps a JSON-serializable detail of the parse in progress (e.g. the header lines a PDF
+    normalization removed) with its cached text; see parse_details. Outside cached_read it is dropped.
+    """
+    details = _details.get()
+    if details is not None:
+        details[name] = value
+
+
+def record_metadata(key, value):
+    """
+    Run metadata about a parse (e.g. its token reduction). cached_read records it on the current run
+    every time the parse is read, so runs that hit the cache (or follow an uncached pre-flight
+    parse) still show it.
+    """
+    details = _details.get()
+    if details is None:
+        metrics.record_metadata(key, value)
+    else:
+        details.setdefault("metadata", {})[key] = value
+
+
+def parse_details(uploaded_file, parser_version, cache):
+    """Returns the details recorded while the upload was parsed ({} when it is not cached)."""
+    return cache.details(content_key(uploaded_file, parser_version))
+
+
+def cached_read(uploaded_file, parser, parser_version, cache):
+    """Returns parser(uploaded_file), reusing earlier output for identical bytes and parser version."""
+    key = content_key(uploaded_file, parser_version)
+    text = cache.get(key)
+    if text is None:
+        details = {}
+        token = _details.set(details)
+        try:
+            text = parser(uploaded_file)
+        finally:
+            _details.reset(token)
+        if text:
+            cache.put(key, text, details)
+    else:
+        details = cache.details(key)
+    for name, value in details.get("metadata", {}).items():
+        metrics.record_metadata(name, value)
+    return text
@@ -0,0 +1,133 @@
+"""
+Normalizes text extracted from PDFs before it is sent to a model.
+
+extract_text() returns every page's running header, footer, page number and disclaimer, so a
+300-page binder sends them 300 times. Lines near the top or bottom of a page are fingerprinted by
+edge and exact text. Only a trailing page counter ("Page 3 of 40", "3/40") is taken relative to
+the page number, so "Binder - Page 3 of 40" on page 3 and "Binder - Page 4 of 40" on page 4 match.
+A line whose fingerprint is found on at least PDF_REPEAT_RATIO of the pages is kept on its first
+page and removed from the others. A bare page number ("3", "Page 3", "3 of 40") is removed when
+it tracks the page index on enough pages, so a lone "500" or "$500" stays. Lines that differ in any
+other digit (a mistyped policy number in one header, amounts, dates) are different lines and
+stay. Runs of spaces are collapsed, blank lines squeezed and words hyphenated across line breaks
+joined. Set PDF_NORMALIZE=0 to send the raw text.
+"""
+import os
+import re
+from collections import Counter, namedtuple
+
+import metrics
+import parse_cache
+
+ENABLED = os.getenv("PDF_NORMALIZE", "1") != "0"
+# Lines this close to the top or bottom of a page are header/footer candidates.
+EDGE_LINES = 3
+# A candidate is a running header/footer when it repeats on this share of the pages (and on two or more).
+REPEAT_RATIO = float(os.getenv("PDF_REPEAT_RATIO", 0.5))
+
+RemovedLine = namedtuple("RemovedLine", ["page", "edge", "text"])
+
+_SPACES_RE = re.compile(r"[ \t\u00a0]+")
+_PAGE_COUNTER_RE = re.compile(r"(\bpage\s*)?\b(\d{1,4})(\s*(?:of|/)\s*\d{1,4})?\W*$", re.IGNORECASE)
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s*)?(\d{1,4})(?:\s*(?:of|/)\s*\d{1,4})?$", re.IGNORECASE)
+_HYPHEN_BREAK_RE = re.compile(r"([A-Za-z])-\n([a-z])")
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+class NormalizedPdf:
+    """Normalized text of a PDF plus the header/footer lines removed from it."""
+
+    def __init__(self, text, removed, raw_text):
+        self.text = text
+        self.removed = removed
+        self.raw_text = raw_text
+
+    def token_reduction(self, model="gpt-4o-mini"):
+        """Returns (raw tokens, normalized tokens) counted with strategy.count_tokens."""
+        import strategy
+
+        return strategy.count_tokens(self.raw_text, model), strategy.count_tokens(self.text, model)
+
+
+def _fingerprint(line, page_number):
+    """
+    Exact text of a line; a trailing "N of M" page counter is replaced by N's offset from the page
+    number, and a bare page number becomes ("", offset).
+    """
+    text = _SPACES_RE.sub(" ", line.strip())
+    match = _PAGE_NUMBER_RE.match(text)
+    if match:
+        return "", int(match.group(1)) - page_number
+    match = _PAGE_COUNTER_RE.search(text)
+    if match and match.group(3):
+        return text[:match.start()], int(match.group(2)) - page_number
+    return text, None
+
+
+def _edges(lines):
+    """Yields (index, edge) for the non-blank lines within EDGE_LINES of the top and bottom of a page."""
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    for i in content[:EDGE_LINES]:
+        yield i, "top"
+    for i in content[-EDGE_LINES:]:
+        if i not in content[:EDGE_LINES]:
+            yield i, "bottom"
+
+
+def _clean(text):
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return "\n".join(lines)
+
+
+def normalize_pages(pages):
+    """Normalizes the extracted text of each page (a list of strings) into one NormalizedPdf."""
+    page_lines = [page.split("\n") for page in pages]
+    counts = Counter()
+    for number, lines in enumerate(page_lines, start=1):
+        counts.update({(edge, _fingerprint(lines[i], number)) for i, edge in _edges(lines)})
+    threshold = max(2, REPEAT_RATIO * len(pages))
+
+    removed = []
+    kept_pages = []
+    seen = set()
+    for number, lines in enumerate(page_lines, start=1):
+        drop = set()
+        for i, edge in _edges(lines):
+            key = (edge, _fingerprint(lines[i], number))
+            page_number = key[1][0] == ""
+            # The first occurrence of a running line stays, so the model still sees e.g. the header's policy number;
+            # page numbers that follow the page index go everywhere.
+            repeated = counts[key] >= threshold and (page_number or key in seen)
+            seen.add(key)
+            if repeated:
+                drop.add(i)
+                removed.append(RemovedLine(number, edge, lines[i].strip()))
+        page = "\n".join(line for i, line in enumerate(lines) if i not in drop)
+        page = _BLANK_RUN_RE.sub("\n\n", _HYPHEN_BREAK_RE.sub(r"\1\2", _clean(page))).strip("\n")
+        kept_pages.append(page)
+
+    return NormalizedPdf("\n".join(kept_pages), removed, "\n".join(pages))
+
+
+def read_pdf_text(file, document=None):
+    """
+    Extracts a PDF's text page by page and normalizes it (unless PDF_NORMALIZE=0). The token
+    reduction goes to the run metadata and the removed lines, as [page, edge, text], to the parse's
+    details (parse_cache.parse_details), both kept with the cached parse.
+    """
+    from PyPDF2 import PdfReader
+
+    pages = [page.extract_text() or "" for page in PdfReader(file).pages]
+    if not ENABLED:
+        return "\n".join(pages)
+    with metrics.stage("normalize_pdf", document=document):
+        result = normalize_pages(pages)
+        raw_tokens, tokens = result.token_reduction()
+    parse_cache.record_detail("removed_lines", [list(line) for line in result.removed])
+    if raw_tokens:
+        parse_cache.record_metadata(
+            f"{document}: PDF normalization",
+            f"{len(result.removed)} header/footer lines removed on {len(pages)} pages; "
+            f"{raw_tokens:,} -> {tokens:,} tokens ({1 - tokens / raw_tokens:.0%} fewer)",
+        )
+    return result.text
@@ -0,0 +1,248 @@
+"""
+Pre-flight estimates and budget enforcement for analysis runs.
+
+Estimates are made from parsed uploads before any model call: tokens are counted locally,
+the app's chunk plan gives the number of calls, and historical throughput (per model,
+kept in PREFLIGHT_HISTORY) gives output tokens and seconds per call.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+import strategy
+
+HISTORY_PATH = os.getenv("PREFLIGHT_HISTORY", "preflight_history.json")
+# Weight of older runs when folding a new run into the history.
+HISTORY_DECAY = 0.8
+# Used until a model has history: (completion tokens per call, seconds per call).
+DEFAULT_THROUGHPUT = {
+    "gpt-4o-mini": (1500, 20.0),
+    "gpt-4": (1200, 45.0),
+    "gemini-1.5-pro": (1500, 30.0),
+    "gemini-1.5-flash": (1500, 12.0),
+}
+# Share of chunks the STAA cascade is expected to re-run on the strong model.
+CASCADE_ESCALATION_RATE = 0.25
+
+RUN_BUDGET_USD = float(os.getenv("RUN_BUDGET_USD", 0) or 0)
+RUN_BUDGET_MINUTES = float(os.getenv("RUN_BUDGET_MINUTES", 0) or 0)
+SESSION_BUDGET_USD = float(os.getenv("SESSION_BUDGET_USD", 0) or 0)
+
+_history_lock = threading.Lock()
+_current_budget = ContextVar("current_budget", default=None)
+
+
+class Budget:
+    """Spending limits for one run; 0 means unlimited. spent_usd is what the session already spent."""
+
+    def __init__(self, max_cost=0.0, max_minutes=0.0, session_max_cost=0.0, spent_usd=0.0):
+        self.max_cost = max_cost
+        self.max_minutes = max_minutes
+        self.session_max_cost = session_max_cost
+        self.spent_usd = spent_usd
+        self.stopped = None
+
+    def cost_limit(self):
+        """The tighter of the run budget and what is left of the session budget, or None."""
+        limits = []
+        if self.max_cost:
+            limits.append(self.max_cost)
+        if self.session_max_cost:
+            limits.append(max(self.session_max_cost - self.spent_usd, 0.0))
+        return min(limits) if limits else None
+
+    def violations(self, estimate):
+        """Returns why an estimate does not fit this budget (empty when it fits)."""
+        reasons = []
+        limit = self.cost_limit()
+        if limit is not None and estimate["cost"] > limit:
+            reasons.append(f"estimated ${estimate['cost']:.2f} exceeds the ${limit:.2f} cost budget")
+        if self.max_minutes and estimate["seconds"] > self.max_minutes * 60:
+            reasons.append(f"estimated {estimate['seconds'] / 60:.1f} min exceeds the {self.max_minutes:g} min time budget")
+        return reasons
+
+
+def load_history(path=None):
+    try:
+        with open(path or HISTORY_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def throughput(model, history=None):
+    """Returns (completion tokens per call, seconds per call) for a model from history or defaults."""
+    stats = (history or {}).get(model)
+    if stats and stats.get("calls"):
+        return stats["completion_tokens"] / stats["calls"], stats["seconds"] / stats["calls"]
+    return DEFAULT_THROUGHPUT.get(model, (1500, 30.0))
+
+
+def update_history(run, path=None):
+    """Folds a finished run's per-call usage and api_call timings into the throughput history."""
+    seconds_by_call = {}
+    for s in run.stages:
+        if s["stage"] == "api_call":
+            key = (s["document"], s["chunk"])
+            seconds_by_call[key] = seconds_by_call.get(key, 0.0) + s["seconds"]
+    totals = {}
+    for u in run.usage:
+        entry = totals.setdefault(u["model"], {"calls": 0, "seconds": 0.0, "completion_tokens": 0})
+        entry["calls"] += 1
+        entry["completion_tokens"] += u["completion_tokens"]
+        entry["seconds"] += seconds_by_call.pop((u["document"], u["chunk"]), 0.0)
+    if not totals:
+        return
+    path = path or HISTORY_PATH
+    with _history_lock:
+        history = load_history(path)
+        for model, new in totals.items():
+            old = history.get(model, {"calls": 0, "seconds": 0.0, "completion_tokens": 0})
+            history[model] = {k: old[k] * HISTORY_DECAY + new[k] for k in new}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(history, f, indent=2)
+        os.replace(tmp, path)
+
+
+def chunk_plan(text, model, prompt_tokens, chunk_chars):
+    """Describes fixed-size chunking of a document in the same shape as strategy.plan_analysis."""
+    calls = max(math.ceil(len(text) / chunk_chars), 1)
+    document_tokens = strategy.count_tokens(text, model)
+    return {
+        "model": model,
+        "strategy": "chunked" if calls > 1 else "whole",
+        "document_tokens": document_tokens,
+        "prompt_tokens": prompt_tokens,
+        "calls": calls,
+        "chunk_chars": chunk_chars,
+        "input_tokens": calls * prompt_tokens + document_tokens,
+    }
+
+
+def estimate_plan(plan, history=None, pause_seconds=0.0, escalation=None, output_scale=1.0):
+    """
+    Estimates calls, tokens, cost and wall time of a plan.
+    escalation=(strong_model, rate) adds the cascade's expected re-analysis of a share of the chunks.
+    output_scale scales the historical output per call (e.g. for the compact table format); generation
+    dominates call time, so seconds per call are scaled the same way.
+    """
+    completion_per_call, seconds_per_call = throughput(plan["model"], history)
+    completion_per_call *= output_scale
+    seconds_per_call *= output_scale
+    output_tokens = int(plan["calls"] * completion_per_call)
+    estimate = {
+        "model": plan["model"],
+        "calls": plan["calls"],
+        "input_tokens": plan["input_tokens"],
+        "output_tokens": output_tokens,
+        "cost": metrics.estimate_cost(plan["model"], plan["input_tokens"], output_tokens),
+        "seconds": plan["calls"] * (seconds_per_call + pause_seconds),
+    }
+    if escalation:
+        strong_model, rate = escalation
+        strong_calls = math.ceil(plan["calls"] * rate)
+        strong_completion, strong_seconds = throughput(strong_model, history)
+        strong_completion *= output_scale
+        strong_seconds *= output_scale
+        strong_input = int(plan["input_tokens"] * strong_calls / plan["calls"])
+        strong_output = int(strong_calls * strong_completion)
+        estimate["calls"] += strong_calls
+        estimate["input_tokens"] += strong_input
+        estimate["output_tokens"] += strong_output
+        estimate["cost"] += metrics.estimate_cost(strong_model, strong_input, strong_output)
+        estimate["seconds"] += strong_calls * strong_seconds
+    return estimate
+
+
+def total(estimates):
+    """Sums per-document estimates into one run estimate."""
+    keys = ("calls", "input_tokens", "output_tokens", "cost", "seconds")
+    return {k: sum(e[k] for e in estimates) for k in keys}
+
+
+def plan_run(documents, options, budget, estimate_document, history=None):
+    """
+    Estimates a run under each option and picks the first that fits the budget.
+    documents is a list of (name, text); options is a list of (label, settings) ordered from the
+    configured settings to the cheapest; estimate_document(text, history=..., **settings) estimates one document.
+    Returns (configured, chosen, reasons): configured and chosen are (label, settings, estimate, per_document)
+    tuples, chosen is None when no option fits, and reasons says why the configured option does not fit.
+    """
+    estimated = []
+    for label, settings in options:
+        per_document = [(name, estimate_document(text, history=history, **settings)) for name, text in documents]
+        estimated.append((label, settings, total([e for _, e in per_document]), per_document))
+    reasons = budget.violations(estimated[0][2])
+    chosen = next((option for option in estimated if not budget.violations(option[2])), None)
+    return estimated[0], chosen, reasons
+
+
+def _describe(estimate):
+    return (f"{estimate['calls']:,} calls, {estimate['input_tokens'] + estimate['output_tokens']:,} tokens, "
+            f"~${estimate['cost']:.2f}, ~{estimate['seconds'] / 60:.1f} min")
+
+
+def render_estimate(st, configured, chosen, reasons):
+    """Shows the pre-flight estimate, and any budget degradation or stop, above the Detect Errors button."""
+    label, _, estimate, per_document = configured
+    st.info(f"🧮 Pre-flight estimate: {_describe(estimate)} (upper bound; reused chunks and boilerplate are not deducted)")
+    with st.expander("Per-document estimate"):
+        st.table([{"Document": name, "Calls": e["calls"], "Tokens": e["input_tokens"] + e["output_tokens"],
+                   "Cost ($)": round(e["cost"], 4), "Minutes": round(e["seconds"] / 60, 1)} for name, e in per_document])
+    if chosen is None:
+        st.error(f"⛔ Over budget even with the cheapest settings: {'; '.join(reasons)}.")
+    elif chosen[0] != label:
+        st.warning(f"💸 Over budget ({'; '.join(reasons)}). This run will use {chosen[0]}: {_describe(chosen[2])}.")
+
+
+_EXAMPLE_RE = re.compile(r"(\*\*Example format.*?```json\s*)(.*?)(\s*```)", re.DOTALL)
+
+
+def compact_prompt(prompt):
+    """Keeps only the first example finding of the prompt's example block, which is most of its tokens."""
+    def shorten(match):
+        body = match.group(2)
+        first_end = body.find("},")
+        if first_end == -1:
+            return match.group(0)
+        return match.group(1) + body[:first_end + 1] + "\n  ]\n}" + match.group(3)
+    return _EXAMPLE_RE.sub(shorten, prompt, count=1)
+
+
+@contextmanager
+def enforce(budget):
+    """Makes budget the current run's budget; within_budget() checks spending against it."""
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def within_budget():
+    """
+    Returns False once the current run has spent its cost or time budget, so callers stop making model calls.
+    The first refusal is recorded on the budget (budget.stopped) and in the run metadata.
+    """
+    budget = _current_budget.get()
+    run = metrics.current_run()
+    if budget is None or run is None:
+        return True
+    limit = budget.cost_limit()
+    if limit is not None and run.total_cost() >= limit:
+        reason = f"stopped after spending ${run.total_cost():.2f} of the ${limit:.2f} budget"
+    elif budget.max_minutes and time.time() - run.started >= budget.max_minutes * 60:
+        reason = f"stopped after the {budget.max_minutes:g} min time budget"
+    else:
+        return True
+    if budget.stopped is None:
+        budget.stopped = reason
+        metrics.record_metadata("budget", reason)
+    return False
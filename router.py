@@ -0,0 +1,234 @@
+"""
+Routes model calls across several API keys and providers.
+
+Keys come from OPENAI_API_KEYS / GOOGLE_API_KEYS (comma-separated), falling back to the single
+OPENAI_API_KEY / GOOGLE_API_KEY. Each key is an endpoint with its own health record: a sliding
+window of outcomes, an EWMA of latency, a circuit breaker and a rate-limit cooldown. Each call goes
+to the healthiest endpoint that is not cooling down, and fails over to the next one on error.
+Calls first take a slot from the fair-share scheduler (scheduler.py), which decides which
+session's call goes next when more calls are made than SCHEDULER_SLOTS.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import scheduler
+
+WINDOW = 20
+MIN_CALLS = 4
+FAILURE_RATE_TO_OPEN = 0.5
+OPEN_SECONDS = 30.0
+MAX_OPEN_SECONDS = 600.0
+LATENCY_EWMA_ALPHA = 0.3
+# How long a call waits for any endpoint to become available before giving up.
+MAX_WAIT_SECONDS = float(os.getenv("ROUTER_MAX_WAIT", 300))
+# Optional per-key request budget per minute (spare quota); 0 disables it.
+REQUESTS_PER_MINUTE = int(os.getenv("ROUTER_RPM", 0))
+
+PROVIDER_ENV = {
+    "openai": ("OPENAI_API_KEYS", "OPENAI_API_KEY"),
+    "gemini": ("GOOGLE_API_KEYS", "GOOGLE_API_KEY"),
+}
+
+
+class RouterExhausted(RuntimeError):
+    """Raised when no endpoint of the allowed providers produced a response."""
+
+
+def is_rate_limit(error):
+    """Recognises OpenAI RateLimitError and Google ResourceExhausted (HTTP 429) without importing either SDK."""
+    return type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests") or getattr(error, "code", None) == 429
+
+
+def _retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Endpoint:
+    """One API key of one provider, with its health record."""
+
+    def __init__(self, provider, api_key, label):
+        self.provider = provider
+        self.api_key = api_key
+        self.label = label
+        self.outcomes = deque(maxlen=WINDOW)
+        self.latency = None
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rate_limits = 0
+        self.state = "closed"
+        self.open_until = 0.0
+        self.open_seconds = OPEN_SECONDS
+        self.cooldown_until = 0.0
+        self.recent_starts = deque()
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def ready_at(self, now):
+        """Earliest time this endpoint may take a call."""
+        ready = max(self.cooldown_until, self.open_until if self.state == "open" else 0.0)
+        if REQUESTS_PER_MINUTE and len(self.recent_starts) >= REQUESTS_PER_MINUTE:
+            ready = max(ready, self.recent_starts[0] + 60.0)
+        return ready
+
+    def score(self):
+        """Lower is healthier: error rate first, then in-flight calls and latency."""
+        return (round(self.error_rate(), 1), self.in_flight, self.latency or 0.0)
+
+
+class Router:
+    """Thread-safe endpoint selection with circuit breaking; one instance per process."""
+
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self.lock = threading.Lock()
+
+    def providers(self):
+        return sorted({e.provider for e in self.endpoints})
+
+    def _acquire(self, providers, exclude, prefer=None):
+        """Picks the preferred or else the healthiest ready endpoint, or returns (None, seconds until one is ready)."""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.provider in providers and e.label not in exclude]
+            if not candidates:
+                return None, None
+            for endpoint in candidates:
+                while endpoint.recent_starts and endpoint.recent_starts[0] <= now - 60.0:
+                    endpoint.recent_starts.popleft()
+                if endpoint.state == "open" and endpoint.open_until <= now:
+                    endpoint.state = "half-open"
+            ready = [e for e in candidates if e.ready_at(now) <= now
+                     and not (e.state == "half-open" and e.in_flight)]
+            if not ready:
+                return None, min(e.ready_at(now) for e in candidates) - now
+            endpoint = next((e for e in ready if e.label == prefer), None) or min(ready, key=Endpoint.score)
+            endpoint.in_flight += 1
+            endpoint.calls += 1
+            endpoint.recent_starts.append(now)
+            return endpoint, 0.0
+
+    def _release(self, endpoint, ok, latency=None, error=None, cooldown=0.0):
+        now = time.monotonic()
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.outcomes.append(ok)
+            if ok:
+                endpoint.latency = latency if endpoint.latency is None else (
+                    LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * endpoint.latency
+                )
+                endpoint.state = "closed"
+                endpoint.open_seconds = OPEN_SECONDS
+                return
+            endpoint.failures += 1
+            if is_rate_limit(error):
+                endpoint.rate_limits += 1
+                endpoint.cooldown_until = now + (_retry_after(error) or cooldown)
+                return
+            failed_probe = endpoint.state == "half-open"
+            tripped = len(endpoint.outcomes) >= MIN_CALLS and endpoint.error_rate() >= FAILURE_RATE_TO_OPEN
+            if failed_probe or tripped:
+                if failed_probe:
+                    endpoint.open_seconds = min(endpoint.open_seconds * 2, MAX_OPEN_SECONDS)
+                endpoint.state = "open"
+                endpoint.open_until = now + endpoint.open_seconds
+
+    def call(self, fn, providers, attempts=3, cooldown=5.0, max_wait=None, on_retry=None, prefer=None):
+        """
+        Calls fn(endpoint) on the healthiest endpoint of the given providers and returns its result.
+        prefer names an endpoint label to use whenever it is ready (e.g. the key that holds a context cache).
+        An endpoint is skipped for the rest of the call once it has failed `attempts` times with
+        non-rate-limit errors; rate-limited endpoints cool down for the Retry-After header or `cooldown` seconds.
+        Waits up to max_wait seconds for an endpoint to become available, then raises RouterExhausted.
+        The call holds a scheduler slot for the current scheduler.job() while it runs, retries included.
+        """
+        with scheduler.shared_scheduler().slot():
+            return self._call(fn, providers, attempts, cooldown, max_wait, on_retry, prefer)
+
+    def _call(self, fn, providers, attempts, cooldown, max_wait, on_retry, prefer):
+        max_wait = MAX_WAIT_SECONDS if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        failures = {}
+        last_error = None
+        while True:
+            exclude = {label for label, count in failures.items() if count >= attempts}
+            endpoint, wait = self._acquire(providers, exclude, prefer)
+            if endpoint is None:
+                if wait is None or time.monotonic() + wait > deadline:
+                    raise RouterExhausted(f"no {'/'.join(providers)} endpoint succeeded: {last_error}")
+                time.sleep(max(wait, 0.05))
+                continue
+            started = time.monotonic()
+            try:
+                result = fn(endpoint)
+            except Exception as e:
+                self._release(endpoint, False, error=e, cooldown=cooldown)
+                if not is_rate_limit(e):
+                    # Rate limits only delay an endpoint; they are bounded by max_wait instead.
+                    failures[endpoint.label] = failures.get(endpoint.label, 0) + 1
+                last_error = f"{endpoint.label}: {e}"
+                if on_retry is not None:
+                    on_retry(endpoint, e)
+                continue
+            self._release(endpoint, True, latency=time.monotonic() - started)
+            return result
+
+    def health(self):
+        """Returns one row per endpoint for display."""
+        with self.lock:
+            return [
+                {
+                    "endpoint": e.label,
+                    "state": e.state,
+                    "calls": e.calls,
+                    "failures": e.failures,
+                    "rate_limits": e.rate_limits,
+                    "error_rate": round(e.error_rate(), 2),
+                    "latency_s": round(e.latency, 2) if e.latency is not None else None,
+                    "in_flight": e.in_flight,
+                }
+                for e in self.endpoints
+            ]
+
+
+def keys_from_env(provider):
+    """Returns the provider's API keys from the plural variable, else the single one."""
+    plural, single = PROVIDER_ENV[provider]
+    keys = [k.strip() for k in os.getenv(plural, "").split(",") if k.strip()]
+    if not keys and os.getenv(single):
+        keys = [os.getenv(single)]
+    return keys
+
+
+def from_env():
+    """Builds a router with one endpoint per configured key; labels show only the key's last 4 characters."""
+    endpoints = []
+    for provider in PROVIDER_ENV:
+        for i, key in enumerate(keys_from_env(provider)):
+            endpoints.append(Endpoint(provider, key, f"{provider}#{i + 1} (…{key[-4:]})"))
+    return Router(endpoints)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_router():
+    """Returns the process-wide router, building it from the environment (and .env) on first use."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            _shared = from_env()
+        return _shared
@@ -0,0 +1,133 @@
+"""
+Fair-share scheduling of model calls across sessions.
+
+Every model call goes through router.call, which first takes one of SCHEDULER_SLOTS process-wide
+slots (default 8; set it to the number of concurrent calls the API keys sustain). When calls wait
+for a slot, the next one is chosen
+1. by lane: interactive before batch; a batch call that has waited BATCH_MAX_WAIT seconds is
+   treated as interactive so batch work is never starved,
+2. across owners (Streamlit sessions, the watch folder, ...) by weighted fair share: the owner that
+   received the least service per unit of weight goes first,
+3. within an owner, shortest job first: calls for the smallest document go first.
+Callers describe their work with `with scheduler.job(owner, size, lane="batch"):`; calls made outside
+a job belong to an anonymous interactive owner. The job queue orders worker jobs the same way.
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+SLOTS = int(os.getenv("SCHEDULER_SLOTS", 8))
+LANES = ("interactive", "batch")
+BATCH_MAX_WAIT = float(os.getenv("SCHEDULER_BATCH_MAX_WAIT", 120))
+# Documents below this many characters (a few pages) are reported as small jobs in the wait metrics.
+SMALL_JOB_CHARS = 20000
+
+
+class Job:
+    """Who a model call is made for: owner, document size in characters, lane and fair-share weight."""
+
+    def __init__(self, owner="anonymous", size=0, lane="interactive", weight=1.0):
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}; expected one of {LANES}")
+        self.owner = owner
+        self.size = size
+        self.lane = lane
+        self.weight = weight if weight > 0 else 1.0
+
+    def size_class(self):
+        return "small" if self.size < SMALL_JOB_CHARS else "large"
+
+
+DEFAULT_JOB = Job()
+_current_job = ContextVar("current_job", default=None)
+
+
+@contextmanager
+def job(owner, size=0, lane="interactive", weight=1.0):
+    """Makes model calls in the block (and in threads started with a copy of this context) belong to one job."""
+    token = _current_job.set(Job(owner, size, lane, weight))
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def current_job():
+    return _current_job.get() or DEFAULT_JOB
+
+
+def session_owner(session_state):
+    """The fair-share owner of a Streamlit session: each browser session gets one equal share."""
+    return session_state.setdefault("scheduler_owner", uuid.uuid4().hex)
+
+
+class FairScheduler:
+    """Grants a bounded number of slots in lane, fair-share and shortest-job order."""
+
+    def __init__(self, slots=SLOTS):
+        self.slots = slots
+        self.busy = 0
+        self.waiting = []
+        self.served = {}  # owner -> service received / weight
+        self.condition = threading.Condition()
+        self._arrivals = itertools.count()
+
+    def _priority(self, ticket, now):
+        job, arrived, order = ticket
+        promoted = job.lane == "interactive" or now - arrived >= BATCH_MAX_WAIT
+        return (0 if promoted else 1, self.served.get(job.owner, 0.0), job.size, order)
+
+    def _activate(self, owner):
+        """An owner that was idle resumes at the least-served active owner's level, so it cannot bank idle time."""
+        active = [self.served.get(j.owner, 0.0) for j, _, _ in self.waiting if j.owner != owner]
+        floor = min(active) if active else 0.0
+        self.served[owner] = max(self.served.get(owner, 0.0), floor)
+
+    def _publish_depth(self):
+        for lane in LANES:
+            metrics.set_queue_depth("calls", lane, sum(1 for j, _, _ in self.waiting if j.lane == lane))
+
+    @contextmanager
+    def slot(self, job=None):
+        """Waits for this job's turn, holds a slot for the block and records the wait."""
+        job = job or current_job()
+        arrived = time.monotonic()
+        ticket = (job, arrived, next(self._arrivals))
+        with self.condition:
+            if not any(j.owner == job.owner for j, _, _ in self.waiting):
+                self._activate(job.owner)
+            self.waiting.append(ticket)
+            self._publish_depth()
+            while self.busy >= self.slots or min(self.waiting, key=lambda t: self._priority(t, time.monotonic())) is not ticket:
+                self.condition.wait(timeout=1.0)  # Timed, so waiting batch calls get promoted.
+            self.waiting.remove(ticket)
+            self.busy += 1
+            self.served[job.owner] = self.served.get(job.owner, 0.0) + 1.0 / job.weight
+            self._publish_depth()
+            self.condition.notify_all()  # The next waiter may fit in a remaining slot.
+        metrics.record_queue_wait("calls", job.lane, job.size_class(), time.monotonic() - arrived)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.busy -= 1
+                self.condition.notify_all()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+    """Returns the process-wide scheduler."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FairScheduler()
+        return _shared
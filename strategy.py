@@ -0,0 +1,98 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+# Context window and maximum output tokens per model.
+MODEL_LIMITS = {
+    "gpt-4o-mini": {"context": 128000, "output": 16384},
+    "gpt-4": {"context": 8192, "output": 8192},
+    "gemini-1.5-pro": {"context": 2097152, "output": 8192},
+    "gemini-1.5-flash": {"context": 1048576, "output": 8192},
+}
+
+# Findings JSON is verbose; budget this many output tokens per input token of document text.
+OUTPUT_TOKENS_PER_INPUT_TOKEN = 0.5
+# Never plan chunks below this many document tokens; smaller chunks waste the prompt overhead.
+MIN_CHUNK_TOKENS = 500
+CHARS_PER_TOKEN_FALLBACK = 4.0
+# Token counts of texts at least this long are kept per content hash, so the pre-flight estimate
+# tokenizes each uploaded document once instead of once per budget option on every rerun.
+COUNT_CACHE_MIN_CHARS = 4096
+COUNT_CACHE_ENTRIES = 512
+
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """
+    Counts tokens locally with tiktoken when installed, else estimates ~4 characters per token.
+    tiktoken counts of long texts are cached by content hash and model.
+    """
+    if len(text) < COUNT_CACHE_MIN_CHARS or not model.startswith("gpt"):
+        return _count_tokens(text, model)
+    key = (hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest(), model)
+    with _counts_lock:
+        if key in _counts:
+            _counts.move_to_end(key)
+            return _counts[key]
+    count = _count_tokens(text, model)
+    with _counts_lock:
+        _counts[key] = count
+        while len(_counts) > COUNT_CACHE_ENTRIES:
+            _counts.popitem(last=False)
+    return count
+
+
+def _count_tokens(text, model):
+    if model.startswith("gpt"):
+        try:
+            import tiktoken
+        except ImportError:
+            pass
+        else:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+            return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN_FALLBACK)
+
+
+def plan_analysis(text, model, prompt_tokens, max_output_tokens=None):
+    """
+    Chooses between a single whole-document call and chunked calls for one model.
+    Chunks are as large as the context window and output limit allow, which minimises calls.
+    max_output_tokens caps the output below the model limit when the caller sends a smaller max_tokens.
+    Returns a dict that is recorded as the run's strategy metadata.
+    """
+    limits = dict(MODEL_LIMITS[model])
+    if max_output_tokens:
+        limits["output"] = min(limits["output"], max_output_tokens)
+    document_tokens = count_tokens(text, model)
+    chars_per_token = len(text) / document_tokens if document_tokens else CHARS_PER_TOKEN_FALLBACK
+
+    # Largest document share per call such that prompt + text + expected output fit the context
+    # and the expected output fits the model's output limit.
+    by_context = (limits["context"] - prompt_tokens) / (1 + OUTPUT_TOKENS_PER_INPUT_TOKEN)
+    by_output = limits["output"] / OUTPUT_TOKENS_PER_INPUT_TOKEN
+    max_chunk_tokens = max(int(min(by_context, by_output)), MIN_CHUNK_TOKENS)
+
+    if document_tokens <= max_chunk_tokens:
+        strategy, calls, chunk_tokens = "whole", 1, document_tokens
+    else:
+        calls = math.ceil(document_tokens / max_chunk_tokens)
+        # Spread the text evenly over the calls instead of leaving a tiny last chunk.
+        strategy, chunk_tokens = "chunked", math.ceil(document_tokens / calls)
+
+    return {
+        "model": model,
+        "strategy": strategy,
+        "document_tokens": document_tokens,
+        "prompt_tokens": prompt_tokens,
+        "calls": calls,
+        "chunk_chars": int(chunk_tokens * chars_per_token),
+        "max_output_tokens": min(limits["output"], math.ceil(chunk_tokens * OUTPUT_TOKENS_PER_INPUT_TOKEN) + 256),
+        "input_tokens": calls * prompt_tokens + document_tokens,
+    }
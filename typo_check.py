@@ -0,0 +1,180 @@
+import hashlib
+import os
+import pickle
+import re
+
+import findings as finding_records
+
+DOMAIN_WORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insurance_words.txt")
+SYSTEM_WORDS = "/usr/share/dict/words"
+# Built indexes are pickled here; the directory must belong to this user and not be writable by others.
+INDEX_DIR = os.getenv("TYPO_INDEX_DIR", "typo_index")
+MAX_EDIT_DISTANCE = 2
+# Only the first PREFIX_LENGTH letters of a word are indexed, as in standard SymSpell; candidates are
+# still checked against the whole word. This keeps the index linear in the dictionary size.
+PREFIX_LENGTH = 7
+MIN_WORD_LENGTH = 5
+
+_WORD_RE = re.compile(r"[A-Za-z]+(?:'[a-z]+)?")
+_SUFFIXES = ("ies", "es", "s", "ed", "ing", "ly", "er", "ers", "ment", "ments", "able", "ion", "ions")
+
+
+def _deletes(word, max_distance):
+    """All strings reachable from word by deleting up to max_distance characters."""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def _edit_distance(a, b, limit):
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, start=1):
+            cost = 0 if ca == cb else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SymSpellIndex:
+    """Symmetric-delete spelling index: every dictionary word is indexed under the deletes of its prefix."""
+
+    def __init__(self, words, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = frozenset(words)
+        self.deletes = {}
+        for word in self.words:
+            for variant in _deletes(word[:prefix_length], max_distance):
+                self.deletes.setdefault(variant, []).append(word)
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def is_known(self, word):
+        if word in self.words:
+            return True
+        return any(word.endswith(s) and word[:-len(s)] in self.words for s in _SUFFIXES)
+
+    def suggest(self, word):
+        """Returns (suggestion, distance) for the closest dictionary word, or None."""
+        best = None
+        seen = set()
+        for variant in _deletes(word[:self.prefix_length], self.max_distance):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = _edit_distance(word, candidate, self.max_distance)
+                if distance > self.max_distance:
+                    continue
+                if best is None or (distance, candidate) < (best[1], best[0]):
+                    best = (candidate, distance)
+        return best
+
+
+def _word_lists():
+    paths = [DOMAIN_WORDS]
+    extra = os.getenv("TYPO_DICTIONARY", SYSTEM_WORDS)
+    paths += [p for p in extra.split(os.pathsep) if p and os.path.exists(p)]
+    return paths
+
+
+def has_full_dictionary():
+    """
+    Whether a general word list (TYPO_DICTIONARY) is installed. insurance_words.txt alone only holds
+    domain terms and would flag ordinary words, so local spelling is offered only with one.
+    """
+    return len(_word_lists()) > 1
+
+
+def _private(path):
+    """True when path belongs to this user and nobody else can write to it, so a pickle in it can be trusted."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    owned = not hasattr(os, "getuid") or stat.st_uid == os.getuid()
+    return owned and not stat.st_mode & 0o022
+
+
+def load_index(paths=None, cache_dir=None):
+    """
+    Loads the SymSpell index for the given word lists, building and pickling it on first use.
+    The pickle is keyed by the word lists' contents so edits to them rebuild it automatically.
+    It is only read from and written to a private cache_dir (default TYPO_INDEX_DIR); otherwise
+    the index is rebuilt in memory.
+    """
+    paths = paths or _word_lists()
+    digest = hashlib.sha256(f"{MAX_EDIT_DISTANCE}/{PREFIX_LENGTH}".encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    cache_dir = cache_dir or INDEX_DIR
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    trusted = _private(cache_dir)
+    cache_path = os.path.join(cache_dir, f"typo_index_{digest.hexdigest()[:16]}.pickle")
+    if trusted and _private(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    words = set()
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            words.update(line.strip().lower() for line in f if line.strip().isalpha())
+    index = SymSpellIndex(words)
+    if trusted:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return index
+
+
+def find_typos(text, index):
+    """
+    Returns spelling findings as findings.Finding records. The readers join pages with plain line
+    breaks, so findings carry the line number and no page number.
+    Only lowercase words of MIN_WORD_LENGTH+ letters are checked, and words that occur more than
+    twice in the document are trusted, which keeps names, acronyms and local jargon from being flagged.
+    """
+    counts = {}
+    for match in _WORD_RE.finditer(text):
+        word = match.group()
+        counts[word] = counts.get(word, 0) + 1
+
+    findings = []
+    suggestions = {}
+    line, position = 1, 0
+    for match in _WORD_RE.finditer(text):
+        word = match.group()
+        if len(word) < MIN_WORD_LENGTH or not word.islower() or counts[word] > 2 or index.is_known(word):
+            continue
+        if word not in suggestions:
+            suggestions[word] = index.suggest(word)
+        if suggestions[word] is None:
+            continue
+        line += text.count("\n", position, match.start())
+        position = match.start()
+        correction = suggestions[word][0]
+        findings.append(finding_records.Finding(
+            Line_Number=line,
+            Error_Type="Typographical Error",
+            Error_Description=f"Misspelled word: '{word}' instead of '{correction}'.",
+            Suggestions=f"Correct '{word}' to '{correction}'.",
+        ))
+    return findings
@@ -0,0 +1,432 @@
+"""
+Watch-folder ingestion: analyzes documents dropped into directories and writes a report for each.
+
+    python watch_folder.py /srv/drop [/srv/drop2 ...] --app STAA --concurrency 2 [--results DIR]
+
+On Linux the directories are watched with inotify (through ctypes, no extra dependency); elsewhere,
+or with --poll, they are rescanned every --poll-seconds. A file is picked up once it has been quiet
+for --debounce seconds with a stable size and mtime, so files still being copied are not read half
+written. Each file goes through the app's read_uploaded_file -> analyze_document ->
+export_errors_to_excel path and its report is written next to it (name.pdf.report.xlsx) or into
+--results, under the file's subdirectory of the watched directory (and that directory's name when
+several are watched).
+A SQLite ledger (WATCH_LEDGER) keeps the content hash of every analyzed file, so restarts, repeated
+events and copies of an already analyzed file do not call the model again; failed files are retried
+on their next change or restart. Model calls run in the scheduler's batch lane (--lane) with
+--weight fair shares, so interactive sessions in the same process go first.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import importlib
+import io
+import os
+import select
+import shutil
+import sqlite3
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cdc
+import metrics
+import scheduler
+import typo_check
+
+LEDGER_PATH = os.getenv("WATCH_LEDGER", "watch_ledger.sqlite3")
+SUFFIXES = (".txt", ".pdf", ".docx", ".xlsx")
+REPORT_SUFFIX = ".report.xlsx"
+DEBOUNCE_SECONDS = 5.0
+POLL_SECONDS = 5.0
+
+# inotify(7) constants.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+
+
+def is_candidate(path):
+    """Documents the apps can parse; reports, hidden, temporary and Office lock files are skipped."""
+    name = os.path.basename(path)
+    return (name.lower().endswith(SUFFIXES) and not name.endswith(REPORT_SUFFIX)
+            and not name.startswith((".", "~$")))
+
+
+def scan_files(directories, recursive=True):
+    """Yields candidate files under the directories."""
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".")] if recursive else []
+            for name in files:
+                path = os.path.join(root, name)
+                if is_candidate(path):
+                    yield path
+
+
+class InotifyWatcher:
+    """Linux inotify through libc; new subdirectories are watched as they appear."""
+
+    def __init__(self, directories, recursive=True):
+        self.directories = list(directories)
+        self.recursive = recursive
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+        for directory in self.directories:
+            self._add_tree(directory)
+
+    def _add_tree(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.paths[wd] = directory
+        if self.recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                    self._add_tree(entry.path)
+
+    def events(self, timeout):
+        """Waits up to timeout seconds and returns the files with write activity."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped by the kernel: fall back to a full scan.
+                paths.extend(scan_files(self.directories, self.recursive))
+                continue
+            directory = self.paths.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                    try:
+                        self._add_tree(path)
+                    except OSError:
+                        continue  # Removed again before it could be watched.
+                    paths.extend(scan_files([path], self.recursive))
+                continue
+            paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: rescans the directories and reports files whose size or mtime changed."""
+
+    def __init__(self, directories, recursive=True, interval=POLL_SECONDS):
+        self.directories = list(directories)
+        self.recursive = recursive
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in scan_files(self.directories, self.recursive):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def events(self, timeout):
+        time.sleep(max(timeout, self.interval))
+        snapshot = self._scan()
+        changed = [path for path, state in snapshot.items() if self.snapshot.get(path) != state]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(directories, recursive=True, poll=False, poll_seconds=POLL_SECONDS):
+    """Returns an inotify watcher on Linux, else (or with poll, or when inotify fails) a polling watcher."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, recursive)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling every {poll_seconds:g}s", flush=True)
+    return PollingWatcher(directories, recursive, poll_seconds)
+
+
+class Debouncer:
+    """Holds files until they have been quiet for `seconds` and their size and mtime stopped changing."""
+
+    def __init__(self, seconds=DEBOUNCE_SECONDS):
+        self.seconds = seconds
+        self.pending = {}  # path -> (last activity, (size, mtime) at last check)
+
+    def touch(self, path):
+        try:
+            stat = os.stat(path)
+            state = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            state = None
+        self.pending[path] = (time.monotonic(), state)
+
+    def ready(self):
+        """Returns files that are quiet and stable, oldest first, without removing them."""
+        now = time.monotonic()
+        ready = []
+        for path, (last, state) in list(self.pending.items()):
+            if now - last < self.seconds:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]  # Deleted or renamed away before it settled.
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != state:
+                # Still changing (e.g. a network copy without inotify events): wait another period.
+                self.pending[path] = (now, current)
+                continue
+            ready.append((last, path))
+        return [path for _, path in sorted(ready)]
+
+    def pop(self, path):
+        self.pending.pop(path, None)
+
+
+class Ledger:
+    """Processed files by path and content hash; shared safely by the processing threads."""
+
+    def __init__(self, path=None):
+        self.path = path or LEDGER_PATH
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY,"
+                " sha256 TEXT NOT NULL,"
+                " size INTEGER,"
+                " mtime_ns INTEGER,"
+                " status TEXT NOT NULL,"
+                " report TEXT,"
+                " findings INTEGER,"
+                " error TEXT,"
+                " processed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256, status)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def unchanged(self, path, size, mtime_ns):
+        """True when path was already analyzed with the same size and mtime (no need to hash it)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT size, mtime_ns FROM files WHERE path = ? AND status = 'done'", (path,)).fetchone()
+        return row is not None and tuple(row) == (size, mtime_ns)
+
+    def lookup(self, path, sha256):
+        """Returns (report, findings) when this path was already analyzed with these bytes, else None."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT report, findings FROM files WHERE path = ? AND sha256 = ? AND status = 'done'", (path, sha256)
+            ).fetchone()
+
+    def report_for(self, sha256):
+        """Returns (report, findings) of an earlier file with the same bytes whose report still exists, or None."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT report, findings FROM files WHERE sha256 = ? AND status = 'done' ORDER BY processed DESC",
+                (sha256,),
+            ).fetchall()
+        return next((row for row in rows if row[0] and os.path.exists(row[0])), None)
+
+    def record(self, path, sha256, size, mtime_ns, status, report=None, findings=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (path, sha256, size, mtime_ns, status, report, findings, error, processed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, sha256, size, mtime_ns, status, report, findings, error, time.time()),
+            )
+
+
+def report_dir(path, directories, results_dir=None):
+    """
+    Directory for a file's report: next to the file, or under results_dir at the file's subdirectory of
+    the watched directory it is in, prefixed by that directory's name when several are watched.
+    """
+    if not results_dir:
+        return os.path.dirname(path)
+    path = os.path.abspath(path)
+    roots = [os.path.abspath(directory) for directory in directories]
+    inside = [root for root in roots if path.startswith(root.rstrip(os.sep) + os.sep)]
+    root = max(inside, key=len) if inside else os.path.dirname(path)
+    relative = os.path.relpath(os.path.dirname(path), root)
+    if len(roots) > 1:
+        relative = os.path.join(os.path.basename(root.rstrip(os.sep)), relative)
+    return os.path.normpath(os.path.join(results_dir, relative))
+
+
+def report_path(path, results_dir=None):
+    """The full file name is kept (a.pdf.report.xlsx) so a.pdf and a.docx do not share a report."""
+    return os.path.join(results_dir or os.path.dirname(path), os.path.basename(path) + REPORT_SUFFIX)
+
+
+def _write_atomic(path, data):
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def process_file(app, path, ledger, results_dir=None, options=None, lane="batch", weight=1.0):
+    """
+    Analyzes one file and writes its report. Returns a short status line, or None when the ledger
+    shows the file's current bytes were already handled.
+    """
+    stat = os.stat(path)
+    if ledger.unchanged(path, stat.st_size, stat.st_mtime_ns):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    previous = ledger.lookup(path, sha256)
+    if previous is not None:
+        # Touched but not changed: remember the new mtime so it is not hashed again.
+        ledger.record(path, sha256, stat.st_size, stat.st_mtime_ns, "done", *previous)
+        return None
+    report = report_path(path, results_dir)
+    os.makedirs(os.path.dirname(report) or ".", exist_ok=True)
+    earlier = ledger.report_for(sha256)
+    if earlier is not None:
+        if os.path.abspath(earlier[0]) != os.path.abspath(report):
+            shutil.copyfile(earlier[0], report)
+        ledger.record(path, sha256, stat.st_size, stat.st_mtime_ns, "done", report, earlier[1])
+        return f"{path}: same content as an earlier file, report copied"
+
+    name = os.path.basename(path)
+    upload = io.BytesIO(data)
+    upload.name = name  # read_uploaded_file dispatches on the upload's name like a Streamlit upload.
+    try:
+        with metrics.track_run() as run:
+            with metrics.stage("read_uploaded_file", document=name):
+                file_content = app.read_uploaded_file(upload)
+            with scheduler.job("watch_folder", len(file_content or ""), lane, weight):
+                found = app.analyze_document(file_content, document=name, **(options or {})) if file_content else []
+            with metrics.stage("export_errors_to_excel"):
+                excel_file = app.export_errors_to_excel([{"Document Name": name, "Error Description": found}])
+        _write_atomic(report, excel_file)
+    except Exception as e:
+        ledger.record(path, sha256, stat.st_size, stat.st_mtime_ns, "failed", error=str(e))
+        return f"{path}: failed: {e}"
+    ledger.record(path, sha256, stat.st_size, stat.st_mtime_ns, "done", report, len(found))
+    return f"{path}: {len(found)} findings, ${run.total_cost():.4f}, report {report}"
+
+
+def watch(directories, app_name="STAA", results_dir=None, concurrency=2, debounce=DEBOUNCE_SECONDS, recursive=True,
+          poll=False, poll_seconds=POLL_SECONDS, options=None, once=False, ledger=None, lane="batch", weight=1.0):
+    """
+    Processes files already in the directories, then new and changed ones as they arrive, with at
+    most `concurrency` files in flight. With once, returns when nothing is pending.
+    """
+    app = importlib.import_module(app_name)
+    ledger = ledger or Ledger()
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+    watcher = None if once else open_watcher(directories, recursive, poll, poll_seconds)
+    pending = Debouncer(debounce)
+    for path in scan_files(directories, recursive):
+        pending.touch(path)  # Catch up on files that arrived while the service was down.
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                for path, future in list(in_flight.items()):
+                    if future.done():
+                        del in_flight[path]
+                        try:
+                            line = future.result()
+                        except Exception as e:  # e.g. the file vanished between the event and the read
+                            line = f"{path}: {e}"
+                        if line:
+                            print(line, flush=True)
+                # Files wait in the debouncer rather than in the pool, so memory stays bounded under bursts.
+                for path in pending.ready():
+                    if len(in_flight) >= concurrency:
+                        break
+                    if path in in_flight:
+                        continue  # Changed while being analyzed: picked up again once this run finishes.
+                    pending.pop(path)
+                    reports = report_dir(path, directories, results_dir)
+                    in_flight[path] = pool.submit(process_file, app, path, ledger, reports, options, lane, weight)
+                if once and not pending.pending and not in_flight:
+                    return
+                timeout = 0.2 if in_flight or pending.pending else 1.0
+                if watcher is None:
+                    time.sleep(timeout)
+                    continue
+                for path in watcher.events(timeout):
+                    if is_candidate(path):
+                        pending.touch(path)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directories", nargs="+")
+    parser.add_argument("--app", choices=["STAA", "STAG"], default="STAA")
+    parser.add_argument("--results", help="directory for reports (default: next to each file)")
+    parser.add_argument("--concurrency", type=int, default=2, help="files analyzed at the same time")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS,
+                        help="seconds a file must be quiet before it is read")
+    parser.add_argument("--no-recursive", action="store_true")
+    parser.add_argument("--poll", action="store_true", help="poll instead of inotify (e.g. for network mounts)")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    parser.add_argument("--once", action="store_true", help="process the current files and exit")
+    parser.add_argument("--reuse-chunks", action="store_true", help="reuse chunk findings across revisions")
+    parser.add_argument("--skip-boilerplate", action="store_true")
+    parser.add_argument("--local-spelling", action="store_true")
+    parser.add_argument("--failover", action="store_true")
+    parser.add_argument("--output-format", choices=["json", "table"], default="json")
+    parser.add_argument("--lane", choices=scheduler.LANES, default="batch", help="scheduler lane for model calls")
+    parser.add_argument("--weight", type=float, default=1.0, help="fair-share weight of the watch folder")
+    args = parser.parse_args()
+    if args.local_spelling and not typo_check.has_full_dictionary():
+        parser.error("--local-spelling needs a general word list (TYPO_DICTIONARY, default /usr/share/dict/words)")
+
+    options = {
+        "chunk_cache": cdc.ChunkResultCache() if args.reuse_chunks else None,
+        "skip_boilerplate": args.skip_boilerplate,
+        "local_spelling": args.local_spelling,
+        "failover": args.failover,
+        "output_format": args.output_format,
+    }
+    try:
+        watch(args.directories, args.app, args.results, args.concurrency, args.debounce, not args.no_recursive,
+              args.poll, args.poll_seconds, options, args.once, lane=args.lane, weight=args.weight)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Analysis worker: pulls chunk jobs from the job queue and runs the existing analyze functions.
+
+Start any number of these, on this machine or others sharing the queue:
+    python worker.py --processes 4 [--queue sqlite:///jobs.sqlite3]
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import cascade
+import cdc
+import job_queue
+import scheduler
+
+POLL_SECONDS = 1.0
+
+
+def run_chunk(payload):
+    """Analyzes one chunk with the app's chunk function and returns findings on document lines."""
+    app = importlib.import_module(payload["app"])
+    options = payload["options"]
+    local_spelling = options.get("local_spelling", False)
+    failover = options.get("failover", False)
+    compact_prompt = options.get("compact_prompt", False)
+    output_format = options.get("output_format", "json")
+    if payload["app"] == "STAG":
+        errors = app.analyze_chunk_with_gemini(payload["chunk"], document=payload["document"],
+                                               chunk_index=payload["chunk_index"], local_spelling=local_spelling,
+                                               failover=failover, compact_prompt=compact_prompt,
+                                               model=options.get("model", "gemini-1.5-pro"), output_format=output_format)
+    else:
+        errors = app.analyze_chunk_with_gpt(payload["chunk"], document=payload["document"],
+                                            chunk_index=payload["chunk_index"], local_spelling=local_spelling,
+                                            failover=failover, compact_prompt=compact_prompt, output_format=output_format)
+        strong_backend = options.get("strong_backend")
+        if strong_backend and cascade.escalation_reasons(payload["chunk"], errors):
+            strong = app.analyze_chunk_with_strong_model(payload["chunk"], strong_backend, document=payload["document"],
+                                                         chunk_index=payload["chunk_index"], local_spelling=local_spelling,
+                                                         compact_prompt=compact_prompt, output_format=output_format)
+            if strong is not None:
+                errors = cascade.merge_findings(errors, strong)
+    if errors is None:
+        raise RuntimeError("no valid model response")
+    return cdc.shift_line_numbers(errors, payload["line_offset"])
+
+
+HANDLERS = {"chunk": run_chunk}
+
+
+def heartbeat(queue, worker_id):
+    """Reports the worker alive every HEARTBEAT_SECONDS, including while a long job is running."""
+    while True:
+        try:
+            queue.heartbeat(worker_id)
+        except Exception:
+            pass  # A busy queue file only delays the next beat.
+        time.sleep(job_queue.HEARTBEAT_SECONDS)
+
+
+def work(queue_url, worker_id, stop_when_idle=False):
+    """Claims and runs jobs until interrupted (or until the queue is empty with stop_when_idle)."""
+    queue = job_queue.open_queue(queue_url)
+    threading.Thread(target=heartbeat, args=(queue, worker_id), daemon=True).start()
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if stop_when_idle:
+                return
+            time.sleep(POLL_SECONDS)
+            continue
+        job_id, kind, payload = job
+        try:
+            # Calls made for the job wait for this process's scheduler slots in the submitter's order.
+            with scheduler.job(**payload.get("job", {"owner": "anonymous"})):
+                result = HANDLERS[kind](payload)
+        except Exception as e:
+            queue.fail(job_id, e, worker_id)
+        else:
+            queue.complete(job_id, result, worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default=job_queue.DEFAULT_URL)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--stop-when-idle", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    host = socket.gethostname()
+    processes = [
+        multiprocessing.Process(target=work, args=(args.queue, f"{host}:{os.getpid()}:{i}", args.stop_when_idle))
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()